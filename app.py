@@ -1,19 +1,37 @@
 import asyncio
+import time
+
 import uvicorn
-from fastapi import FastAPI
-from kink import di
+from fastapi import FastAPI, Request
 
 from app_config import AppConfig
 from core.db_tables import db
+from core.lazy import lazy_di
 from core.logger import logger
 
+SLOW_REQUEST_SECS = 1.0
+
 app = FastAPI(title='Vyapari', description='APIs for Vyapari', version='0.0.1-SNAPSHOT')
 
-app_config = di[AppConfig]
+app_config: AppConfig = lazy_di(AppConfig)
 loop = asyncio.new_event_loop()
 asyncio.set_event_loop(loop)
 
 
+@app.middleware("http")
+async def measure_latency(request: Request, call_next):
+    started = time.perf_counter()
+    response = await call_next(request)
+    elapsed = time.perf_counter() - started
+
+    response.headers['Server-Timing'] = f"app;dur={elapsed * 1000:.1f}"
+    if elapsed > SLOW_REQUEST_SECS:
+        logger.warning(f"Slow request: {request.method} {request.url.path} took {elapsed:.2f}s")
+    else:
+        logger.debug(f"{request.method} {request.url.path} took {elapsed * 1000:.1f}ms")
+    return response
+
+
 @app.get("/")
 async def root():
     return {"message": f"Running Vyapari with {app_config.get_strategy()}"}
@@ -41,12 +59,14 @@ def shutdown_event():
     logger.info("Exited")
 
 
-from webapp import position_router, scheduler_router, order_router, ui_router
+from webapp import position_router, scheduler_router, order_router, ui_router, stream_router, pnl_router
 
 app.include_router(position_router.route)
 app.include_router(scheduler_router.route)
 app.include_router(order_router.route)
 app.include_router(ui_router.route)
+app.include_router(stream_router.route)
+app.include_router(pnl_router.route)
 
 app.add_event_handler("startup", startup_event)
 app.add_event_handler("shutdown", shutdown_event)
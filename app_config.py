@@ -1,9 +1,10 @@
 import importlib
 import threading
+from dataclasses import dataclass
 from datetime import datetime, timedelta
 from enum import Enum
 from time import sleep
-from typing import Optional, Hashable
+from typing import Dict, List, Optional, Hashable
 
 import schedule
 from kink import inject, di
@@ -21,8 +22,16 @@ BEFORE_MARKET_OPEN = '06:30'
 START_TRADING = "08:00"
 STOP_TRADING = "12:00"
 MARKET_CLOSE = "13:00"
+# FMP publishes the end of day bars of the whole market a while after the close
+END_OF_DAY_DATA = "15:00"
 MAX_TIME = "23:59"
 
+# Shared by the jobs of all strategies when more than one strategy is configured
+STRATEGY_WORKERS = 4
+WEEKLY = 'weekly'
+DAILY = 'daily'
+WEEKDAYS = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday']
+
 
 class Frequency(Enum):
     DAILY = 24 * 60 * 60
@@ -33,14 +42,45 @@ class Frequency(Enum):
     HOURLY = 3600
 
 
+@dataclass
+class StrategyConfig:
+    name: str
+    allocation: float = 1.0
+    schedule: str = WEEKLY
+
+
+'''
+Reads the STRATEGIES list of the config, each entry with a name and optionally an allocation (share of the
+portfolio) and a schedule (weekly / daily). Without it, the single STRATEGY gets the whole portfolio
+'''
+def load_strategy_configs() -> List[StrategyConfig]:
+    entries = load_app_variables("STRATEGIES")
+    if not entries:
+        return [StrategyConfig(load_app_variables("STRATEGY"))]
+
+    configs = [StrategyConfig(entry['name'], float(entry.get('allocation', 1.0)), entry.get('schedule', WEEKLY))
+               for entry in entries]
+    names = [config.name for config in configs]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Strategies can only be configured once: {names}")
+    invalid_schedules = [config.name for config in configs if config.schedule not in (WEEKLY, DAILY)]
+    if invalid_schedules:
+        raise ValueError(f"Schedule must be '{WEEKLY}' or '{DAILY}' for: {invalid_schedules}")
+    total_allocation = sum(config.allocation for config in configs)
+    if total_allocation > 1.0001:
+        raise ValueError(f"Strategy allocations add up to {total_allocation:.2f}, more than the portfolio")
+    return configs
+
+
 @inject
 class AppConfig(object):
 
     def __init__(self):
-        self.strategy_name = load_app_variables("STRATEGY")
+        self.strategy_configs: List[StrategyConfig] = load_strategy_configs()
+        self.strategy_name = ', '.join(config.name for config in self.strategy_configs)
         self.adhoc_run: bool = load_app_variables("ADHOC_RUN")
-        strategy_class = getattr(importlib.import_module(f"strategies.{self.strategy_name}"), self.strategy_name)
-        self.strategy = strategy_class()
+        self._strategies: Dict[str, object] = {}
+        self._strategies_lock = threading.Lock()
 
         self.database: Database = di[Database]
         self.order_service: OrderService = di[OrderService]
@@ -48,13 +88,43 @@ class AppConfig(object):
         self.runtime_steps: RuntimeSteps = di[RuntimeSteps]
         self.post_run_steps: PostRunSteps = di[PostRunSteps]
         self.schedule: SafeScheduler = di[SafeScheduler]
+        if len(self.strategy_configs) > 1:
+            # Data, broker and DB clients are DI singletons, so the strategies already share them
+            self.schedule.use_worker_pool(STRATEGY_WORKERS)
         self.schedule.every(Frequency.MIN_1.value).seconds.do(run_threaded, self.register_heartbeat) \
             .tag(JobRunType.HEARTBEAT)
 
     def get_strategy(self):
         return self.strategy_name
 
+    '''
+    The strategy modules pull in the numerical libraries, so a strategy is only imported (and checked for sharing
+    the account) when a job first needs it
+    '''
+    def get_strategy_instance(self, strategy_name: str):
+        with self._strategies_lock:
+            if strategy_name not in self._strategies:
+                config = next(config for config in self.strategy_configs if config.name == strategy_name)
+                strategy_class = _get_strategy_class(strategy_name)
+                self._check_shared_account(strategy_class)
+                strategy = strategy_class()
+                if len(self.strategy_configs) > 1:
+                    strategy.share_account(config.name, config.allocation)
+                else:
+                    strategy.allocation = config.allocation
+                self._strategies[strategy_name] = strategy
+            return self._strategies[strategy_name]
+
+    '''
+    Schedules the jobs and runs the scheduler loop, only app.py calls it (in its own thread)
+    '''
     def start(self):
+        self.schedule_jobs()
+        while True:
+            self.schedule.run_pending()
+            sleep(10)  # change this if any of the above jobs are more frequent
+
+    def schedule_jobs(self):
         logger.info("Scheduling jobs... ")
         self._schedule_rebalance_job()
         self._schedule_weekday_jobs()
@@ -63,10 +133,6 @@ class AppConfig(object):
         logger.info("***** --- All Jobs have been scheduled --- *****")
         [logger.info(s) for s in self.get_all_schedules()]
 
-        while True:
-            self.schedule.run_pending()
-            sleep(10)  # change this if any of the above jobs are more frequent
-
     '''
     Clears only DAILY jobs
     '''
@@ -85,24 +151,27 @@ class AppConfig(object):
         self.cancel()
         self.schedule.clear()
 
+    '''
+    Reschedules the DAILY jobs, they keep running in the loop started by start()
+    '''
     def restart(self):
         logger.info("Restarting scheduler service... ")
         self.cancel()
-        self.start()
+        self.schedule_jobs()
 
     def get_all_schedules(self, tag: Optional[Hashable] = None) -> list[schedule.Job]:
         return self.schedule.get_jobs(tag=tag)
 
-    def initialize_and_run_once(self, sleep_next_x_seconds, until_time):
-        self.init_run()
+    def initialize_and_run_once(self, strategy_name, sleep_next_x_seconds, until_time):
+        self.init_run(strategy_name)
         # self.runtime_steps.run(sleep_next_x_seconds, until_time) # Not needed for long term
-        self.strategy.run(sleep_next_x_seconds, until_time)
+        self.get_strategy_instance(strategy_name).run(sleep_next_x_seconds, until_time)
         return schedule.CancelJob  # Runs once and kills itself
 
-    def init_run(self):
-        logger.info(f"Initializing trader ... Running strategy: {self.strategy_name}")
-        self.pre_run_steps.show_configuration()
-        self.strategy.init_data()  # This runs trading as well
+    def init_run(self, strategy_name):
+        logger.info(f"Initializing trader ... Running strategy: {strategy_name}")
+        self.pre_run_steps.show_configuration(strategy_name)
+        self.get_strategy_instance(strategy_name).init_data()  # This runs trading as well
         self.post_run_steps.run_stats()
 
     def run_before_market_close(self):
@@ -117,15 +186,20 @@ class AppConfig(object):
         logger.info(f"Registering heartbeat ... ")
 
     def _schedule_rebalance_job(self):
-        # Define the job that should run once in many days to rebalance
-        rebalance_job = [
-            (BEFORE_MARKET_OPEN, self.init_run),
-        ]
-
-        # Schedule portfolio rebalance job
-        for time, func, *args in rebalance_job:
-            self.schedule.every().monday.at(time).do(func, *args).tag(JobRunType.STANDARD)  # Weekly: Monday
-            # self.schedule.every(1).month.at(time).do(func, *args).tag(JobRunType.STANDARD) # Monthly
+        for config in self.strategy_configs:
+            # Define the job that should run once in many days to rebalance
+            rebalance_job = [
+                (BEFORE_MARKET_OPEN, self.init_run, config.name),
+            ]
+
+            # Schedule portfolio rebalance job
+            for time, func, *args in rebalance_job:
+                if config.schedule == DAILY:
+                    for day in WEEKDAYS:
+                        getattr(self.schedule.every(), day).at(time).do(func, *args).tag(JobRunType.STANDARD)
+                else:
+                    self.schedule.every().monday.at(time).do(func, *args).tag(JobRunType.STANDARD)  # Weekly: Monday
+                # self.schedule.every(1).month.at(time).do(func, *args).tag(JobRunType.STANDARD) # Monthly
 
     def _schedule_weekday_jobs(self):
 
@@ -135,10 +209,10 @@ class AppConfig(object):
             # (START_TRADING, self.strategy.run, Frequency.MIN_10.value, STOP_TRADING), # Not needed for long term
             # (STOP_TRADING, self.app_config.run_before_market_close), # Needed for day trading
             (MARKET_CLOSE, self.run_after_market_close),
+            (END_OF_DAY_DATA, self.post_run_steps.ingest_end_of_day),
         ]
         # Schedule jobs for all weekdays
-        weekdays = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday']
-        for day in weekdays:
+        for day in WEEKDAYS:
             for time, func, *args in weekday_jobs:
                 getattr(self.schedule.every(), day).at(time).do(func, *args).tag(JobRunType.STANDARD)
 
@@ -158,9 +232,11 @@ class AppConfig(object):
 
             if is_within_trading_window:
                 logger.info("*** Within trading window ***")
-                run_now_jobs.append((at_time, self.initialize_and_run_once, Frequency.MIN_10.value, STOP_TRADING))
+                run_now_jobs.extend((at_time, self.initialize_and_run_once, config.name, Frequency.MIN_10.value,
+                                     STOP_TRADING) for config in self.strategy_configs)
             elif self.adhoc_run:
-                run_now_jobs.append((at_time, self.initialize_and_run_once, Frequency.MIN_10.value, MAX_TIME))
+                run_now_jobs.extend((at_time, self.initialize_and_run_once, config.name, Frequency.MIN_10.value,
+                                     MAX_TIME) for config in self.strategy_configs)
                 logger.info(f"*** Adhoc run flag set to : ***{self.adhoc_run}")
             logger.info(f"Run now jobs start at: {at_time}")
 
@@ -180,6 +256,22 @@ class AppConfig(object):
         else:
             return False
 
+    '''
+    Strategies sharing the account tag their orders and only act on the positions those orders opened (see
+    Strategy.share_account). A strategy that cannot be limited that way would sell the positions of the others,
+    so it can only run alone
+    '''
+    def _check_shared_account(self, strategy_class):
+        if len(self.strategy_configs) < 2:
+            return
+        if getattr(strategy_class, 'trades_whole_portfolio', False) or not hasattr(strategy_class, 'share_account'):
+            raise ValueError(f"{strategy_class.__name__} acts on positions it did not open and cannot share the "
+                             f"account with other strategies, configure it as the only STRATEGY")
+
+
+def _get_strategy_class(strategy_name: str):
+    return getattr(importlib.import_module(f"strategies.{strategy_name}"), strategy_name)
+
 
 def run_threaded(job_func):
     job_thread = threading.Thread(target=job_func)
@@ -0,0 +1,105 @@
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+from typing import Callable, List
+
+import orjson
+import pandas as pd
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from services.bar_schema import BarSchema  # noqa: E402
+from services.fmp_fast import decode_bars  # noqa: E402
+
+'''
+Compares decoding FMP bar payloads the fmp_python way (json -> list of dicts -> DataFrame -> reverse -> index)
+with the FastFmpClient path (orjson -> column arrays -> BarSchema), on synthetic payloads of realistic size.
+
+    python benchmarks/fmp_decode.py                      # 5 years of daily bars and 5 days of 1 min bars
+    python benchmarks/fmp_decode.py --symbols 2000 --daily-rows 252
+'''
+
+
+def daily_payload(rows: int) -> bytes:
+    day = datetime(2024, 1, 2)
+    price = 100.0
+    records = []
+    for _ in range(rows):
+        price *= 1 + random.uniform(-0.03, 0.03)
+        records.append({'date': day.strftime('%Y-%m-%d'), 'open': round(price * 0.99, 2),
+                        'high': round(price * 1.02, 2), 'low': round(price * 0.98, 2), 'close': round(price, 2),
+                        'adjClose': round(price, 2), 'volume': random.randint(100_000, 50_000_000),
+                        'unadjustedVolume': random.randint(100_000, 50_000_000), 'change': 0.42,
+                        'changePercent': 0.42, 'vwap': round(price, 2), 'label': day.strftime('%B %d, %y'),
+                        'changeOverTime': 0.0042})
+        day -= timedelta(days=1)
+    return json.dumps({'symbol': 'TEST', 'historical': records}).encode()
+
+
+def minute_payload(rows: int) -> bytes:
+    minute = datetime(2024, 1, 5, 15, 59)
+    price = 100.0
+    records = []
+    for _ in range(rows):
+        price *= 1 + random.uniform(-0.002, 0.002)
+        records.append({'date': minute.strftime('%Y-%m-%d %H:%M:%S'), 'open': round(price, 2),
+                        'low': round(price * 0.999, 2), 'high': round(price * 1.001, 2), 'close': round(price, 2),
+                        'volume': random.randint(100, 100_000)})
+        minute -= timedelta(minutes=1)
+    return json.dumps(records).encode()
+
+
+def fmp_python_path(payload: bytes, nested: bool) -> pd.DataFrame:
+    records = json.loads(payload)
+    bars = pd.DataFrame(records['historical'] if nested else records)[::-1]
+    bars.set_index('date', inplace=True)
+    return bars
+
+
+def fmp_python_with_schema(payload: bytes, nested: bool) -> pd.DataFrame:
+    return BarSchema.to_bars(fmp_python_path(payload, nested))
+
+
+def fast_path(payload: bytes, nested: bool) -> pd.DataFrame:
+    records = orjson.loads(payload)
+    return BarSchema.from_columns(*decode_bars(records['historical'] if nested else records))
+
+
+def measure(decode: Callable, payloads: List[bytes], nested: bool) -> float:
+    started = time.perf_counter()
+    for payload in payloads:
+        decode(payload, nested)
+    return (time.perf_counter() - started) / len(payloads) * 1000
+
+
+def main(args: List[str] = None):
+    parser = argparse.ArgumentParser(description="Benchmark FMP bar decoding")
+    parser.add_argument('--symbols', type=int, default=200, help="Payloads decoded per path")
+    parser.add_argument('--daily-rows', type=int, default=1260, help="Bars per daily payload")
+    parser.add_argument('--minute-rows', type=int, default=1950, help="Bars per 1 min payload")
+    opts = parser.parse_args(args)
+
+    random.seed(42)
+    for name, payload, nested in [('daily', daily_payload(opts.daily_rows), True),
+                                  ('1min', minute_payload(opts.minute_rows), False)]:
+        payloads = [payload] * opts.symbols
+        # Warm up imports and caches
+        for decode in (fmp_python_path, fmp_python_with_schema, fast_path):
+            decode(payload, nested)
+
+        baseline = measure(fmp_python_path, payloads, nested)
+        with_schema = measure(fmp_python_with_schema, payloads, nested)
+        fast = measure(fast_path, payloads, nested)
+        print(f"{name}: {len(payload) / 1024:.0f} KiB per payload, {opts.symbols} payloads")
+        print(f"  fmp_python path            {baseline:8.2f} ms/payload")
+        print(f"  fmp_python path + schema   {with_schema:8.2f} ms/payload")
+        print(f"  orjson -> columns          {fast:8.2f} ms/payload  ({with_schema / fast:.1f}x)")
+
+
+if __name__ == '__main__':
+    main()
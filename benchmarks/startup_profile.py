@@ -0,0 +1,73 @@
+import argparse
+import os
+import re
+import subprocess
+import sys
+import time
+from typing import Dict, List, Tuple
+
+'''
+Profiles the import of the web app in a fresh interpreter using `python -X importtime`.
+
+    python benchmarks/startup_profile.py                 # import app, show the 25 slowest modules
+    python benchmarks/startup_profile.py --module app_config --runs 5 --budget-secs 1.0
+
+Exits with 1 when the median import time is above the budget, so it can guard a CI step.
+'''
+
+IMPORT_TIME_LINE = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)\s*$')
+HEAVY_MODULES = ['talib', 'finta', 'scipy', 'sklearn', 'tabulate', 'matplotlib', 'mplfinance']
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def profile_import(module: str) -> Tuple[float, Dict[str, Tuple[int, int, int]]]:
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            cwd=ROOT_DIR, capture_output=True, text=True)
+    elapsed = time.perf_counter() - started
+    if result.returncode != 0:
+        sys.stderr.write(result.stderr)
+        raise SystemExit(f"Importing {module} failed")
+
+    # module -> (self us, cumulative us, nesting level)
+    timings: Dict[str, Tuple[int, int, int]] = {}
+    for line in result.stderr.splitlines():
+        match = IMPORT_TIME_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            timings[name] = (int(self_us), int(cumulative_us), (len(indent) - 1) // 2)
+    return elapsed, timings
+
+
+def main(args: List[str] = None):
+    parser = argparse.ArgumentParser(description="Profile the startup imports of the app")
+    parser.add_argument('--module', default='app', help="Module to import (default: app)")
+    parser.add_argument('--runs', type=int, default=3, help="Number of fresh interpreter runs")
+    parser.add_argument('--top', type=int, default=25, help="Number of slowest modules to show")
+    parser.add_argument('--budget-secs', type=float, default=None, help="Fail when the median is above this")
+    opts = parser.parse_args(args)
+
+    runs = [profile_import(opts.module) for _ in range(opts.runs)]
+    wall_times = sorted(elapsed for elapsed, _ in runs)
+    median = wall_times[len(wall_times) // 2]
+    _, timings = runs[-1]
+
+    print(f"import {opts.module}: median {median:.3f}s, min {wall_times[0]:.3f}s, max {wall_times[-1]:.3f}s "
+          f"over {opts.runs} runs, {len(timings)} modules")
+
+    print(f"\n{'Cumulative (ms)':>15} {'Self (ms)':>10}  Module")
+    top_level = [(name, t) for name, t in timings.items() if t[2] == 0]
+    for name, (self_us, cumulative_us, _) in sorted(top_level, key=lambda item: -item[1][1])[:opts.top]:
+        print(f"{cumulative_us / 1000:15.1f} {self_us / 1000:10.1f}  {name}")
+
+    heavy = [name for name in timings if name.split('.')[0] in HEAVY_MODULES]
+    if heavy:
+        print(f"\nHeavy modules imported at startup: {sorted({name.split('.')[0] for name in heavy})}")
+
+    if opts.budget_secs is not None and median > opts.budget_secs:
+        print(f"\nStartup budget exceeded: {median:.3f}s > {opts.budget_secs:.3f}s")
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
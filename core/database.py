@@ -1,13 +1,30 @@
 import datetime
+import threading
 from datetime import date
-from datetime import datetime
-from typing import List
+from datetime import datetime, time, timedelta
+from typing import Dict, List, Optional, Tuple
 
 from kink import inject
 from peewee import fn
 
-from core.db_tables import OrderEntity, PositionEntity, StockEntity, AccountEntity, db
+from core.db_tables import OrderEntity, PositionEntity, StockEntity, AccountEntity, LedgerFillEntity, LotEntity, \
+    TradeEntity, DailyPnlEntity, SymbolPnlEntity, db
 from core.logger import logger
+from core.tracing import span
+
+
+ORDER_CURSOR_FIELDS = ['created_at', 'id']
+LEDGER_ENTITIES = (LedgerFillEntity, LotEntity, TradeEntity, DailyPnlEntity, SymbolPnlEntity)
+
+
+def _order_columns(fields: List[str] = None, required: List[str] = None) -> list:
+    if not fields:
+        return list(OrderEntity._meta.sorted_fields)
+    unknown = [name for name in fields if name not in OrderEntity._meta.fields]
+    if unknown:
+        raise ValueError(f"Unknown order fields: {unknown}")
+    names = list(dict.fromkeys(list(fields) + (required or [])))
+    return [OrderEntity._meta.fields[name] for name in names]
 
 
 @inject
@@ -15,6 +32,9 @@ class Database(object):
 
     def __init__(self):
         self.db = db
+        # Model -> number of writes to its table
+        self._data_versions: Dict[type, int] = {}
+        self._version_lock = threading.Lock()
 
     def wrap(self, func):
         result = None
@@ -31,21 +51,39 @@ class Database(object):
             self.db.close()
             return result
 
+    '''
+    Same as wrap(), for statements that change orders / positions / the account / the ledger. Every write bumps
+    the data version of the `tables` (models) it changes, which response caches use as part of their key
+    '''
+    def write(self, func, *tables: type):
+        with span('db_write'):
+            result = self.wrap(func)
+        with self._version_lock:
+            for table in tables:
+                self._data_versions[table] = self._data_versions.get(table, 0) + 1
+        return result
+
+    '''
+    Changes whenever one of the `tables` (models) is written, a write to any other table leaves it as is
+    '''
+    def data_version(self, *tables: type) -> int:
+        return sum(self._data_versions.get(table, 0) for table in tables)
+
     # *** Ping ***
     def ping(self):
         return self.wrap(lambda: AccountEntity.select().limit(1))
 
     # *** Account ****
     def upsert_account(self, run_date, initial_portfolio_value: float, final_portfolio_value: float):
-        return self.wrap(lambda: AccountEntity.insert(run_date=run_date,
-                                                      initial_portfolio_value=initial_portfolio_value,
-                                                      final_portfolio_value=final_portfolio_value,
-                                                      created_at=datetime.now(),
-                                                      updated_at=datetime.now())
-                         .on_conflict(preserve=[AccountEntity.run_date],
-                                      update={AccountEntity.final_portfolio_value: final_portfolio_value,
-                                              AccountEntity.updated_at: datetime.now()})
-                         .execute())
+        return self.write(lambda: AccountEntity.insert(run_date=run_date,
+                                                       initial_portfolio_value=initial_portfolio_value,
+                                                       final_portfolio_value=final_portfolio_value,
+                                                       created_at=datetime.now(),
+                                                       updated_at=datetime.now())
+                          .on_conflict(preserve=[AccountEntity.run_date],
+                                       update={AccountEntity.final_portfolio_value: final_portfolio_value,
+                                               AccountEntity.updated_at: datetime.now()})
+                          .execute(), AccountEntity)
 
     def get_portfolio_history(self, limit: int = 10) -> List[AccountEntity]:
         return self.wrap(lambda: list(AccountEntity.select().order_by(AccountEntity.created_at.desc()).limit(limit)))
@@ -56,7 +94,8 @@ class Database(object):
                      initial_stop_price: float, updated_stop_price: float, filled_avg_price: float, filled_qty: float,
                      hwm: float, limit_price: float, replaced_by: str, extended_hours: bool, status: str,
                      failed_at: datetime, filled_at: datetime, canceled_at: datetime, expired_at: datetime,
-                     replaced_at: datetime, submitted_at: datetime, created_at: datetime, updated_at: datetime):
+                     replaced_at: datetime, submitted_at: datetime, created_at: datetime, updated_at: datetime,
+                     strategy: str = None):
         insert_stmt = OrderEntity.insert(id=order_id,
                                          parent_id=parent_id,
                                          symbol=symbol,
@@ -76,6 +115,7 @@ class Database(object):
                                          replaced_by=replaced_by,
                                          extended_hours=extended_hours,
                                          status=status,
+                                         strategy=strategy,
 
                                          failed_at=failed_at,
                                          filled_at=filled_at,
@@ -85,7 +125,7 @@ class Database(object):
                                          submitted_at=submitted_at,
                                          created_at=created_at,
                                          updated_at=updated_at)
-        order_object = self.wrap(lambda: insert_stmt.execute())
+        order_object = self.write(lambda: insert_stmt.execute(), OrderEntity)
         return order_object
 
     def update_order(self, order_id: str, updated_stop_price: float, filled_avg_price: float, filled_qty: float,
@@ -93,34 +133,62 @@ class Database(object):
                      replaced_by: str, extended_hours: bool, status: str,
                      failed_at: datetime, filled_at: datetime, canceled_at: datetime,
                      expired_at: datetime, replaced_at: datetime):
-        self.wrap(lambda: OrderEntity.update(updated_stop_price=updated_stop_price,
-                                             filled_avg_price=filled_avg_price,
-                                             filled_qty=filled_qty,
-                                             hwm=hwm,
-                                             replaced_by=replaced_by,
-                                             extended_hours=extended_hours,
-                                             status=status,
-                                             failed_at=failed_at,
-                                             filled_at=filled_at,
-                                             canceled_at=canceled_at,
-                                             expired_at=expired_at,
-                                             replaced_at=replaced_at)
-                  .where(OrderEntity.id == order_id)
-                  .execute())
-
-    def get_open_orders(self) -> List[OrderEntity]:
-        return self.wrap(lambda:
-                         OrderEntity.select().where(
-                             ~(OrderEntity.status << ['canceled', 'rejected', 'filled', 'replaced'])))
+        self.write(lambda: OrderEntity.update(updated_stop_price=updated_stop_price,
+                                              filled_avg_price=filled_avg_price,
+                                              filled_qty=filled_qty,
+                                              hwm=hwm,
+                                              replaced_by=replaced_by,
+                                              extended_hours=extended_hours,
+                                              status=status,
+                                              failed_at=failed_at,
+                                              filled_at=filled_at,
+                                              canceled_at=canceled_at,
+                                              expired_at=expired_at,
+                                              replaced_at=replaced_at)
+                   .where(OrderEntity.id == order_id)
+                   .execute(), OrderEntity)
+
+    def get_open_orders(self, strategy: str = None) -> List[OrderEntity]:
+        query = OrderEntity.select().where(~(OrderEntity.status << ['canceled', 'rejected', 'filled', 'replaced']))
+        if strategy is not None:
+            query = query.where(OrderEntity.strategy == strategy)
+        return self.wrap(lambda: query)
+
+    '''
+    Net filled quantity per symbol of the orders placed by `strategy`: positive for long, negative for short
+    holdings. Symbols the strategy got out of are left out
+    '''
+    def get_strategy_holdings(self, strategy: str) -> Dict[str, int]:
+        rows = self.wrap(lambda: list(OrderEntity
+                                      .select(OrderEntity.symbol, OrderEntity.side, OrderEntity.filled_qty)
+                                      .where(OrderEntity.strategy == strategy, OrderEntity.filled_qty > 0)
+                                      .dicts())) or []
+        holdings: Dict[str, int] = {}
+        for row in rows:
+            side = str(row['side']).lower().split('.')[-1]
+            qty = int(row['filled_qty']) if side == 'buy' else -int(row['filled_qty'])
+            holdings[row['symbol']] = holdings.get(row['symbol'], 0) + qty
+        return {symbol: qty for symbol, qty in holdings.items() if qty != 0}
 
     def get_all_orders(self, for_date: date) -> List[OrderEntity]:
-        return self.wrap(lambda: OrderEntity
-                         .select()
-                         .where(~(OrderEntity.status << ['canceled', 'rejected']),
-                                OrderEntity.updated_at.day == for_date.day,
-                                OrderEntity.updated_at.month == for_date.month,
-                                OrderEntity.updated_at.year == for_date.year)
-                         .order_by(OrderEntity.symbol.asc(), OrderEntity.created_at.asc()))
+        return self.wrap(lambda: self._orders_for_date(OrderEntity.select(), for_date))
+
+    '''
+    Same as get_all_orders(), but only selects `fields` and returns plain dicts instead of model objects
+    '''
+    def get_all_order_rows(self, for_date: date, fields: List[str] = None) -> List[dict]:
+        query = self._orders_for_date(OrderEntity.select(*_order_columns(fields)), for_date)
+        return self.wrap(lambda: list(query.dicts()))
+
+    @staticmethod
+    def _orders_for_date(query, for_date: date):
+        # A range on the column (instead of DAY() / MONTH() / YEAR()) lets MySQL use the updated_at index
+        day_start = datetime.combine(for_date, time.min)
+        return (query
+                .where(~(OrderEntity.status << ['canceled', 'rejected']),
+                       OrderEntity.updated_at >= day_start,
+                       OrderEntity.updated_at < day_start + timedelta(days=1))
+                .order_by(OrderEntity.symbol.asc(), OrderEntity.created_at.asc()))
 
     def get_all_filled_orders_for_date(self, for_date=date.today()) -> List[OrderEntity]:
         return self.wrap(lambda: OrderEntity
@@ -146,8 +214,24 @@ class Database(object):
     def list_orders(self, skip: int = 0, limit: int = 100) -> List[OrderEntity]:
         return self.wrap(lambda: list(OrderEntity.select().offset(skip).limit(limit)))
 
+    '''
+    Keyset pagination on (created_at, id), newest first. Pass the (created_at, id) of the last row of the previous
+    page as `after`; unlike OFFSET, every page is a single index range scan however deep it is
+    '''
+    def list_orders_page(self, after: Optional[Tuple[datetime, str]] = None, limit: int = 100,
+                         fields: List[str] = None) -> List[dict]:
+        query = OrderEntity.select(*_order_columns(fields, required=ORDER_CURSOR_FIELDS))
+        if after is not None:
+            created_at, order_id = after
+            query = query.where((OrderEntity.created_at < created_at) |
+                                ((OrderEntity.created_at == created_at) & (OrderEntity.id < order_id)))
+        return self.wrap(lambda: list(query
+                                      .order_by(OrderEntity.created_at.desc(), OrderEntity.id.desc())
+                                      .limit(limit)
+                                      .dicts()))
+
     def delete_order(self, order_id: str):
-        return self.wrap(lambda: OrderEntity.delete().where(OrderEntity.id == order_id).execute())
+        return self.write(lambda: OrderEntity.delete().where(OrderEntity.id == order_id).execute(), OrderEntity)
 
     # *** Positions ****
     def get_position(self, symbol: str):
@@ -160,7 +244,8 @@ class Database(object):
                                       .offset(0).limit(10)))
 
     def delete_position(self, position_id: int):
-        return self.wrap(lambda: PositionEntity.delete().where(PositionEntity.id == position_id).execute())
+        return self.write(lambda: PositionEntity.delete().where(PositionEntity.id == position_id).execute(),
+                          PositionEntity)
 
     def create_position(self, run_date, symbol: str, side: str, qty: int, entry_price: float,
                         market_price: float, lastday_price: float):
@@ -175,24 +260,24 @@ class Database(object):
             created_at=datetime.now(),
             updated_at=datetime.now()
         )
-        self.wrap(lambda: position_object.save())
+        self.write(lambda: position_object.save(), PositionEntity)
         return position_object
 
     def upsert_position(self, run_date, symbol: str, side: str, qty: int, entry_price: float,
                         market_price: float, lastday_price: float):
-        return self.wrap(lambda: PositionEntity.insert(run_date=run_date,
-                                                       symbol=symbol,
-                                                       side=side,
-                                                       qty=qty,
-                                                       entry_price=entry_price,
-                                                       market_price=market_price,
-                                                       lastday_price=lastday_price,
-                                                       created_at=datetime.now(),
-                                                       updated_at=datetime.now())
-                         .on_conflict(preserve=[PositionEntity.run_date, PositionEntity.symbol, PositionEntity.side],
-                                      update={PositionEntity.market_price: market_price,
-                                              PositionEntity.updated_at: datetime.now()})
-                         .execute())
+        return self.write(lambda: PositionEntity.insert(run_date=run_date,
+                                                        symbol=symbol,
+                                                        side=side,
+                                                        qty=qty,
+                                                        entry_price=entry_price,
+                                                        market_price=market_price,
+                                                        lastday_price=lastday_price,
+                                                        created_at=datetime.now(),
+                                                        updated_at=datetime.now())
+                          .on_conflict(preserve=[PositionEntity.run_date, PositionEntity.symbol, PositionEntity.side],
+                                       update={PositionEntity.market_price: market_price,
+                                               PositionEntity.updated_at: datetime.now()})
+                          .execute(), PositionEntity)
 
     # *** Stock ****
     def create_stock(self, symbol: str, timeframe: str, ohlcv_at: datetime, open: float,
@@ -216,3 +301,100 @@ class Database(object):
                                       .filter(StockEntity.symbol == symbol, StockEntity.timeframe == timeframe)
                                       .between(from_time, to_time)
                                       .order_by(StockEntity.ohlcv_at)))
+
+    # *** Trade ledger ****
+    def get_ledger_fill(self, order_id: str) -> Optional[LedgerFillEntity]:
+        return self.wrap(lambda: LedgerFillEntity.get_or_none(LedgerFillEntity.order_id == order_id))
+
+    def get_open_lots(self, symbol: str) -> List[LotEntity]:
+        return self.wrap(lambda: list(LotEntity.select()
+                                      .where(LotEntity.symbol == symbol)
+                                      .order_by(LotEntity.opened_at.asc(), LotEntity.id.asc())))
+
+    '''
+    Stores the result of matching one fill in a single transaction: the processed fill quantity, the updated
+    (or closed) lots, an optional new lot, the closed trades and their daily / per symbol P/L increments
+    '''
+    def apply_ledger_fill(self, order_id: str, symbol: str, filled_qty: float, filled_avg_price: float,
+                          lot_updates: Dict[int, float], new_lot: Optional[dict], trades: List[dict]):
+        def apply():
+            with self.db.atomic():
+                now = datetime.now()
+                LedgerFillEntity.insert(order_id=order_id, symbol=symbol, filled_qty=filled_qty,
+                                        filled_avg_price=filled_avg_price, updated_at=now) \
+                    .on_conflict(update={LedgerFillEntity.filled_qty: filled_qty,
+                                         LedgerFillEntity.filled_avg_price: filled_avg_price,
+                                         LedgerFillEntity.updated_at: now}) \
+                    .execute()
+
+                for lot_id, qty in lot_updates.items():
+                    if qty == 0:
+                        LotEntity.delete().where(LotEntity.id == lot_id).execute()
+                    else:
+                        LotEntity.update(qty=qty).where(LotEntity.id == lot_id).execute()
+                if new_lot is not None:
+                    LotEntity.insert(**new_lot).execute()
+
+                for trade in trades:
+                    TradeEntity.insert(**trade).execute()
+                    self._add_trade_pnl(trade, now)
+
+        return self.write(apply, *LEDGER_ENTITIES)
+
+    @staticmethod
+    def _add_trade_pnl(trade: dict, now: datetime):
+        realized_pl = round(trade['realized_pl'], 2)
+        win = 1 if realized_pl > 0 else 0
+        DailyPnlEntity.insert(run_date=trade['closed_at'].date(), symbol=trade['symbol'], realized_pl=realized_pl,
+                              trade_count=1, win_count=win, updated_at=now) \
+            .on_conflict(update={DailyPnlEntity.realized_pl: DailyPnlEntity.realized_pl + realized_pl,
+                                 DailyPnlEntity.trade_count: DailyPnlEntity.trade_count + 1,
+                                 DailyPnlEntity.win_count: DailyPnlEntity.win_count + win,
+                                 DailyPnlEntity.updated_at: now}) \
+            .execute()
+        SymbolPnlEntity.insert(symbol=trade['symbol'], realized_pl=realized_pl, trade_count=1, win_count=win,
+                               updated_at=now) \
+            .on_conflict(update={SymbolPnlEntity.realized_pl: SymbolPnlEntity.realized_pl + realized_pl,
+                                 SymbolPnlEntity.trade_count: SymbolPnlEntity.trade_count + 1,
+                                 SymbolPnlEntity.win_count: SymbolPnlEntity.win_count + win,
+                                 SymbolPnlEntity.updated_at: now}) \
+            .execute()
+
+    def clear_ledger(self):
+        def clear():
+            with self.db.atomic():
+                for entity in LEDGER_ENTITIES:
+                    entity.delete().execute()
+
+        return self.write(clear, *LEDGER_ENTITIES)
+
+    def get_all_filled_orders(self) -> List[OrderEntity]:
+        return self.wrap(lambda: list(OrderEntity.select()
+                                      .where(OrderEntity.filled_qty > 0, OrderEntity.filled_at.is_null(False))
+                                      .order_by(OrderEntity.filled_at.asc(), OrderEntity.created_at.asc())))
+
+    def get_daily_pnl(self, for_date: date) -> List[DailyPnlEntity]:
+        return self.wrap(lambda: list(DailyPnlEntity.select()
+                                      .where(DailyPnlEntity.run_date == for_date)
+                                      .order_by(DailyPnlEntity.symbol.asc())))
+
+    def get_daily_pnl_totals(self, limit: int = 30) -> List[dict]:
+        return self.wrap(lambda: list(DailyPnlEntity
+                                      .select(DailyPnlEntity.run_date,
+                                              fn.SUM(DailyPnlEntity.realized_pl).alias('realized_pl'),
+                                              fn.SUM(DailyPnlEntity.trade_count).alias('trade_count'),
+                                              fn.SUM(DailyPnlEntity.win_count).alias('win_count'))
+                                      .group_by(DailyPnlEntity.run_date)
+                                      .order_by(DailyPnlEntity.run_date.desc())
+                                      .limit(limit)
+                                      .dicts()))
+
+    def get_symbol_pnl(self) -> List[SymbolPnlEntity]:
+        return self.wrap(lambda: list(SymbolPnlEntity.select().order_by(SymbolPnlEntity.realized_pl.desc())))
+
+    def get_trades_closed_on(self, for_date: date) -> List[TradeEntity]:
+        day_start = datetime.combine(for_date, time.min)
+        return self.wrap(lambda: list(TradeEntity.select()
+                                      .where(TradeEntity.closed_at >= day_start,
+                                             TradeEntity.closed_at < day_start + timedelta(days=1))
+                                      .order_by(TradeEntity.symbol.asc(), TradeEntity.closed_at.asc())))
@@ -57,6 +57,8 @@ class OrderEntity(BaseModel):
     replaced_by = CharField(max_length=40)
     extended_hours = BooleanField()
     status = CharField(max_length=16)
+    # Strategy that placed the order when several strategies share the account, NULL otherwise
+    strategy = CharField(max_length=40, null=True)
 
     canceled_at = DateTimeField()
     expired_at = DateTimeField()
@@ -67,6 +69,11 @@ class OrderEntity(BaseModel):
 
     class Meta:
         db_table = 'order'
+        indexes = (
+            (('created_at', 'id'), False),  # Keyset pagination
+            (('updated_at',), False),
+            (('strategy',), False),
+        )
 
 
 class PositionEntity(BaseModel):
@@ -99,3 +106,68 @@ class StockEntity(BaseModel):
     class Meta:
         db_table = 'stock'
         primary_key = CompositeKey('symbol', 'timeframe', 'ohlcv_at')
+
+
+'''
+Trade ledger: fills are matched FIFO into round trip trades as they arrive (see TradeLedgerService)
+'''
+class LedgerFillEntity(BaseModel):
+    order_id = FixedCharField(40, primary_key=True)
+    symbol = CharField(max_length=10)
+    filled_qty = DecimalField(12, 4)
+    filled_avg_price = DecimalField(12, 4)
+    updated_at = DateTimeField()
+
+    class Meta:
+        db_table = 'ledger_fill'
+
+
+class LotEntity(BaseModel):
+    symbol = CharField(max_length=10, index=True)
+    qty = DecimalField(12, 4)  # Positive for long, negative for short lots
+    price = DecimalField(12, 4)
+    order_id = FixedCharField(40)
+    opened_at = DateTimeField()
+
+    class Meta:
+        db_table = 'lot'
+
+
+class TradeEntity(BaseModel):
+    symbol = CharField(max_length=10)
+    side = CharField(max_length=5)
+    qty = DecimalField(12, 4)
+    entry_price = DecimalField(12, 4)
+    exit_price = DecimalField(12, 4)
+    realized_pl = DecimalField(12, 2)
+    entry_order_id = FixedCharField(40)
+    exit_order_id = FixedCharField(40)
+    opened_at = DateTimeField()
+    closed_at = DateTimeField(index=True)
+
+    class Meta:
+        db_table = 'trade'
+
+
+class DailyPnlEntity(BaseModel):
+    run_date = DateField()
+    symbol = CharField(max_length=10)
+    realized_pl = DecimalField(12, 2)
+    trade_count = IntegerField()
+    win_count = IntegerField()
+    updated_at = DateTimeField()
+
+    class Meta:
+        db_table = 'daily_pnl'
+        primary_key = CompositeKey('run_date', 'symbol')
+
+
+class SymbolPnlEntity(BaseModel):
+    symbol = CharField(max_length=10, primary_key=True)
+    realized_pl = DecimalField(12, 2)
+    trade_count = IntegerField()
+    win_count = IntegerField()
+    updated_at = DateTimeField()
+
+    class Meta:
+        db_table = 'symbol_pnl'
@@ -0,0 +1,39 @@
+import threading
+from typing import Type, TypeVar, cast
+
+from kink import di
+
+T = TypeVar('T')
+
+
+class LazyService(object):
+    """
+    Stands in for `di[service]` until the first attribute access. Module level singletons (routers, app.py) can
+    be declared at import time without building the service, and the broker / DB clients behind it.
+    """
+
+    def __init__(self, service: Type):
+        object.__setattr__(self, '_service', service)
+        object.__setattr__(self, '_instance', None)
+        object.__setattr__(self, '_lock', threading.Lock())
+
+    def resolve(self):
+        if self._instance is None:
+            with self._lock:
+                if self._instance is None:
+                    object.__setattr__(self, '_instance', di[self._service])
+        return self._instance
+
+    def __getattr__(self, name):
+        return getattr(self.resolve(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self.resolve(), name, value)
+
+    def __repr__(self):
+        state = 'resolved' if self._instance is not None else 'unresolved'
+        return f"<LazyService {self._service.__name__} ({state})>"
+
+
+def lazy_di(service: Type[T]) -> T:
+    return cast(T, LazyService(service))
@@ -1,10 +1,16 @@
+import atexit
 import logging
 import os
+import queue
 import sys
-from logging.handlers import TimedRotatingFileHandler
+from logging.handlers import TimedRotatingFileHandler, QueueHandler, QueueListener
 
 logger = logging.getLogger("__name__")
 
+# Rows / columns of a DataFrame rendered into a log line
+DF_LOG_MAX_ROWS = 10
+DF_LOG_MAX_COLUMNS = 12
+
 # Create a formatter
 formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(filename)s:%(lineno)d - %(message)s')
 
@@ -20,9 +26,56 @@ file_handler = TimedRotatingFileHandler(filename=log_file_path, when='midnight',
 console_handler.setFormatter(formatter)
 file_handler.setFormatter(formatter)
 
-# Add the console handler to the logger
-logger.addHandler(console_handler)
-logger.addHandler(file_handler)
+
+class DeferredQueueHandler(QueueHandler):
+    """
+    The stock QueueHandler formats the message in the logging thread. The queue never leaves the process, so the
+    record is handed over as is and the message (e.g. a DataFrame) is only rendered by the listener thread.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+# The logging threads only enqueue records, formatting and console / file I/O happen on the listener thread
+log_queue = queue.SimpleQueue()
+queue_listener = QueueListener(log_queue, console_handler, file_handler, respect_handler_level=True)
+logger.addHandler(DeferredQueueHandler(log_queue))
+queue_listener.start()
+
+# Flush whatever is still queued on exit
+atexit.register(queue_listener.stop)
 
 # Set loglevel
-logger.setLevel(logging.INFO)
+logger.setLevel(os.environ.get('LOG_LEVEL', 'INFO').upper())
+
+
+class _FrameText(object):
+    """
+    Renders a DataFrame when the log record is formatted. Only the first or last `max_rows` rows are kept (as a
+    copy, so later changes to the frame do not show up in the log).
+    """
+
+    def __init__(self, df, max_rows: int, max_columns: int, head: bool):
+        self.total_rows = len(df)
+        self.df = (df.head(max_rows) if head else df.tail(max_rows)).copy()
+        self.max_columns = max_columns
+        self.head = head
+
+    def __str__(self) -> str:
+        text = self.df.to_string(max_cols=self.max_columns)
+        if self.total_rows > len(self.df):
+            more = f"... {self.total_rows - len(self.df)} more rows"
+            text = f"{text}\n{more}" if self.head else f"{more}\n{text}"
+        return text
+
+
+'''
+Logs the tail of a DataFrame, or its head with `head=True` (ranked frames, best first). Nothing is copied or
+rendered unless the level is enabled
+'''
+def log_frame(title: str, df, level: int = logging.DEBUG, max_rows: int = DF_LOG_MAX_ROWS,
+              max_columns: int = DF_LOG_MAX_COLUMNS, head: bool = False) -> None:
+    if df is None or not logger.isEnabledFor(level):
+        return
+    logger.log(level, "%s\n%s", title, _FrameText(df, max_rows, max_columns, head), stacklevel=2)
@@ -0,0 +1,29 @@
+import threading
+import time
+from collections import deque
+
+
+class RateLimiter(object):
+    """
+    Thread safe sliding window rate limiter. `acquire()` blocks the calling thread until a call is allowed,
+    so a pool of workers can share one limiter and stay within a broker / data provider quota.
+    """
+
+    def __init__(self, max_calls: int, period_secs: float):
+        self.max_calls = max_calls
+        self.period_secs = period_secs
+        self._calls = deque()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                while self._calls and now - self._calls[0] >= self.period_secs:
+                    self._calls.popleft()
+
+                if len(self._calls) < self.max_calls:
+                    self._calls.append(now)
+                    return
+                wait_secs = self.period_secs - (now - self._calls[0])
+            time.sleep(wait_secs)
@@ -1,11 +1,21 @@
+import cProfile
+import concurrent.futures
 import datetime
+import os
+import threading
 from enum import Enum
 from traceback import format_exc
+from typing import Dict, List, Optional, Set
 
 from kink import inject
 from schedule import Scheduler
 
-from core.logger import logger
+from core.logger import logger, logs_folder
+from core.tracing import trace
+
+PROFILES_FOLDER = os.path.join(logs_folder, 'profiles')
+# Oldest profiles are deleted beyond this count
+MAX_PROFILES = 50
 
 
 class JobRunType(Enum):
@@ -22,6 +32,12 @@ class SafeScheduler(Scheduler):
     next run time, and keeps going.
     Use this to run jobs that may or may not crash without worrying about
     whether other jobs will run or if they'll crash the entire script.
+
+    The next runs of a job can be profiled with cProfile (see profile_next), the stats are written to
+    logs/profiles as .pstats files.
+
+    With a worker pool (see use_worker_pool) due jobs run on the pool, so the ticks of several strategies do not
+    wait for each other. A job that is still running is not started again.
     """
 
     def __init__(self, reschedule_on_failure=True):
@@ -31,11 +47,62 @@ class SafeScheduler(Scheduler):
         on the next run_pending() tick.
         """
         self.reschedule_on_failure = reschedule_on_failure
+        # job name -> number of runs still to profile
+        self._profile_runs: Dict[str, int] = {}
+        self._profile_lock = threading.Lock()
+        self._worker_pool: Optional[concurrent.futures.ThreadPoolExecutor] = None
+        self._running_jobs: Set = set()
+        self._running_lock = threading.Lock()
+        # Pooled jobs cancel themselves (CancelJob, until()) on the pool threads while run_pending walks the jobs
+        self._jobs_lock = threading.RLock()
         super().__init__()
 
+    def run_pending(self):
+        with self._jobs_lock:
+            runnable_jobs = sorted(job for job in self.jobs if job.should_run)
+        for job in runnable_jobs:
+            self._run_job(job)
+
+    def cancel_job(self, job) -> None:
+        with self._jobs_lock:
+            super().cancel_job(job)
+
+    def clear(self, tag=None) -> None:
+        with self._jobs_lock:
+            super().clear(tag)
+
+    def use_worker_pool(self, max_workers: int) -> None:
+        if self._worker_pool is None:
+            self._worker_pool = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers,
+                                                                      thread_name_prefix='job')
+
     def _run_job(self, job):
+        if self._worker_pool is None:
+            self._run_job_now(job)
+            return
+
+        with self._running_lock:
+            if job in self._running_jobs:
+                logger.debug(f"Skipping {_job_name(job)}, its previous run has not finished yet")
+                return
+            self._running_jobs.add(job)
+        self._worker_pool.submit(self._run_pooled, job)
+
+    def _run_pooled(self, job):
         try:
-            super()._run_job(job)
+            self._run_job_now(job)
+        finally:
+            with self._running_lock:
+                self._running_jobs.discard(job)
+
+    def _run_job_now(self, job):
+        job_name = _job_name(job)
+        try:
+            with trace(job_name):
+                if self._take_profile_run(job_name):
+                    self._run_profiled(job, job_name)
+                else:
+                    super()._run_job(job)
         except Exception:
             logger.error(format_exc())
             job.last_run = datetime.datetime.now()
@@ -46,3 +113,88 @@ class SafeScheduler(Scheduler):
             .seconds.until(run_until) \
             .do(job) \
             .tag(frequency_tag.value)
+
+    def job_names(self) -> List[str]:
+        with self._jobs_lock:
+            jobs = list(self.jobs)
+        return sorted({_job_name(job) for job in jobs})
+
+    '''
+    Profiles the next `runs` executions of the job. Only the scheduler thread is profiled, work the job hands to
+    a thread pool shows up as time waiting on it
+    '''
+    def profile_next(self, job_name: str, runs: int = 1) -> Dict[str, int]:
+        if job_name not in self.job_names():
+            raise ValueError(f"No scheduled job named {job_name}")
+        with self._profile_lock:
+            self._profile_runs[job_name] = runs
+            logger.info(f"Profiling the next {runs} run(s) of {job_name}")
+            return dict(self._profile_runs)
+
+    def cancel_profiling(self, job_name: str = None) -> Dict[str, int]:
+        with self._profile_lock:
+            if job_name is None:
+                self._profile_runs.clear()
+            else:
+                self._profile_runs.pop(job_name, None)
+            return dict(self._profile_runs)
+
+    def pending_profiles(self) -> Dict[str, int]:
+        with self._profile_lock:
+            return dict(self._profile_runs)
+
+    def _take_profile_run(self, job_name: str) -> bool:
+        with self._profile_lock:
+            remaining = self._profile_runs.get(job_name, 0)
+            if remaining <= 0:
+                return False
+            if remaining == 1:
+                del self._profile_runs[job_name]
+            else:
+                self._profile_runs[job_name] = remaining - 1
+            return True
+
+    def _run_profiled(self, job, job_name: str):
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            super()._run_job(job)
+        finally:
+            profiler.disable()
+            os.makedirs(PROFILES_FOLDER, exist_ok=True)
+            file_name = f"{job_name}-{datetime.datetime.now():%Y%m%d-%H%M%S}.pstats"
+            profiler.dump_stats(os.path.join(PROFILES_FOLDER, file_name))
+            logger.info(f"Profile of {job_name} written to {file_name}")
+            _prune_profiles()
+
+
+def list_profiles() -> List[Dict]:
+    if not os.path.isdir(PROFILES_FOLDER):
+        return []
+    profiles = []
+    for entry in os.scandir(PROFILES_FOLDER):
+        if entry.is_file() and entry.name.endswith('.pstats'):
+            stat = entry.stat()
+            profiles.append({'name': entry.name, 'size': stat.st_size,
+                             'created_at': datetime.datetime.fromtimestamp(stat.st_mtime)})
+    return sorted(profiles, key=lambda profile: profile['created_at'], reverse=True)
+
+
+def _prune_profiles():
+    for profile in list_profiles()[MAX_PROFILES:]:
+        os.remove(os.path.join(PROFILES_FOLDER, profile['name']))
+
+
+def _job_name(job) -> str:
+    # schedule wraps the job function in a functools.partial that keeps its name
+    name = getattr(job.job_func, '__qualname__', None) or getattr(job.job_func, '__name__', None) or repr(job)
+    # The same function scheduled for several strategies is told apart by its arguments. Callables (e.g. the
+    # bound method run_threaded starts) go by their name, their repr holds an address that changes every run
+    args = getattr(job.job_func, 'args', ())
+    return f"{name}[{', '.join(_arg_name(arg) for arg in args)}]" if args else name
+
+
+def _arg_name(arg) -> str:
+    if callable(arg):
+        return getattr(arg, '__qualname__', None) or str(arg)
+    return str(arg)
@@ -0,0 +1,167 @@
+import argparse
+import atexit
+import contextvars
+import functools
+import glob
+import json
+import logging
+import math
+import os
+import queue
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import date, datetime
+from logging.handlers import TimedRotatingFileHandler, QueueListener
+from typing import Dict, List, Optional, Tuple
+
+from core.logger import DeferredQueueHandler, logs_folder
+
+'''
+Structured event log: every scheduler job run gets a trace id, and the stages it goes through (data fetch,
+indicators, order submission, DB writes) are written as JSON lines with their duration to logs/events.jsonl.
+
+    with trace("ORBStrategy._run_singular"):
+        with span("data_fetch", symbol="AAPL"):
+            ...
+
+Per stage latency percentiles of a day:
+
+    python -m core.tracing --date 2024-03-18 [--job ORBStrategy._run_singular]
+
+The trace id lives in a context variable, so work handed to a thread pool only carries it when submitted through
+contextvars.copy_context().run.
+'''
+
+EVENTS_FILE = os.path.join(logs_folder, 'events.jsonl')
+PERCENTILES = [50, 90, 99]
+
+_current_trace: contextvars.ContextVar = contextvars.ContextVar('trace', default=None)
+
+event_logger = logging.getLogger("events")
+event_logger.propagate = False
+event_logger.setLevel(logging.INFO)
+
+_events_handler = TimedRotatingFileHandler(filename=EVENTS_FILE, when='midnight', interval=1, backupCount=14)
+_events_handler.setFormatter(logging.Formatter('%(message)s'))
+_events_queue = queue.SimpleQueue()
+_events_listener = QueueListener(_events_queue, _events_handler)
+event_logger.addHandler(DeferredQueueHandler(_events_queue))
+_events_listener.start()
+atexit.register(_events_listener.stop)
+
+
+class _JsonLine(object):
+    # Serialized by the listener thread, when the record is written
+    def __init__(self, event: dict):
+        self.event = event
+
+    def __str__(self) -> str:
+        return json.dumps(self.event, default=str)
+
+
+def current_trace_id() -> Optional[str]:
+    trace_ctx = _current_trace.get()
+    return trace_ctx[0] if trace_ctx else None
+
+
+def emit(event: str, **fields) -> None:
+    trace_ctx = _current_trace.get()
+    record = {'ts': datetime.now().isoformat(timespec='milliseconds'), 'event': event,
+              'trace_id': trace_ctx[0] if trace_ctx else None, 'job': trace_ctx[1] if trace_ctx else None}
+    record.update(fields)
+    event_logger.info("%s", _JsonLine(record))
+
+
+@contextmanager
+def span(stage: str, **attrs):
+    started = time.perf_counter()
+    status = 'ok'
+    try:
+        yield
+    except BaseException as ex:
+        status = type(ex).__name__
+        raise
+    finally:
+        emit('span', stage=stage, duration_ms=round((time.perf_counter() - started) * 1000, 3), status=status,
+             **attrs)
+
+
+'''
+Starts a new trace for a job run. The job itself is recorded as a span of stage "job"
+'''
+@contextmanager
+def trace(job: str):
+    token = _current_trace.set((uuid.uuid4().hex[:16], job))
+    try:
+        with span('job'):
+            yield
+    finally:
+        _current_trace.reset(token)
+
+
+def traced(stage: str):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(stage, name=func.__qualname__):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _read_spans(events_file: str, for_date: date, job: Optional[str]) -> List[dict]:
+    day = for_date.isoformat()
+    spans = []
+    for path in sorted(glob.glob(f"{events_file}*")):
+        with open(path) as file:
+            for line in file:
+                if not line.startswith('{'):
+                    continue
+                event = json.loads(line)
+                if event.get('event') == 'span' and event['ts'].startswith(day) \
+                        and (job is None or event.get('job') == job):
+                    spans.append(event)
+    return spans
+
+
+def _percentile(sorted_values: List[float], pct: int) -> float:
+    # Nearest rank
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def summarize(spans: List[dict]) -> List[Tuple[str, str, int, Dict[int, float], float]]:
+    durations: Dict[Tuple[str, str], List[float]] = {}
+    for event in spans:
+        durations.setdefault((event.get('job') or '-', event['stage']), []).append(float(event['duration_ms']))
+
+    summary = []
+    for (job, stage), values in sorted(durations.items()):
+        values.sort()
+        summary.append((job, stage, len(values), {pct: _percentile(values, pct) for pct in PERCENTILES},
+                        values[-1]))
+    return summary
+
+
+def main(args: List[str] = None):
+    parser = argparse.ArgumentParser(description="Per stage latency percentiles from the event log")
+    parser.add_argument('--date', default=date.today().isoformat(), help="Day to aggregate (YYYY-MM-DD)")
+    parser.add_argument('--job', default=None, help="Only spans of this job")
+    parser.add_argument('--file', default=EVENTS_FILE, help="Event log (rotated files are read as well)")
+    opts = parser.parse_args(args)
+
+    spans = _read_spans(opts.file, datetime.strptime(opts.date, '%Y-%m-%d').date(), opts.job)
+    if not spans:
+        print(f"No spans found for {opts.date}")
+        return
+
+    header = ''.join(f"{f'p{pct} (ms)':>12}" for pct in PERCENTILES)
+    print(f"{'Job':<40} {'Stage':<15} {'Count':>7}{header}{'max (ms)':>12}")
+    for job, stage, count, percentiles, max_ms in summarize(spans):
+        values = ''.join(f"{percentiles[pct]:12.1f}" for pct in PERCENTILES)
+        print(f"{job[:40]:<40} {stage:<15} {count:>7}{values}{max_ms:12.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -59,6 +59,7 @@ CREATE TABLE `order` (
   `replaced_by` varchar(40) COLLATE utf8mb4_unicode_ci DEFAULT NULL,
   `extended_hours` tinyint DEFAULT NULL,
   `status` varchar(16) COLLATE utf8mb4_unicode_ci NOT NULL,
+  `strategy` varchar(40) COLLATE utf8mb4_unicode_ci DEFAULT NULL,
   `filled_avg_price` decimal(10,2) DEFAULT NULL,
   `filled_qty` decimal(10,2) DEFAULT NULL,
   `failed_at` timestamp NULL DEFAULT NULL,
@@ -69,7 +70,10 @@ CREATE TABLE `order` (
   `submitted_at` timestamp NULL DEFAULT NULL,
   `created_at` timestamp NOT NULL,
   `updated_at` timestamp NOT NULL,
-  PRIMARY KEY (`id`)
+  PRIMARY KEY (`id`),
+  KEY `order_created_at_id` (`created_at`,`id`),
+  KEY `order_updated_at` (`updated_at`),
+  KEY `order_strategy` (`strategy`)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
 /*!40101 SET character_set_client = @saved_cs_client */;
 
@@ -114,6 +118,100 @@ CREATE TABLE `stock` (
   PRIMARY KEY (`symbol`,`timeframe`,`ohlcv_at`)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
 /*!40101 SET character_set_client = @saved_cs_client */;
+--
+-- Table structure for table `ledger_fill`
+--
+
+DROP TABLE IF EXISTS `ledger_fill`;
+/*!40101 SET @saved_cs_client     = @@character_set_client */;
+/*!50503 SET character_set_client = utf8mb4 */;
+CREATE TABLE `ledger_fill` (
+  `order_id` varchar(40) COLLATE utf8mb4_unicode_ci NOT NULL,
+  `symbol` varchar(10) COLLATE utf8mb4_unicode_ci NOT NULL,
+  `filled_qty` decimal(12,4) NOT NULL,
+  `filled_avg_price` decimal(12,4) NOT NULL,
+  `updated_at` timestamp NOT NULL,
+  PRIMARY KEY (`order_id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+/*!40101 SET character_set_client = @saved_cs_client */;
+
+--
+-- Table structure for table `lot`
+--
+
+DROP TABLE IF EXISTS `lot`;
+/*!40101 SET @saved_cs_client     = @@character_set_client */;
+/*!50503 SET character_set_client = utf8mb4 */;
+CREATE TABLE `lot` (
+  `id` int NOT NULL AUTO_INCREMENT,
+  `symbol` varchar(10) COLLATE utf8mb4_unicode_ci NOT NULL,
+  `qty` decimal(12,4) NOT NULL,
+  `price` decimal(12,4) NOT NULL,
+  `order_id` varchar(40) COLLATE utf8mb4_unicode_ci NOT NULL,
+  `opened_at` timestamp NOT NULL,
+  PRIMARY KEY (`id`),
+  KEY `lot_symbol` (`symbol`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+/*!40101 SET character_set_client = @saved_cs_client */;
+
+--
+-- Table structure for table `trade`
+--
+
+DROP TABLE IF EXISTS `trade`;
+/*!40101 SET @saved_cs_client     = @@character_set_client */;
+/*!50503 SET character_set_client = utf8mb4 */;
+CREATE TABLE `trade` (
+  `id` int NOT NULL AUTO_INCREMENT,
+  `symbol` varchar(10) COLLATE utf8mb4_unicode_ci NOT NULL,
+  `side` varchar(5) COLLATE utf8mb4_unicode_ci NOT NULL,
+  `qty` decimal(12,4) NOT NULL,
+  `entry_price` decimal(12,4) NOT NULL,
+  `exit_price` decimal(12,4) NOT NULL,
+  `realized_pl` decimal(12,2) NOT NULL,
+  `entry_order_id` varchar(40) COLLATE utf8mb4_unicode_ci NOT NULL,
+  `exit_order_id` varchar(40) COLLATE utf8mb4_unicode_ci NOT NULL,
+  `opened_at` timestamp NOT NULL,
+  `closed_at` timestamp NOT NULL,
+  PRIMARY KEY (`id`),
+  KEY `trade_closed_at` (`closed_at`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+/*!40101 SET character_set_client = @saved_cs_client */;
+
+--
+-- Table structure for table `daily_pnl`
+--
+
+DROP TABLE IF EXISTS `daily_pnl`;
+/*!40101 SET @saved_cs_client     = @@character_set_client */;
+/*!50503 SET character_set_client = utf8mb4 */;
+CREATE TABLE `daily_pnl` (
+  `run_date` date NOT NULL,
+  `symbol` varchar(10) COLLATE utf8mb4_unicode_ci NOT NULL,
+  `realized_pl` decimal(12,2) NOT NULL,
+  `trade_count` int NOT NULL,
+  `win_count` int NOT NULL,
+  `updated_at` timestamp NOT NULL,
+  PRIMARY KEY (`run_date`,`symbol`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+/*!40101 SET character_set_client = @saved_cs_client */;
+
+--
+-- Table structure for table `symbol_pnl`
+--
+
+DROP TABLE IF EXISTS `symbol_pnl`;
+/*!40101 SET @saved_cs_client     = @@character_set_client */;
+/*!50503 SET character_set_client = utf8mb4 */;
+CREATE TABLE `symbol_pnl` (
+  `symbol` varchar(10) COLLATE utf8mb4_unicode_ci NOT NULL,
+  `realized_pl` decimal(12,2) NOT NULL,
+  `trade_count` int NOT NULL,
+  `win_count` int NOT NULL,
+  `updated_at` timestamp NOT NULL,
+  PRIMARY KEY (`symbol`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+/*!40101 SET character_set_client = @saved_cs_client */;
 /*!40103 SET TIME_ZONE=@OLD_TIME_ZONE */;
 
 /*!40101 SET SQL_MODE=@OLD_SQL_MODE */;
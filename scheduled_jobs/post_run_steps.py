@@ -4,6 +4,9 @@ from kink import di, inject
 from core.logger import logger
 from services.account_service import AccountService
 from services.broker_service import Broker
+from services.data_service import DataService
+from services.feature_store import FeatureStore
+from services.history_store import HistoryStore, last_completed_trading_day
 from services.notification_service import Notification
 
 
@@ -14,6 +17,9 @@ class PostRunSteps(object):
         self.account_service: AccountService = di[AccountService]
         self.notification: Notification = di[Notification]
         self.broker = di[Broker]
+        self.data_service: DataService = di[DataService]
+        self.history_store: HistoryStore = di[HistoryStore]
+        self.feature_store: FeatureStore = di[FeatureStore]
 
     def run_stats(self):
         total_unrealized_pl = 0
@@ -51,7 +57,7 @@ class PostRunSteps(object):
         # log_msg += "Total portfolio value: ${:.2f}\n".format(current_portfolio_value)
         # pl_msg += "Total portfolio value: ${:.2f}\n".format(current_portfolio_value)
 
-        print(log_msg)
+        logger.info(log_msg)
         self.notification.notify(pl_msg)
 
     def show_portfolio_details(self):
@@ -59,3 +65,28 @@ class PostRunSteps(object):
         portfolio = self.account_service.get_account_details()
         self.notification.notify(f"Final portfolio value: ${float(portfolio.portfolio_value)}")
         logger.info("Completed: Final Steps for the day")
+
+    '''
+    Appends today's bar of every US symbol to the history store with one bulk request, then precomputes the
+    price changes and features the morning screening reads. When the bulk download fails, the symbols are topped
+    up one by one when the strategies next ask for them
+    '''
+    def ingest_end_of_day(self):
+        day = last_completed_trading_day()
+        # On market holidays the last session is the one already stored
+        if self.history_store.last_date() == day:
+            logger.info(f"End of day bars for {day} already stored")
+            return
+        try:
+            bars = self.data_service.get_end_of_day_bars(day.isoformat())
+        except Exception as ex:
+            logger.error(f"Bulk end of day download for {day} failed: {ex}")
+            return
+        if bars.empty:
+            logger.info(f"No end of day bars for {day}")
+            return
+
+        self.history_store.add_day(day, bars)
+        self.history_store.precompute_price_changes()
+        self.feature_store.precompute()
+        logger.info(f"Completed: End of day bars of {len(bars)} symbols stored for {day}")
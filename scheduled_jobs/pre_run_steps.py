@@ -13,10 +13,10 @@ class PreRunSteps(object):
         self.account_service: AccountService = di[AccountService]
         self.notification: Notification = di[Notification]
 
-    def show_configuration(self):
+    def show_configuration(self, strategy_name: str = None):
         logger.info("Running: pre run steps ...")
         account: TradeAccount = self.account_service.get_account_details()
-        strategy_name = load_app_variables("STRATEGY")
+        strategy_name = strategy_name or load_app_variables("STRATEGY")
 
         msg = "Starting Vyapari with ... \n"
         msg += "*********************************************\n"
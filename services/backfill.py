@@ -0,0 +1,236 @@
+import argparse
+import concurrent.futures
+import os
+import time
+from collections import Counter
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional, Set
+
+import numpy as np
+from kink import di
+from pandas import DataFrame
+
+from core.logger import logger
+from core.rate_limiter import RateLimiter
+from services.bar_schema import BarSchema
+from services.bar_store import BarStore
+from services.fmp_fast import FastFmpClient, BarColumns, BAR_FIELDS
+from services.history_store import HistoryStore, INITIAL_HISTORY_DAYS
+from services.util import load_env_variables
+from universe.watchlist import WatchList
+
+BACKFILL_FOLDER = os.path.join('data', 'backfill')
+DAILY = 'day'
+TIMEFRAMES = ['1min', '5min', '15min', '30min', '1hour', DAILY]
+# FMP's quota of the starter plan, raise it with --calls-per-minute on bigger plans
+FMP_CALLS_PER_MINUTE = 300
+DEFAULT_WORKERS = 8
+# FMP cuts intraday answers to a few thousand bars, so a month is downloaded one week at a time
+INTRADAY_WINDOW_DAYS = 7
+# Daily bars are merged into the HistoryStore this many symbols at a time, every merge rewrites the year files
+DAILY_WRITE_BATCH = 200
+PROGRESS_EVERY_SECS = 30
+
+
+@dataclass(frozen=True)
+class BackfillChunk:
+    symbol: str
+    start: date
+    end: date
+    # YYYY-MM of intraday chunks, daily chunks span the whole range
+    month: Optional[str] = None
+
+    '''
+    Checkpoint key, independent of the end of the range so a run started again on a later day resumes
+    '''
+    @property
+    def key(self) -> str:
+        return self.symbol if self.month is None else f"{self.symbol}:{self.month}"
+
+
+class Backfill(object):
+    """
+    Downloads years of daily or intraday bars for many symbols. The work is split into (symbol, date range)
+    chunks, one per symbol for daily bars and one per symbol and month for intraday bars, run by a pool of
+    workers sharing one FMP rate limiter. Every stored chunk is appended to a checkpoint file of the timeframe and
+    start, so an interrupted run started again with the same start (on any later day) only downloads what is
+    missing. An intraday month that had not ended by the end of the range is not checkpointed, it is downloaded
+    again to get its remaining days.
+    Daily bars go to the HistoryStore, intraday bars to the BarStore (one .npy file per symbol and month).
+    The HistoryStore locks its files while writing and the app reloads what the backfill wrote, so the app can
+    keep running during a daily backfill.
+    """
+
+    def __init__(self, timeframe: str, symbols: List[str], start: date, end: date, workers: int = DEFAULT_WORKERS,
+                 calls_per_minute: int = FMP_CALLS_PER_MINUTE):
+        self.timeframe = timeframe
+        self.symbols = list(dict.fromkeys(symbols))
+        self.start = start
+        self.end = end
+        self.workers = workers
+        self.rate_limiter = RateLimiter(calls_per_minute, 60)
+        self.fmp = FastFmpClient()
+        self.bar_store = BarStore(timeframe) if timeframe != DAILY else None
+        self.checkpoint_path = os.path.join(BACKFILL_FOLDER, f"{timeframe}_{start}.done")
+
+    def chunks(self) -> List[BackfillChunk]:
+        if self.timeframe == DAILY:
+            return [BackfillChunk(symbol, self.start, self.end) for symbol in self.symbols]
+
+        months = np.arange(np.datetime64(self.start, 'M'), np.datetime64(self.end, 'M') + 1)
+        month_starts: List[date] = months.astype('datetime64[D]').astype(object).tolist()
+        return [BackfillChunk(symbol, max(month_start, self.start), min(_month_end(month_start), self.end),
+                              month_start.strftime('%Y-%m'))
+                for symbol in self.symbols for month_start in month_starts]
+
+    def run(self) -> Dict[str, float]:
+        done = self._read_checkpoint()
+        todo = [chunk for chunk in self.chunks() if chunk.key not in done]
+        chunks_left = Counter(chunk.symbol for chunk in todo)
+        logger.info(f"Backfill of {self.timeframe} bars from {self.start} to {self.end}: {len(self.symbols)} "
+                    f"symbols, {len(todo)} chunks to go ({len(done)} done in earlier runs)")
+
+        stats = Counter()
+        pending_bars: Dict[str, DataFrame] = {}
+        pending_keys: List[str] = []
+        started = last_progress = time.monotonic()
+
+        os.makedirs(BACKFILL_FOLDER, exist_ok=True)
+        with open(self.checkpoint_path, 'a') as checkpoint, \
+                concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
+
+            def mark_done(keys: List[str]):
+                checkpoint.writelines(f"{key}\n" for key in keys)
+                checkpoint.flush()
+
+            futures = {executor.submit(self._run_chunk, chunk): chunk for chunk in todo}
+            for future in concurrent.futures.as_completed(futures):
+                chunk = futures[future]
+                try:
+                    result = future.result()
+                except Exception as ex:
+                    stats['failed_chunks'] += 1
+                    logger.warning(f"{chunk.key}: Backfill failed, it is retried on the next run: {ex}")
+                    continue
+
+                if self.timeframe == DAILY:
+                    if result is not None:
+                        pending_bars[chunk.symbol] = result
+                        stats['bars'] += len(result)
+                    pending_keys.append(chunk.key)
+                    if len(pending_keys) >= DAILY_WRITE_BATCH:
+                        self._store_daily(pending_bars)
+                        mark_done(pending_keys)
+                        pending_bars, pending_keys = {}, []
+                else:
+                    stats['bars'] += result
+                    if chunk.end == _month_end(chunk.start):
+                        mark_done([chunk.key])
+
+                stats['chunks'] += 1
+                chunks_left[chunk.symbol] -= 1
+                if chunks_left[chunk.symbol] == 0:
+                    stats['symbols'] += 1
+
+                if time.monotonic() - last_progress >= PROGRESS_EVERY_SECS:
+                    last_progress = time.monotonic()
+                    self._log_progress(stats, len(todo), last_progress - started)
+
+            if pending_keys:
+                self._store_daily(pending_bars)
+                mark_done(pending_keys)
+
+        elapsed_secs = time.monotonic() - started
+        self._log_progress(stats, len(todo), elapsed_secs)
+        return {**stats, 'elapsed_secs': round(elapsed_secs, 1),
+                'symbols_per_minute': round(stats['symbols'] / elapsed_secs * 60, 1) if elapsed_secs else 0.0}
+
+    def _run_chunk(self, chunk: BackfillChunk):
+        symbol = chunk.symbol
+        if self.timeframe == DAILY:
+            self.rate_limiter.acquire()
+            dates, columns = self.fmp.get_historical_price(symbol, start=chunk.start.isoformat(),
+                                                           end=chunk.end.isoformat())
+            return BarSchema.from_columns(dates, columns) if len(dates) else None
+
+        windows: List[BarColumns] = []
+        window_start = chunk.start
+        while window_start <= chunk.end:
+            window_end = min(window_start + timedelta(days=INTRADAY_WINDOW_DAYS - 1), chunk.end)
+            self.rate_limiter.acquire()
+            windows.append(self.fmp.get_historical_chart(symbol, self.timeframe, window_start.isoformat(),
+                                                         window_end.isoformat()))
+            window_start = window_end + timedelta(days=1)
+
+        dates = np.concatenate([dates for dates, _ in windows])
+        if len(dates) == 0:
+            return 0
+        columns = {field: np.concatenate([columns[field] for _, columns in windows]) for field in BAR_FIELDS}
+        return self.bar_store.write_month(symbol, chunk.month, (dates, columns))
+
+    '''
+    A symbol's history is complete when the range is as long as a top up's first download, or when its first bar
+    comes well after the start of the range (it was listed later, not just a weekend or holiday)
+    '''
+    def _store_daily(self, bars_by_symbol: Dict[str, DataFrame]) -> None:
+        history_store: HistoryStore = di[HistoryStore]
+        history_store.add_bars(bars_by_symbol)
+        long_range = np.busday_count(self.start, self.end) >= INITIAL_HISTORY_DAYS
+        history_store.mark_complete(symbol for symbol, bars in bars_by_symbol.items()
+                                    if long_range or bars.index[0].date() > self.start + timedelta(days=7))
+
+    def _read_checkpoint(self) -> Set[str]:
+        if not os.path.exists(self.checkpoint_path):
+            return set()
+        with open(self.checkpoint_path) as checkpoint:
+            return {line.strip() for line in checkpoint if line.strip()}
+
+    def _log_progress(self, stats: Counter, chunk_count: int, elapsed_secs: float) -> None:
+        minutes = max(elapsed_secs / 60, 1e-9)
+        logger.info(f"Backfill: {stats['chunks']}/{chunk_count} chunks, {stats['symbols']} symbols complete, "
+                    f"{stats['bars']} bars, {stats['failed_chunks']} failed in {elapsed_secs:.0f}s "
+                    f"({stats['symbols'] / minutes:.1f} symbols/min)")
+
+
+def _month_end(month_start: date) -> date:
+    next_month = (month_start.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return next_month - timedelta(days=1)
+
+
+def _symbols(opts) -> List[str]:
+    if opts.symbols:
+        return opts.symbols
+    if opts.symbols_file:
+        with open(opts.symbols_file) as symbols_file:
+            return [line.strip() for line in symbols_file if line.strip()]
+    if opts.stored:
+        return di[HistoryStore].symbols()
+    return di[WatchList].get_universe()
+
+
+def main(args: List[str] = None):
+    # FMP_API_KEY and the other settings of conf/env.yml, the app loads them the same way on startup
+    load_env_variables()
+    parser = argparse.ArgumentParser(description="Resumable backfill of daily or intraday bars from FMP")
+    parser.add_argument('--timeframe', choices=TIMEFRAMES, default=DAILY)
+    parser.add_argument('--start', required=True, help="First day (YYYY-MM-DD)")
+    parser.add_argument('--end', default=date.today().isoformat(), help="Last day (YYYY-MM-DD)")
+    symbol_source = parser.add_mutually_exclusive_group()
+    symbol_source.add_argument('--symbols', nargs='+', help="Symbols to backfill (default: today's universe)")
+    symbol_source.add_argument('--symbols-file', help="File with one symbol per line")
+    symbol_source.add_argument('--stored', action='store_true', help="Every symbol of the HistoryStore")
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS)
+    parser.add_argument('--calls-per-minute', type=int, default=FMP_CALLS_PER_MINUTE)
+    opts = parser.parse_args(args)
+
+    backfill = Backfill(opts.timeframe, _symbols(opts), datetime.strptime(opts.start, '%Y-%m-%d').date(),
+                        datetime.strptime(opts.end, '%Y-%m-%d').date(), opts.workers, opts.calls_per_minute)
+    stats = backfill.run()
+    print(f"Backfilled {stats.get('symbols', 0)} symbols ({stats.get('bars', 0)} bars) in "
+          f"{stats['elapsed_secs']}s: {stats['symbols_per_minute']} symbols/min, "
+          f"{stats.get('failed_chunks', 0)} chunks failed")
+
+
+if __name__ == '__main__':
+    main()
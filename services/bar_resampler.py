@@ -0,0 +1,63 @@
+from datetime import date, datetime, time, timedelta
+from typing import Optional, Tuple
+
+import pandas as pd
+from pandas import DataFrame
+
+from services.bar_schema import BarSchema
+
+# FMP intraday bars are in US/Eastern and labelled with the start of the bar
+SESSION_OPEN = time(9, 30)
+SESSION_CLOSE = time(16, 0)
+SESSION_OPEN_OFFSET = '9h30min'
+
+OHLCV_AGGREGATION = {'open': 'first', 'high': 'max', 'low': 'min', 'close': 'last', 'volume': 'sum'}
+
+
+class BarResampler:
+    """
+    Derives coarser OHLCV bars from one series of 1-minute bars, so every timeframe of a symbol comes from the same
+    data. Bars are anchored at the session open (09:30, 09:45, 10:00 ... for 15 minutes, 09:30, 10:30 ... for an
+    hour) and labelled with their start, like the bars FMP returns.
+    """
+
+    @classmethod
+    def session_bars(cls, one_min_df: DataFrame) -> DataFrame:
+        df = one_min_df if isinstance(one_min_df.index, pd.DatetimeIndex) else BarSchema.to_bars(one_min_df)
+        if not df.index.is_monotonic_increasing:
+            df = df.sort_index()
+        minutes = df.index.hour * 60 + df.index.minute
+        in_session = (minutes >= SESSION_OPEN.hour * 60 + SESSION_OPEN.minute) & \
+                     (minutes < SESSION_CLOSE.hour * 60 + SESSION_CLOSE.minute)
+        return df[in_session].rename_axis('date')
+
+    '''
+    `rule` is a pandas offset below a day that divides it ('5min', '15min', '30min', '60min'), or '1D'
+    '''
+    @classmethod
+    def resample(cls, one_min_df: DataFrame, rule: str) -> DataFrame:
+        df = cls.session_bars(one_min_df)
+        columns = [column for column in OHLCV_AGGREGATION if column in df.columns]
+        aggregation = {column: OHLCV_AGGREGATION[column] for column in columns}
+
+        if rule.upper() == '1D':
+            bars = df[columns].groupby(df.index.normalize()).agg(aggregation)
+        else:
+            # Bins start at midnight + 09:30 of the first day, which lines up with the open of every day
+            bars = df[columns].resample(rule, origin='start_day', offset=SESSION_OPEN_OFFSET,
+                                        label='left', closed='left').agg(aggregation)
+            # Bins outside of the session (nights, weekends) have no bars
+            bars = bars[bars['open'].notna()]
+        return bars.rename_axis('date')
+
+    '''
+    Low and high of the first `minutes` of today's session, None while fewer than 2 bars are available
+    '''
+    @classmethod
+    def opening_range(cls, one_min_df: DataFrame, minutes: int = 30) -> Optional[Tuple[float, float]]:
+        df = cls.session_bars(one_min_df)
+        session_start = datetime.combine(date.today(), SESSION_OPEN)
+        opening_bars = df[(df.index >= session_start) & (df.index < session_start + timedelta(minutes=minutes))]
+        if len(opening_bars) < 2:
+            return None
+        return float(opening_bars['low'].min()), float(opening_bars['high'].max())
@@ -0,0 +1,68 @@
+from typing import Dict
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+
+PRICE_COLUMNS = ['open', 'high', 'low', 'close']
+VOLUME_COLUMN = 'volume'
+BAR_COLUMNS = PRICE_COLUMNS + [VOLUME_COLUMN]
+
+
+class BarSchema:
+    """
+    Canonical form of every OHLCV frame handed out by the DataService: a sorted datetime64 index named `date`,
+    contiguous float64 (or float32) price columns and int64 volume. FMP's extra columns are dropped.
+    Frames are converted once, when they are downloaded, so indicators and time slicing do not convert again.
+    """
+
+    @classmethod
+    def to_bars(cls, df: DataFrame, price_dtype=np.float64) -> DataFrame:
+        if df is None or len(df) == 0:
+            return cls.empty(price_dtype)
+
+        index = df.index if 'date' not in df.columns else df['date']
+        index = pd.DatetimeIndex(pd.to_datetime(index), name='date')
+
+        columns = {column: np.ascontiguousarray(pd.to_numeric(df[column], errors='coerce'), dtype=price_dtype)
+                   for column in PRICE_COLUMNS}
+        volume = pd.to_numeric(df[VOLUME_COLUMN], errors='coerce') if VOLUME_COLUMN in df.columns else 0
+        columns[VOLUME_COLUMN] = np.ascontiguousarray(pd.Series(volume, index=df.index).fillna(0), dtype=np.int64)
+
+        bars = DataFrame(columns, index=index)
+        if not bars.index.is_monotonic_increasing:
+            bars = bars.sort_index(kind='stable')
+        # FMP pages can overlap, the latest copy of a bar wins
+        return bars[~bars.index.duplicated(keep='last')]
+
+    '''
+    Same as to_bars(), for bars already decoded into column arrays (see FastFmpClient)
+    '''
+    @classmethod
+    def from_columns(cls, dates: np.ndarray, columns: Dict[str, np.ndarray], price_dtype=np.float64) -> DataFrame:
+        if len(dates) == 0:
+            return cls.empty(price_dtype)
+        data = {column: np.ascontiguousarray(columns[column], dtype=price_dtype) for column in PRICE_COLUMNS}
+        data[VOLUME_COLUMN] = np.nan_to_num(columns[VOLUME_COLUMN]).astype(np.int64)
+        bars = DataFrame(data, index=pd.DatetimeIndex(dates, name='date'))
+        if not bars.index.is_monotonic_increasing:
+            bars = bars.sort_index(kind='stable')
+        return bars[~bars.index.duplicated(keep='last')]
+
+    @classmethod
+    def empty(cls, price_dtype=np.float64) -> DataFrame:
+        columns = {column: np.array([], dtype=price_dtype) for column in PRICE_COLUMNS}
+        columns[VOLUME_COLUMN] = np.array([], dtype=np.int64)
+        return DataFrame(columns, index=pd.DatetimeIndex([], name='date'))
+
+    '''
+    Long frame of the bars of several symbols, with `symbol` as a categorical column
+    '''
+    @classmethod
+    def combine(cls, bars_by_symbol: Dict[str, DataFrame]) -> DataFrame:
+        frames = [bars.assign(symbol=symbol) for symbol, bars in bars_by_symbol.items() if len(bars) > 0]
+        if not frames:
+            return cls.empty().assign(symbol=pd.Categorical([]))
+        combined = pd.concat(frames)
+        combined['symbol'] = pd.Categorical(combined['symbol'], categories=list(bars_by_symbol))
+        return combined
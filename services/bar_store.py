@@ -0,0 +1,90 @@
+import os
+from typing import Iterator, List
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+
+from services.fmp_fast import BarColumns, BAR_FIELDS
+
+BAR_STORE_FOLDER = os.path.join('data', 'bars')
+# One record per bar, so a month of a symbol is a single contiguous array on disk
+BAR_DTYPE = np.dtype([('date', 'datetime64[s]')] + [(field, np.float64) for field in BAR_FIELDS])
+
+
+class BarStore(object):
+    """
+    Intraday bars of one timeframe saved as one structured .npy file per symbol and month:
+    data/bars/<timeframe>/<symbol>/<YYYY-MM>.npy. Files are written whole, oldest bar first, so they are
+    memory-mapped back without any parsing, and years of minute bars can be walked one month at a time.
+    """
+
+    def __init__(self, timeframe: str = '1min', folder: str = BAR_STORE_FOLDER):
+        self.timeframe = timeframe
+        self.folder = os.path.join(folder, timeframe)
+
+    def path(self, symbol: str, month: str) -> str:
+        return os.path.join(self.folder, symbol, f"{month}.npy")
+
+    def symbols(self) -> List[str]:
+        return sorted(os.listdir(self.folder)) if os.path.isdir(self.folder) else []
+
+    def months(self, symbol: str) -> List[str]:
+        symbol_folder = os.path.join(self.folder, symbol)
+        if not os.path.isdir(symbol_folder):
+            return []
+        return sorted(name[:-len('.npy')] for name in os.listdir(symbol_folder) if name.endswith('.npy'))
+
+    '''
+    Read-only memory map of one month, pages are only read from disk when the bars are accessed
+    '''
+    def open_month(self, symbol: str, month: str) -> np.ndarray:
+        return np.load(self.path(symbol, month), mmap_mode='r')
+
+    '''
+    Yields the bars of `symbol` from `start` to `end` (days, inclusive) one month at a time, as zero-copy slices
+    of the memory-mapped files. At most one month is resident, however long the range is
+    '''
+    def iter_chunks(self, symbol: str, start=None, end=None) -> Iterator[np.ndarray]:
+        start_day = np.datetime64(start, 'D') if start is not None else None
+        end_day = np.datetime64(end, 'D') + 1 if end is not None else None
+        for month in self.months(symbol):
+            month_start = np.datetime64(month, 'M')
+            if start_day is not None and month_start < start_day.astype('datetime64[M]'):
+                continue
+            if end_day is not None and month_start > (end_day - 1).astype('datetime64[M]'):
+                break
+            bars = self.open_month(symbol, month)
+            dates = bars['date']
+            first = np.searchsorted(dates, start_day.astype(dates.dtype)) if start_day is not None else 0
+            last = np.searchsorted(dates, end_day.astype(dates.dtype)) if end_day is not None else len(bars)
+            if last > first:
+                yield bars[first:last]
+
+    '''
+    Copies a chunk into a BarSchema like DataFrame, for code that works on frames
+    '''
+    @staticmethod
+    def to_frame(bars: np.ndarray) -> DataFrame:
+        return DataFrame({field: np.asarray(bars[field]) for field in BAR_FIELDS},
+                         index=pd.DatetimeIndex(np.asarray(bars['date']), name='date'))
+
+    '''
+    Replaces the month (YYYY-MM) of `symbol` with the given bars. Overlapping downloads are de-duplicated,
+    the first copy of a bar wins. Returns the number of bars written
+    '''
+    def write_month(self, symbol: str, month: str, bar_columns: BarColumns) -> int:
+        dates, columns = bar_columns
+        dates, first_idx = np.unique(np.asarray(dates, dtype='datetime64[s]'), return_index=True)
+        bars = np.empty(len(dates), dtype=BAR_DTYPE)
+        bars['date'] = dates
+        for field in BAR_FIELDS:
+            bars[field] = np.asarray(columns[field], dtype=np.float64)[first_idx]
+
+        path = self.path(symbol, month)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # np.save would append .npy to the temporary name
+        with open(f"{path}.tmp", 'wb') as tmp_file:
+            np.save(tmp_file, bars)
+        os.replace(f"{path}.tmp", path)
+        return len(bars)
@@ -69,7 +69,6 @@ class AlpacaClient(Broker):
     def __init__(self):
         self.api: TradingClient = di[AlpacaBroker].get_instance()
         self.notification = di[Notification]
-        assert self.get_portfolio() is not None
 
     def get_portfolio(self) -> TradeAccount:
         return self.api.get_account()
@@ -1,44 +1,157 @@
 import concurrent.futures
+import io
 import time
 from enum import Enum
-from typing import List
+from typing import List, Dict
 
+import numpy as np
 import pandas as pd
 from fmp_python.fmp import FMP, Interval
-from kink import inject
+from kink import inject, di
 from pandas import DataFrame, concat
 
-from core.logger import logger
+from core.logger import logger, log_frame
+from core.tracing import traced
+from services.bar_resampler import BarResampler
+from services.bar_schema import BarSchema, BAR_COLUMNS
+from services.fmp_fast import FastFmpClient, BarColumns
+from services.quote_cache import QuoteCache
+
+QUOTE_BATCH_SIZE = 100
+# FMP suffixes the symbols of other exchanges (VOD.L, SAP.DE), US share classes use a dash (BRK-B)
+US_SYMBOL_PATTERN = r'^[A-Z]{1,5}(-[A-Z]{1,2})?$'
 
 
 class Timeframe(Enum):
     MIN_1 = "1Min"
     MIN_5 = "5Min"
     MIN_15 = "15Min"
+    MIN_30 = "30Min"
+    HOUR = "1Hour"
     DAY = 'day'
 
 
+RESAMPLE_RULES = {
+    Timeframe.MIN_5: '5min',
+    Timeframe.MIN_15: '15min',
+    Timeframe.MIN_30: '30min',
+    Timeframe.HOUR: '60min',
+    Timeframe.DAY: '1D',
+}
+
+
 @inject
 class DataService(object):
 
     def __init__(self):
         self.api = FMP()
+        self.fast_api = FastFmpClient()
+        self.quote_cache: QuoteCache = di[QuoteCache]
 
+    '''
+    Prices are shared through the quote cache for a few seconds, see QuoteCache
+    '''
     def get_current_price(self, symbol) -> float:
-        return self.api.get_quote_short(symbol).iloc[-1]['price']
+        return self.quote_cache.get(symbol, self._fetch_price)
+
+    '''
+    Returns the latest price of every symbol, fetched as comma separated batches (one request per batch).
+    Symbols without a quote are left out of the result
+    '''
+    def get_current_prices(self, symbols: List[str]) -> Dict[str, float]:
+        prices = self.quote_cache.get_many(symbols, self._fetch_prices)
+        missing = [sym for sym in dict.fromkeys(symbols) if sym not in prices]
+        if missing:
+            logger.warning(f"No quotes found for: {missing}")
+        return prices
+
+    @traced('data_fetch')
+    def _fetch_price(self, symbol) -> float:
+        return float(self.api.get_quote_short(symbol).iloc[-1]['price'])
+
+    @traced('data_fetch')
+    def _fetch_prices(self, symbols: List[str]) -> Dict[str, float]:
+        prices: Dict[str, float] = {}
+        unique_symbols = list(dict.fromkeys(symbols))
+        for idx in range(0, len(unique_symbols), QUOTE_BATCH_SIZE):
+            batch = unique_symbols[idx:idx + QUOTE_BATCH_SIZE]
+            quotes = self.api.get_quote_short(','.join(batch))
+            if isinstance(quotes, DataFrame) and not quotes.empty:
+                prices.update(zip(quotes['symbol'], quotes['price'].astype(float)))
+        return prices
+
+    '''
+    Returns dataframe in ascending order, in the BarSchema form
+    '''
+    @traced('data_fetch')
+    def get_daily_bars(self, symbol: str, limit: int, price_dtype=np.float64) -> DataFrame:
+        try:
+            return self._columns_to_bars(symbol, self.fast_api.get_historical_price(symbol, limit), price_dtype)
+        except Exception as ex:
+            logger.warning(f"{symbol}: Fast daily bars download failed, retrying with fmp_python: {ex}")
+            return self._to_bars(symbol, self.api.get_historical_price(symbol, limit), price_dtype)
+
+    @traced('data_fetch')
+    def get_intra_day_bars(self, symbol: str, interval: Interval, price_dtype=np.float64) -> DataFrame:
+        try:
+            return self._columns_to_bars(symbol, self.fast_api.get_historical_chart(symbol, interval), price_dtype)
+        except Exception as ex:
+            logger.warning(f"{symbol}: Fast intraday bars download failed, retrying with fmp_python: {ex}")
+            return self._to_bars(symbol, self.api.get_historical_chart(symbol, interval), price_dtype)
 
     '''
-    Returns dataframe in ascending order
+    Daily bars of several symbols as one long frame with a categorical `symbol` column. Screening panels do not
+    need double precision, so prices are float32 by default. Symbols without bars are left out
     '''
-    def get_daily_bars(self, symbol: str, limit: int) -> DataFrame:
-        bars = self.api.get_historical_price(symbol, limit)[::-1]
-        bars.set_index('date', inplace=True)
-        return bars
+    def get_daily_bar_panel(self, symbols: List[str], limit: int, price_dtype=np.float32) -> DataFrame:
+        def fetch_bars(sym):
+            try:
+                return self.get_daily_bars(sym, limit, price_dtype)
+            except Exception as ex:
+                logger.warning(f"{sym}: No daily bars: {ex}")
+                return None
+
+        # Limit to 2 threads like the price change downloads, FMP answers with 429s beyond that
+        with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+            bars_by_symbol = dict(zip(symbols, executor.map(fetch_bars, symbols)))
+        return BarSchema.combine({sym: bars for sym, bars in bars_by_symbol.items() if bars is not None})
 
-    def get_intra_day_bars(self, symbol: str, interval: Interval):
-        bars = self.api.get_historical_chart(symbol, interval)[::-1]
-        bars.set_index('date', inplace=True)
-        return bars
+    '''
+    Daily bar of every US listed symbol for `day` (YYYY-MM-DD) from FMP's bulk end of day endpoint, one request
+    for the whole market. Indexed by symbol, with the BarSchema columns. Empty on days without a session
+    '''
+    @traced('data_fetch')
+    def get_end_of_day_bars(self, day: str) -> DataFrame:
+        content = self.fast_api.get_batch_eod(day)
+        dtypes = {column: np.float64 for column in BAR_COLUMNS}
+        bars = pd.read_csv(io.BytesIO(content), usecols=['symbol'] + BAR_COLUMNS, dtype={'symbol': str, **dtypes})
+        bars = bars[bars['symbol'].str.match(US_SYMBOL_PATTERN, na=False)]
+        return bars.drop_duplicates(subset='symbol', keep='last').set_index('symbol')[BAR_COLUMNS]
+
+    @staticmethod
+    def _columns_to_bars(symbol: str, bar_columns: BarColumns, price_dtype) -> DataFrame:
+        dates, columns = bar_columns
+        if len(dates) == 0:
+            raise ValueError(f"{symbol}: FMP returned no bars")
+        return BarSchema.from_columns(dates, columns, price_dtype)
+
+    @staticmethod
+    def _to_bars(symbol: str, raw_bars: DataFrame, price_dtype) -> DataFrame:
+        if not isinstance(raw_bars, DataFrame) or raw_bars.empty:
+            raise ValueError(f"{symbol}: FMP returned no bars")
+        return BarSchema.to_bars(raw_bars, price_dtype)
+
+    '''
+    Regular session bars of every timeframe, resampled from a single download of 1-minute bars.
+    The 1-minute bars are always part of the result
+    '''
+    def get_intra_day_bar_set(self, symbol: str, timeframes: List[Timeframe]) -> Dict[Timeframe, DataFrame]:
+        one_min_df = BarResampler.session_bars(self.get_intra_day_bars(symbol, Interval.MIN_1))
+        bar_set = {Timeframe.MIN_1: one_min_df}
+        for timeframe in timeframes:
+            if timeframe != Timeframe.MIN_1:
+                bar_set[timeframe] = BarResampler.resample(one_min_df, RESAMPLE_RULES[timeframe])
+        return bar_set
 
     '''
     Dataframe response:
@@ -56,7 +169,7 @@ class DataService(object):
             for attempt in range(1, retry_count + 1):
                 result = self.api.stock_price_change(sym)
                 if isinstance(result, DataFrame) and not result.empty:
-                    logger.info(f'Price change for {sym}:\n{result}')
+                    log_frame(f'Price change for {sym}:', result)
                     return result  # Return the result directly
                 else:
                     logger.warning(
@@ -80,9 +193,6 @@ class DataService(object):
         else:
             return pd.DataFrame()
 
-    def save_history(self, symbol, interval: Interval, limit: int = 252):
-        pass
-
     def screen_stocks(self, market_cap_lt: int = None, market_cap_gt: int = None, price_lt: int = None,
                       price_gt: int = None, beta_lt: float = None, beta_gt: float = None, volume_lt: int = None,
                       volume_gt: int = None, is_etf: bool = None) -> DataFrame:
@@ -0,0 +1,143 @@
+import os
+import threading
+from datetime import date
+from typing import Dict, List, Optional, Set
+
+import numpy as np
+import pandas as pd
+from kink import inject, di
+from pandas import DataFrame
+
+from core.logger import logger
+from core.tracing import traced
+from services.bar_schema import BAR_COLUMNS
+from services.history_store import HistoryStore, last_completed_trading_day
+
+FEATURES_FOLDER = os.path.join('data', 'features')
+# Enough days for the exponential averages to settle, indicators are only read as of the last close
+FEATURE_LOOKBACK_DAYS = 120
+FEATURE_COLUMNS = BAR_COLUMNS + ['atr_7', 'atr_14', 'ema_20', 'atr_14_ema_9', 'atr_14_ema_14', 'atr_14_increasing',
+                                 'atr_7_to_price', 'atr_14_to_price', 'high_30d', 'drawdown_30d']
+# A row without these was computed on too short a history, e.g. only the days of the bulk end of day downloads
+REQUIRED_FEATURES = ['atr_14', 'ema_20']
+
+
+@inject
+class FeatureStore(object):
+    """
+    Screening indicators of every stored symbol as of the last close: one row per symbol, one column per feature,
+    saved as data/features/features_<date>.pkl. Computed for the whole market after the close from the
+    HistoryStore, so the morning screening is a single lookup followed by array predicates.
+    """
+
+    def __init__(self):
+        self.history_store: HistoryStore = di[HistoryStore]
+        self._features: Optional[DataFrame] = None
+        # As of date -> symbols still without the REQUIRED_FEATURES after a top up (too short a history)
+        self._incomplete: Dict[date, Set[str]] = {}
+        self._lock = threading.Lock()
+
+    '''
+    Features of `symbols` (in that order) as of the last completed trading day. Symbols missing from the
+    precomputed table or without the REQUIRED_FEATURES, or all of them when it is stale, get their daily history
+    topped up and are computed on the spot. Symbols whose history is too short for the REQUIRED_FEATURES are
+    only computed once per as of date
+    '''
+    def get_features(self, symbols: List[str]) -> DataFrame:
+        symbols = list(dict.fromkeys(symbols))
+        as_of = last_completed_trading_day()
+        with self._lock:
+            features = self._load(as_of)
+            incomplete = self._incomplete.get(as_of, set())
+        if features is None:
+            missing = symbols
+        else:
+            known = features.reindex(symbols)
+            missing = [symbol for symbol in known.index[known[REQUIRED_FEATURES].isna().any(axis=1)]
+                       if symbol not in incomplete]
+        if missing:
+            logger.info(f"Computing the features of {len(missing)} symbols missing from the feature store")
+            self.history_store.top_up(missing)
+            computed = self.compute(missing)
+            still_missing = computed.reindex(missing)[REQUIRED_FEATURES].isna().any(axis=1)
+            features = computed if features is None else pd.concat([features.drop(missing, errors='ignore'),
+                                                                    computed])
+            features.attrs['as_of'] = as_of
+            # Recomputed rows replace the incomplete ones, so the next lookup does not compute them again
+            with self._lock:
+                self._features = features
+                self._incomplete = {as_of: self._incomplete.get(as_of, set()) | set(still_missing.index[still_missing])}
+        return features.reindex(symbols)
+
+    '''
+    Computes the features of every stored symbol and saves them. Runs after the end of day bars are stored
+    '''
+    def precompute(self) -> DataFrame:
+        features = self.compute()
+        as_of = self.history_store.last_date()
+        os.makedirs(FEATURES_FOLDER, exist_ok=True)
+        path = os.path.join(FEATURES_FOLDER, f"features_{as_of}.pkl")
+        features.to_pickle(f"{path}.tmp")
+        os.replace(f"{path}.tmp", path)
+        with self._lock:
+            self._features = features
+            self._features.attrs['as_of'] = as_of
+        logger.info(f"Precomputed {len(FEATURE_COLUMNS)} features of {len(features)} symbols as of {as_of}")
+        return features
+
+    @traced('indicators')
+    def compute(self, symbols: List[str] = None) -> DataFrame:
+        closes = self.history_store.get_closes(symbols).tail(FEATURE_LOOKBACK_DAYS)
+        bars = {field: self.history_store.get_field(field, symbols, top_up=False).reindex_like(closes)
+                for field in BAR_COLUMNS}
+        return compute_features(bars['open'], bars['high'], bars['low'], bars['close'], bars['volume'])
+
+    def _load(self, as_of: date) -> Optional[DataFrame]:
+        if self._features is None or self._features.attrs.get('as_of') != as_of:
+            path = os.path.join(FEATURES_FOLDER, f"features_{as_of}.pkl")
+            self._features = pd.read_pickle(path) if os.path.exists(path) else None
+            if self._features is not None:
+                self._features.attrs['as_of'] = as_of
+        return self._features
+
+
+'''
+All arguments are wide frames (dates x symbols) of the same shape. ATRs use Wilder's smoothing like TA-Lib.
+Symbols without a bar on the last day get NaN features, so every predicate on them is False
+'''
+def compute_features(open_: DataFrame, high: DataFrame, low: DataFrame, close: DataFrame,
+                     volume: DataFrame) -> DataFrame:
+    if close.empty:
+        return DataFrame(columns=FEATURE_COLUMNS, index=pd.Index([], name='symbol'))
+
+    prev_close = close.shift()
+    true_range = np.fmax(high - low, np.fmax((high - prev_close).abs(), (low - prev_close).abs()))
+    atr_7 = true_range.ewm(alpha=1 / 7, adjust=False, min_periods=7).mean()
+    atr_14 = true_range.ewm(alpha=1 / 14, adjust=False, min_periods=14).mean()
+    atr_14_ema_9 = atr_14.ewm(span=9, adjust=False, min_periods=9).mean()
+    atr_14_ema_14 = atr_14.ewm(span=14, adjust=False, min_periods=14).mean()
+    atr_14_rising = atr_14_ema_9 > atr_14_ema_14
+    high_30d = high.rolling(30, min_periods=1).max()
+    close_max_30d = close.rolling(30, min_periods=1).max()
+
+    last_close = close.iloc[-1]
+    features = DataFrame({
+        'open': open_.iloc[-1],
+        'high': high.iloc[-1],
+        'low': low.iloc[-1],
+        'close': last_close,
+        'volume': volume.iloc[-1],
+        'atr_7': atr_7.iloc[-1],
+        'atr_14': atr_14.iloc[-1],
+        'ema_20': close.ewm(span=20, adjust=False, min_periods=20).mean().iloc[-1],
+        'atr_14_ema_9': atr_14_ema_9.iloc[-1],
+        'atr_14_ema_14': atr_14_ema_14.iloc[-1],
+        # Rising now and 5 sessions ago, same as the strategies' iloc[-1] / iloc[-5] check
+        'atr_14_increasing': atr_14_rising.iloc[-1] & atr_14_rising.iloc[-5] if len(close) >= 5 else False,
+        'atr_7_to_price': (atr_7.iloc[-1] / last_close * 100).round(3),
+        'atr_14_to_price': (atr_14.iloc[-1] / last_close * 100).round(3),
+        'high_30d': high_30d.iloc[-1],
+        'drawdown_30d': ((last_close / close_max_30d.iloc[-1] - 1) * 100).round(3),
+    }, columns=FEATURE_COLUMNS)
+    features.index.name = 'symbol'
+    return features
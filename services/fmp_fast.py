@@ -0,0 +1,82 @@
+import os
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import orjson
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+FMP_BASE_URL = 'https://financialmodelingprep.com/api/v3'
+FMP_V4_URL = 'https://financialmodelingprep.com/api/v4'
+REQUEST_TIMEOUT_SECS = 30
+POOL_SIZE = 16
+BAR_FIELDS = ['open', 'high', 'low', 'close', 'volume']
+
+# date -> datetime64 array, field -> float64 array, in ascending order
+BarColumns = Tuple[np.ndarray, Dict[str, np.ndarray]]
+
+
+class FastFmpClient(object):
+    """
+    Reads the FMP endpoints behind the bar downloads without fmp_python: the response bytes are parsed with orjson
+    and every field goes straight into a NumPy column, oldest bar first. No per record DataFrame is built and
+    nothing is reversed or re-indexed afterwards.
+    """
+
+    def __init__(self, api_key: str = None):
+        self.api_key = api_key or os.environ.get('FMP_API_KEY')
+        self.session = requests.Session()
+        retries = Retry(total=3, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504])
+        adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE, max_retries=retries)
+        self.session.mount('https://', adapter)
+
+    '''
+    The last `limit` daily bars, or the bars between `start` and `end` (YYYY-MM-DD, inclusive) when given
+    '''
+    def get_historical_price(self, symbol: str, limit: int = None, start: str = None, end: str = None) -> BarColumns:
+        params = {'from': start, 'to': end} if start else {'timeseries': limit}
+        payload = self._get(f"historical-price-full/{symbol}", **params)
+        return decode_bars(payload.get('historical', []) if isinstance(payload, dict) else [])
+
+    def get_historical_chart(self, symbol: str, interval, start: str = None, end: str = None) -> BarColumns:
+        params = {'from': start, 'to': end} if start else {}
+        # fmp_python's Interval values are the FMP path segments (1min, 5min ...)
+        return decode_bars(self._get(f"historical-chart/{getattr(interval, 'value', interval)}/{symbol}", **params))
+
+    def get_quote_short(self, symbols: List[str]) -> Dict[str, float]:
+        return {quote['symbol']: float(quote['price']) for quote in self._get(f"quote-short/{','.join(symbols)}")
+                if quote.get('price') is not None}
+
+    '''
+    End of day bars of every symbol FMP covers (all exchanges) for one day, in a single request.
+    The endpoint answers with CSV: symbol,date,open,low,high,close,adjClose,volume
+    '''
+    def get_batch_eod(self, day: str) -> bytes:
+        return self._get_content(f"{FMP_V4_URL}/batch-request-end-of-day-prices", date=day)
+
+    def _get(self, path: str, **params):
+        return orjson.loads(self._get_content(f"{FMP_BASE_URL}/{path}", **params))
+
+    def _get_content(self, url: str, **params) -> bytes:
+        params['apikey'] = self.api_key
+        response = self.session.get(url, params=params, timeout=REQUEST_TIMEOUT_SECS)
+        response.raise_for_status()
+        return response.content
+
+
+'''
+FMP lists the newest bar first. Columns are filled back to front, so they come out in ascending order
+'''
+def decode_bars(records: Optional[list]) -> BarColumns:
+    records = records or []
+    count = len(records)
+    dates = np.array([record['date'] for record in reversed(records)], dtype='datetime64[s]')
+    columns = {field: np.fromiter((_number(record.get(field)) for record in reversed(records)),
+                                  dtype=np.float64, count=count)
+               for field in BAR_FIELDS}
+    return dates, columns
+
+
+def _number(value) -> float:
+    return np.nan if value is None else value
@@ -0,0 +1,288 @@
+import concurrent.futures
+import fcntl
+import json
+import os
+import threading
+import uuid
+from contextlib import contextmanager
+from datetime import date
+from typing import Dict, Iterable, List, Optional, Set
+
+import numpy as np
+import pandas as pd
+from kink import inject, di
+from pandas import DataFrame, Series
+
+from core.logger import logger
+from services.bar_schema import BAR_COLUMNS
+from services.data_service import DataService
+from services.order_service import OrderService
+from services.returns_calculator import ReturnsCalculator
+
+HISTORY_FOLDER = os.path.join('data', 'history')
+PRICE_CHANGE_FILE = os.path.join(HISTORY_FOLDER, 'price_change.pkl')
+# Symbols whose whole history was downloaded once, the others only have the days of the bulk end of day downloads
+COMPLETE_FILE = os.path.join(HISTORY_FOLDER, 'complete.json')
+# Writers of all processes (the app, the backfill CLI) hold this lock, and rewrite the version file when done
+LOCK_FILE = os.path.join(HISTORY_FOLDER, 'store.lock')
+VERSION_FILE = os.path.join(HISTORY_FOLDER, 'store.version')
+# A symbol seen for the first time gets about 2 years, enough for the 1Y and ytd changes
+INITIAL_HISTORY_DAYS = 2 * 252 + 10
+# Same limit as the other per symbol FMP downloads, more threads run into 429s
+TOP_UP_WORKERS = 2
+
+
+@inject
+class HistoryStore(object):
+    """
+    Daily bars of every symbol the strategies have looked at, as one wide frame (dates x symbols) per bar field
+    kept in memory and saved as one pickle per field and year under data/history. FMP is only asked for the days
+    a symbol is missing, so the price changes of a whole universe are computed locally instead of with one
+    request per symbol. Fields are loaded on first use, reading closes does not load the other fields.
+    Several processes can share the store: writes hold a file lock, and frames written by another process since
+    they were loaded are read again, so no process saves stale frames over the bars of another.
+    """
+
+    def __init__(self):
+        self.data_service: DataService = di[DataService]
+        self._frames: Dict[str, DataFrame] = {}
+        # Price changes of every stored symbol, as of the last stored day (see precompute_price_changes)
+        self._price_changes: Optional[DataFrame] = None
+        # symbol -> last completed trading day it was topped up for, to not ask FMP again on holidays
+        self._topped_up: Dict[str, date] = {}
+        self._complete: Optional[Set[str]] = None
+        # Content of VERSION_FILE when the frames were loaded
+        self._disk_version: Optional[str] = None
+        self._lock = threading.RLock()
+
+    def get_closes(self, symbols: List[str] = None, top_up: bool = True) -> DataFrame:
+        return self.get_field('close', symbols, top_up)
+
+    def get_field(self, field: str, symbols: List[str] = None, top_up: bool = True) -> DataFrame:
+        if top_up and symbols:
+            self.top_up(symbols)
+        with self._lock:
+            frame = self._load(field)
+            if symbols is None:
+                return frame
+            return frame.reindex(columns=[sym for sym in dict.fromkeys(symbols) if sym in frame.columns])
+
+    def symbols(self) -> List[str]:
+        with self._lock:
+            return list(self._load('close').columns)
+
+    def last_date(self) -> Optional[date]:
+        with self._lock:
+            closes = self._load('close')
+            return closes.index[-1].date() if len(closes) else None
+
+    '''
+    Same DataFrame as DataService.stock_price_change, as of the last close. Served from the table precomputed
+    after the close when it covers every symbol, computed on the spot otherwise
+    '''
+    def price_change(self, symbols: List[str]) -> DataFrame:
+        self.top_up(symbols)
+        with self._lock:
+            closes = self._load('close')
+            known = [sym for sym in dict.fromkeys(symbols) if sym in closes.columns]
+            precomputed = self._load_price_changes()
+            if precomputed is not None and precomputed.index.isin(known).sum() == len(known):
+                return precomputed.loc[known].reset_index()
+            closes = closes[known]
+        return ReturnsCalculator.price_change(closes)
+
+    '''
+    Computes the price changes of every stored symbol once and saves them, so the morning screening only
+    selects rows. Invalidated by every write to the store
+    '''
+    def precompute_price_changes(self) -> DataFrame:
+        with self._lock:
+            price_changes = ReturnsCalculator.price_change(self._load('close')).set_index('symbol')
+            price_changes.attrs['as_of'] = self.last_date()
+            self._price_changes = price_changes
+            price_changes.to_pickle(f"{PRICE_CHANGE_FILE}.tmp")
+            os.replace(f"{PRICE_CHANGE_FILE}.tmp", PRICE_CHANGE_FILE)
+        logger.info(f"Precomputed the price changes of {len(price_changes)} symbols as of {self.last_date()}")
+        return price_changes
+
+    '''
+    Downloads the whole history (INITIAL_HISTORY_DAYS) of symbols that never had one, even when the bulk end of
+    day downloads already stored their last days, and the missing days of the others. A symbol listed more
+    recently than that is complete after one download, it is not downloaded again every morning
+    '''
+    def top_up(self, symbols: List[str]) -> int:
+        trading_day = last_completed_trading_day()
+        with self._lock:
+            closes = self._load('close')
+            last_dates = closes.apply(Series.last_valid_index) if not closes.empty else Series(dtype=object)
+            complete = set(self._load_complete())
+
+        limits: Dict[str, int] = {}
+        for symbol in dict.fromkeys(symbols):
+            if self._topped_up.get(symbol) == trading_day:
+                continue
+            last_date = last_dates.get(symbol)
+            if symbol not in complete or last_date is None or pd.isna(last_date):
+                limits[symbol] = INITIAL_HISTORY_DAYS
+            elif last_date.date() < trading_day:
+                limits[symbol] = int(np.busday_count(last_date.date(), trading_day)) + 5
+            else:
+                self._topped_up[symbol] = trading_day
+
+        if not limits:
+            return 0
+
+        def fetch_bars(sym):
+            try:
+                bars = self.data_service.get_daily_bars(sym, limits[sym])
+                # The bar of a session still running (or of today before the close) is not final
+                return sym, bars[bars.index.normalize() <= pd.Timestamp(trading_day)]
+            except Exception as ex:
+                logger.warning(f"{sym}: Could not top up the daily history: {ex}")
+                return sym, None
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=TOP_UP_WORKERS) as executor:
+            fetched = {sym: bars for sym, bars in executor.map(fetch_bars, limits) if bars is not None}
+
+        self.add_bars(fetched)
+        self.mark_complete([sym for sym in fetched if limits[sym] == INITIAL_HISTORY_DAYS])
+        for symbol in fetched:
+            self._topped_up[symbol] = trading_day
+        logger.info(f"Daily history topped up for {len(fetched)}/{len(limits)} symbols")
+        return len(fetched)
+
+    '''
+    Records that the whole history of `symbols` is stored, top_up() then only downloads their missing days
+    '''
+    def mark_complete(self, symbols: Iterable[str]) -> None:
+        symbols = set(symbols)
+        with self._lock, self._write_lock():
+            complete = self._load_complete()
+            new_symbols = symbols - complete
+            if not new_symbols:
+                return
+            complete.update(new_symbols)
+            with open(f"{COMPLETE_FILE}.tmp", 'w') as complete_file:
+                json.dump(sorted(complete), complete_file)
+            os.replace(f"{COMPLETE_FILE}.tmp", COMPLETE_FILE)
+
+    '''
+    Merges daily bars (symbol -> BarSchema frame) into the store, new values win
+    '''
+    def add_bars(self, bars_by_symbol: Dict[str, DataFrame]) -> None:
+        if not bars_by_symbol:
+            return
+        with self._lock, self._write_lock():
+            for field in BAR_COLUMNS:
+                self._merge(field, DataFrame({sym: bars[field] for sym, bars in bars_by_symbol.items()}))
+
+    '''
+    Merges the bars of many symbols for a single day (indexed by symbol, BarSchema columns), as returned by the
+    bulk end of day download
+    '''
+    def add_day(self, day: date, bars: DataFrame) -> None:
+        if bars.empty:
+            return
+        index = pd.DatetimeIndex([pd.Timestamp(day)])
+        with self._lock, self._write_lock():
+            for field in BAR_COLUMNS:
+                self._merge(field, DataFrame([bars[field].to_numpy(dtype=np.float64)], index=index,
+                                             columns=bars.index))
+
+    '''
+    Only the years that changed are written
+    '''
+    def _merge(self, field: str, new_values: DataFrame) -> None:
+        new_values = new_values.sort_index()
+        new_values.index = pd.DatetimeIndex(new_values.index, name='date').normalize()
+        frame = self._load(field)
+        self._frames[field] = new_values.combine_first(frame) if not frame.empty else new_values
+        for year in sorted(set(new_values.index.year)):
+            self._save_year(field, year)
+        self._price_changes = None
+        if os.path.exists(PRICE_CHANGE_FILE):
+            os.remove(PRICE_CHANGE_FILE)
+
+    '''
+    Holds the lock of the store across processes. Frames another process changed are read again first, and the
+    version file is rewritten at the end so the other processes read this write
+    '''
+    @contextmanager
+    def _write_lock(self):
+        os.makedirs(HISTORY_FOLDER, exist_ok=True)
+        with open(LOCK_FILE, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                self._reload_if_changed()
+                yield
+                self._disk_version = uuid.uuid4().hex
+                with open(f"{VERSION_FILE}.tmp", 'w') as version_file:
+                    version_file.write(self._disk_version)
+                os.replace(f"{VERSION_FILE}.tmp", VERSION_FILE)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _reload_if_changed(self) -> None:
+        disk_version = _read_version()
+        if disk_version != self._disk_version:
+            if self._frames:
+                logger.info("The daily history was changed by another process, reloading it")
+            self._frames.clear()
+            self._price_changes = None
+            self._complete = None
+            self._disk_version = disk_version
+
+    def _load(self, field: str) -> DataFrame:
+        self._reload_if_changed()
+        if field not in self._frames:
+            os.makedirs(HISTORY_FOLDER, exist_ok=True)
+            frames = [pd.read_pickle(os.path.join(HISTORY_FOLDER, name))
+                      for name in sorted(os.listdir(HISTORY_FOLDER))
+                      if name.startswith(f"{field}_") and name.endswith('.pkl')]
+            self._frames[field] = pd.concat(frames).sort_index() if frames else DataFrame(dtype=np.float64)
+            logger.info(f"Loaded the daily {field} history of {self._frames[field].shape[1]} symbols, "
+                        f"{len(self._frames[field])} days")
+        return self._frames[field]
+
+    '''
+    Stores written before the file existed count the symbols with a full history of days as complete
+    '''
+    def _load_complete(self) -> Set[str]:
+        if self._complete is None:
+            if os.path.exists(COMPLETE_FILE):
+                with open(COMPLETE_FILE) as complete_file:
+                    self._complete = set(json.load(complete_file))
+            else:
+                day_counts = self._load('close').count()
+                self._complete = set(day_counts.index[day_counts >= INITIAL_HISTORY_DAYS])
+        return self._complete
+
+    def _load_price_changes(self) -> Optional[DataFrame]:
+        if self._price_changes is None and os.path.exists(PRICE_CHANGE_FILE):
+            price_changes = pd.read_pickle(PRICE_CHANGE_FILE)
+            if price_changes.attrs.get('as_of') == self.last_date():
+                self._price_changes = price_changes
+        return self._price_changes
+
+    def _save_year(self, field: str, year: int) -> None:
+        frame = self._frames[field]
+        year_values = frame[frame.index.year == year].dropna(axis=1, how='all')
+        path = os.path.join(HISTORY_FOLDER, f"{field}_{year}.pkl")
+        # Written next to the target first, a crash never leaves a half written year
+        year_values.to_pickle(f"{path}.tmp")
+        os.replace(f"{path}.tmp", path)
+
+
+def _read_version() -> Optional[str]:
+    try:
+        with open(VERSION_FILE) as version_file:
+            return version_file.read()
+    except FileNotFoundError:
+        return None
+
+
+'''
+Last session of the market calendar whose close has passed, market holidays have no bars
+'''
+def last_completed_trading_day() -> date:
+    return di[OrderService].last_completed_session()
@@ -1,23 +1,32 @@
+import copy
+import threading
 import time
 from datetime import datetime, date, timedelta
 from random import randint
-from typing import List
-from uuid import UUID
+from typing import List, Dict, Optional, Tuple
+from uuid import UUID, uuid4
 
 import pytz
 from alpaca.common import APIError
 from alpaca.trading.client import TradingClient
 from alpaca.trading import Order, OrderRequest, OrderSide, OrderType, TimeInForce, OrderClass, TakeProfitRequest, \
-    StopLossRequest, Position, TrailingStopOrderRequest, MarketOrderRequest, Clock
+    StopLossRequest, Position, TrailingStopOrderRequest, MarketOrderRequest, Clock, GetOrdersRequest, QueryOrderStatus, \
+    GetCalendarRequest
 from kink import inject, di
 
 from core.broker import AlpacaBroker
 from core.database import Database
 from core.db_tables import OrderEntity
 from core.logger import logger
+from core.tracing import span
 from services.notification_service import Notification
+from services.trade_ledger_service import TradeLedgerService
 
 timezone = pytz.timezone('America/Los_Angeles')
+EASTERN = pytz.timezone('America/New_York')
+MARKET_CLOSE_HOUR = 16
+# Longer than any run of market holidays and weekends
+CALENDAR_LOOKBACK_DAYS = 10
 
 
 @inject
@@ -27,6 +36,21 @@ class OrderService(object):
         self.api: TradingClient = di[AlpacaBroker].get_instance()
         self.db: Database = di[Database]
         self.notification: Notification = di[Notification]
+        self.trade_ledger: TradeLedgerService = di[TradeLedgerService]
+        # Set on the copies returned by for_strategy(), None trades the whole account
+        self.strategy: Optional[str] = None
+        # Day (Eastern) -> (session day, close) of the calendar up to that day, shared with the for_strategy() copies
+        self._sessions: Dict[date, List[Tuple[date, datetime]]] = {}
+        self._sessions_lock = threading.Lock()
+
+    '''
+    Copy of the service for one of several strategies sharing the account: its orders are tagged with the strategy
+    (client order id prefix and order row), and close_all() only cancels and closes what the strategy opened
+    '''
+    def for_strategy(self, strategy: str) -> 'OrderService':
+        scoped = copy.copy(self)
+        scoped.strategy = strategy
+        return scoped
 
     # TODO: Do not use until multithreading is implemented
     def await_market_open(self) -> None:
@@ -75,7 +99,7 @@ class OrderService(object):
                                                           time_in_force=TimeInForce.GTC)
 
             try:
-                order: Order = self.api.submit_order(order_data)
+                order: Order = self._submit_order(order_data)
                 self.notification.notify(f"Market order to {side}: {qty} shares of {symbol} placed")
                 self._save_order(order)
                 return order.id
@@ -97,7 +121,7 @@ class OrderService(object):
                                                     )
 
             try:
-                order: Order = self.api.submit_order(order_data)
+                order: Order = self._submit_order(order_data)
                 logger.info(f"Limit order to {side}: {qty} shares of {symbol} placed @ {limit_price}")
                 return self._save_order(order)
             except APIError as api_error:
@@ -122,7 +146,7 @@ class OrderService(object):
                                                     )
 
             try:
-                order: Order = self.api.submit_order(order_data)
+                order: Order = self._submit_order(order_data)
                 logger.info(f"Bracket order to {side}: {qty} shares of {symbol} placed")
                 return self._save_order(order)
             except APIError as api_error:
@@ -163,7 +187,7 @@ class OrderService(object):
                                                                 trail_price=trail_price
                                                                 )
             try:
-                order = self.api.submit_order(order_data)
+                order = self._submit_order(order_data)
                 logger.info(f"{symbol}: Trailing stop order submitted : {order.id}")
                 self._save_order(order)
                 return order.id
@@ -189,7 +213,11 @@ class OrderService(object):
             # Close all open orders
             logger.info("Closing all open orders ...")
             try:
-                self.api.cancel_orders()
+                if self.strategy is None:
+                    self.api.cancel_orders()
+                else:
+                    for order in self.db.get_open_orders(self.strategy):
+                        self.api.cancel_order_by_id(order.id)
                 time.sleep(randint(1, 3))
             except APIError as api_error:
                 self.notification.err_notify(f"Could not cancel all open orders: {api_error}")
@@ -202,13 +230,19 @@ class OrderService(object):
             except APIError as api_error:
                 self.notification.err_notify(f"Could not cancel all open orders: {api_error}")
 
-            # Close all open positions
+            # Close all open positions, only the shares the strategy holds itself when the account is shared
             logger.info("Closing all open positions ...")
+            holdings = self.db.get_strategy_holdings(self.strategy) if self.strategy is not None else None
             for position in positions:
+                qty = abs(int(position.qty))
+                if holdings is not None:
+                    qty = min(qty, abs(holdings.get(position.symbol, 0)))
+                if qty == 0:
+                    continue
                 if position.side == 'long':
-                    self.market_sell(position.symbol, abs(int(position.qty)))
+                    self.market_sell(position.symbol, qty)
                 else:
-                    self.market_buy(position.symbol, abs(int(position.qty)))
+                    self.market_buy(position.symbol, qty)
             self.update_all_open_orders()
 
         else:
@@ -223,16 +257,54 @@ class OrderService(object):
     def get_all_orders(self, for_date: date) -> List[OrderEntity]:
         return list(self.db.get_all_orders(for_date))
 
+    def get_all_order_rows(self, for_date: date, fields: List[str] = None) -> List[dict]:
+        return self.db.get_all_order_rows(for_date, fields)
+
+    def list_orders_page(self, after: Optional[Tuple[datetime, str]] = None, limit: int = 100,
+                         fields: List[str] = None) -> List[dict]:
+        return self.db.list_orders_page(after, limit, fields)
+
     def get_all_filled_orders_today(self) -> List[OrderEntity]:
+        return list(self.db.get_all_filled_orders_for_date(self.last_trading_date()))
+
+    '''
+    Today on weekdays, the previous Friday on weekends
+    '''
+    @staticmethod
+    def last_trading_date() -> date:
         day_number = date.today().isoweekday()
         if day_number > 5:
-            return list(self.db.get_all_filled_orders_for_date(date.today() - timedelta(days=day_number - 5)))
-        return list(self.db.get_all_filled_orders_for_date(date.today()))
+            return date.today() - timedelta(days=day_number - 5)
+        return date.today()
+
+    '''
+    Last session whose close has passed, from the broker's calendar so market holidays and early closes are taken
+    into account. The calendar is fetched once a day, only weekends are skipped when the broker cannot be reached
+    '''
+    def last_completed_session(self) -> date:
+        now = datetime.now(EASTERN)
+        today = now.date()
+        with self._sessions_lock:
+            sessions = self._sessions.get(today)
+            if sessions is None:
+                try:
+                    calendar = self.api.get_calendar(GetCalendarRequest(
+                        start=today - timedelta(days=CALENDAR_LOOKBACK_DAYS), end=today))
+                except Exception as ex:
+                    logger.warning(f"Could not get the market calendar, skipping weekends only: {ex}")
+                    return _last_weekday(now)
+                sessions = [(session.date, session.close) for session in calendar]
+                self._sessions.clear()
+                self._sessions[today] = sessions
+
+        # The calendar lists the open and close in Eastern time
+        closed = [day for day, close in sessions if close <= now.replace(tzinfo=None)]
+        return max(closed) if closed else _last_weekday(now)
 
     def update_all_open_orders(self) -> List[Order]:
         logger.info("Updating all open orders ...")
         updated_orders: List[Order] = []
-        for order in self.db.get_open_orders():
+        for order in self.db.get_open_orders(self.strategy):
             updated_orders.append(self.update_saved_order(order.id))
         return updated_orders
 
@@ -254,7 +326,9 @@ class OrderService(object):
                              order.extended_hours,
                              order.status, self._pst(order.failed_at), self._pst(order.filled_at),
                              self._pst(order.canceled_at), self._pst(order.expired_at), self._pst(order.replaced_at),
-                             self._pst(order.submitted_at), self._pst(order.created_at), self._pst(order.updated_at))
+                             self._pst(order.submitted_at), self._pst(order.created_at), self._pst(order.updated_at),
+                             self.strategy)
+        self._record_fill(order)
 
         if order.legs is not None:
             for leg in order.legs:
@@ -273,14 +347,23 @@ class OrderService(object):
                                      filled_avg_price, filled_qty, hwm, limit_price, str(leg.replaced_by),
                                      leg.extended_hours, leg.status, self._pst(leg.failed_at), self._pst(leg.filled_at),
                                      self._pst(leg.canceled_at), self._pst(leg.expired_at), self._pst(leg.replaced_at),
-                                     self._pst(leg.submitted_at), self._pst(leg.created_at), self._pst(leg.updated_at))
+                                     self._pst(leg.submitted_at), self._pst(leg.created_at), self._pst(leg.updated_at),
+                                     self.strategy)
+                self._record_fill(leg)
 
         logger.info(f"Saved order id: {parent_order_id}")
         return self.db.get_by_parent_id(str(parent_order_id))
 
+    def get_orders_by_ids(self, order_ids: List[str], submitted_after: datetime) -> Dict[str, Order]:
+        request = GetOrdersRequest(status=QueryOrderStatus.ALL, after=submitted_after, limit=500)
+        wanted = set(order_ids)
+        return {str(order.id): order for order in self.api.get_orders(request) if str(order.id) in wanted}
+
     def update_saved_order(self, order_id: str) -> Order:
-        order = self.api.get_order_by_id(order_id)
+        return self.save_order_update(self.api.get_order_by_id(order_id))
 
+    def save_order_update(self, order: Order) -> Order:
+        order_id = str(order.id)
         updated_stop_price = self._check_float(order.stop_price)
         filled_avg_price = self._check_float(order.filled_avg_price)
         filled_qty = self._check_float(order.filled_qty)
@@ -288,10 +371,25 @@ class OrderService(object):
         self.db.update_order(order_id, updated_stop_price, filled_avg_price, filled_qty, hwm, str(order.replaced_by),
                              order.extended_hours, order.status, self._pst(order.failed_at), self._pst(order.filled_at),
                              self._pst(order.canceled_at), self._pst(order.expired_at), self._pst(order.replaced_at))
+        self._record_fill(order)
 
         logger.info(f"Updated order id: {order.id}")
         return order
 
+    def _submit_order(self, order_data: OrderRequest) -> Order:
+        if self.strategy is not None:
+            order_data.client_order_id = f"{self.strategy}-{uuid4().hex[:16]}"
+        with span('order_submit', symbol=order_data.symbol, side=str(order_data.side)):
+            return self.api.submit_order(order_data)
+
+    def _record_fill(self, order: Order) -> None:
+        # The order is already saved, a ledger failure must not fail the order update
+        try:
+            self.trade_ledger.record_fill(str(order.id), order.symbol, order.side, self._check_float(order.filled_qty),
+                                          self._check_float(order.filled_avg_price), self._pst(order.filled_at))
+        except Exception as ex:
+            logger.error(f"Could not record fill of order {order.id} in the trade ledger: {ex}")
+
     @staticmethod
     def _check_float(value):
         return 0.00 if value is None else float(value)
@@ -302,3 +400,10 @@ class OrderService(object):
             return None
         ts = timestamp.astimezone(timezone)
         return datetime.fromtimestamp(ts.timestamp())
+
+
+def _last_weekday(now: datetime) -> date:
+    day = now.date() if now.hour >= MARKET_CLOSE_HOUR else now.date() - timedelta(days=1)
+    while day.weekday() > 4:
+        day -= timedelta(days=1)
+    return day
@@ -0,0 +1,68 @@
+import math
+from dataclasses import dataclass, field
+from typing import Dict
+
+from core.logger import logger
+
+
+@dataclass
+class PortfolioDelta:
+    sells: Dict[str, int] = field(default_factory=dict)
+    buys: Dict[str, int] = field(default_factory=dict)
+    skipped: Dict[str, int] = field(default_factory=dict)
+
+    @property
+    def order_count(self) -> int:
+        return len(self.sells) + len(self.buys)
+
+
+class PortfolioDiff:
+
+    @classmethod
+    def compute(cls, current_qty: Dict[str, int], target_weights: Dict[str, float], prices: Dict[str, float],
+                portfolio_value: float, lot_size: int = 1, min_trade_value: float = 0,
+                max_qty: int = None) -> PortfolioDelta:
+        """
+        Computes the smallest set of orders that moves the current holdings to the target weights.
+
+        - Every symbol gets at most one net order (a trim and a re-buy of the same symbol cancel out)
+        - Target quantities are rounded down to whole lots and capped at `max_qty` shares
+        - Adjustments worth less than `min_trade_value` are skipped, except full exits which are always sold
+        - Held symbols missing from `target_weights` have a target weight of 0
+        """
+        delta = PortfolioDelta()
+
+        for symbol in dict.fromkeys(list(target_weights) + list(current_qty)):
+            held_qty = int(current_qty.get(symbol, 0))
+            weight = target_weights.get(symbol, 0)
+
+            if weight <= 0:
+                if held_qty > 0:
+                    delta.sells[symbol] = held_qty
+                elif held_qty < 0:
+                    delta.buys[symbol] = -held_qty
+                continue
+
+            price = prices.get(symbol)
+            if not price or price <= 0:
+                logger.warning(f"{symbol}: No price available, cannot rebalance")
+                continue
+
+            target_qty = math.floor(portfolio_value * weight / price / lot_size) * lot_size
+            if max_qty is not None:
+                target_qty = min(target_qty, max_qty)
+
+            qty_diff = target_qty - held_qty
+            if qty_diff == 0:
+                continue
+
+            if abs(qty_diff) * price < min_trade_value:
+                delta.skipped[symbol] = qty_diff
+            elif qty_diff > 0:
+                delta.buys[symbol] = qty_diff
+            else:
+                delta.sells[symbol] = -qty_diff
+
+        logger.info(f"Portfolio diff: {len(delta.sells)} sells, {len(delta.buys)} buys, "
+                    f"{len(delta.skipped)} adjustments below ${min_trade_value:,.2f} skipped")
+        return delta
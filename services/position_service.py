@@ -1,6 +1,7 @@
+import copy
 from dataclasses import dataclass
 from datetime import datetime
-from typing import List
+from typing import Dict, List, Optional
 
 from alpaca.trading import Position
 from kink import inject, di
@@ -15,6 +16,17 @@ class PositionService(object):
     def __init__(self):
         self.broker: Broker = di[Broker]
         self.db: Database = di[Database]
+        # Set on the copies returned by for_strategy(), None sees the whole account
+        self.strategy: Optional[str] = None
+
+    '''
+    Copy of the service for one of several strategies sharing the account, it only sees the positions opened by the
+    orders of that strategy (see OrderService.for_strategy)
+    '''
+    def for_strategy(self, strategy: str) -> 'PositionService':
+        scoped = copy.copy(self)
+        scoped.strategy = strategy
+        return scoped
 
     def update_current_positions(self):
         positions = self.broker.get_positions()
@@ -30,4 +42,40 @@ class PositionService(object):
         return self.db.get_position(symbol)
 
     def get_all_positions(self) -> List[Position]:
-        return self.broker.get_positions()
+        positions = self.broker.get_positions()
+        if self.strategy is None:
+            return positions
+        holdings = self.db.get_strategy_holdings(self.strategy)
+        return [_own_share(pos, holdings[pos.symbol]) for pos in positions if pos.symbol in holdings]
+
+    '''
+    Held shares per symbol, negative for shorts. A strategy sharing the account only counts its own shares of a
+    symbol, even when another strategy holds the same one
+    '''
+    def get_held_qty(self) -> Dict[str, int]:
+        held_qty = {pos.symbol: int(float(pos.qty)) for pos in self.broker.get_positions()}
+        if self.strategy is None:
+            return held_qty
+        holdings = self.db.get_strategy_holdings(self.strategy)
+        return {symbol: min(qty, held_qty[symbol], key=abs) for symbol, qty in holdings.items() if symbol in held_qty}
+
+
+'''
+The account's position in a symbol cut down to the `qty` shares a strategy owns, so a strategy's notifications do
+not report the shares of another strategy holding the same symbol. Percentages and prices stay as they are
+'''
+def _own_share(position: Position, qty: int) -> Position:
+    account_qty = float(position.qty)
+    qty = min(qty, int(account_qty), key=abs)
+    if qty == account_qty or not account_qty:
+        return position
+    share = qty / account_qty
+
+    def scaled(value: Optional[str]) -> Optional[str]:
+        return None if value is None else str(round(float(value) * share, 2))
+
+    return position.copy(update={'qty': str(qty),
+                                 'market_value': scaled(position.market_value),
+                                 'cost_basis': scaled(position.cost_basis),
+                                 'unrealized_pl': scaled(position.unrealized_pl),
+                                 'unrealized_intraday_pl': scaled(position.unrealized_intraday_pl)})
@@ -0,0 +1,114 @@
+import threading
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional
+
+from cachetools import TTLCache
+from kink import inject
+
+from core.logger import logger
+from services.util import load_app_variables
+
+# Quotes older than this are fetched again. QUOTE_TTL_SECS in env.yml overrides it
+DEFAULT_QUOTE_TTL_SECS = 5.0
+# A caller waiting on another thread's fetch gives up after this
+FLIGHT_TIMEOUT_SECS = 30
+# More than the whole universe, the least recently used quotes go first beyond it
+MAX_QUOTES = 20000
+
+
+@dataclass
+class _Flight:
+    done: threading.Event = field(default_factory=threading.Event)
+    price: Optional[float] = None
+    error: Optional[Exception] = None
+
+
+@inject
+class QuoteCache(object):
+    """
+    Keeps the latest price of every symbol for a few seconds. While a symbol is being fetched, other callers of
+    the same symbol wait for that request instead of sending their own (single flight).
+    """
+
+    def __init__(self):
+        ttl_secs = load_app_variables("QUOTE_TTL_SECS")
+        self.ttl_secs = float(ttl_secs) if ttl_secs is not None else DEFAULT_QUOTE_TTL_SECS
+        # symbol -> price, expired quotes are dropped whenever one is stored
+        self._quotes: TTLCache = TTLCache(maxsize=MAX_QUOTES, ttl=self.ttl_secs)
+        self._flights: Dict[str, _Flight] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.shared = 0
+
+    def get(self, symbol: str, fetch: Callable[[str], float]) -> float:
+        prices = self.get_many([symbol], lambda symbols: {symbols[0]: fetch(symbols[0])})
+        if symbol not in prices:
+            raise ValueError(f"{symbol}: No quote found")
+        return prices[symbol]
+
+    '''
+    Returns the prices of `symbols`, calling `fetch` once with only the symbols that are neither cached nor
+    already being fetched. Symbols `fetch` has no price for are left out
+    '''
+    def get_many(self, symbols: List[str], fetch: Callable[[List[str]], Dict[str, float]]) -> Dict[str, float]:
+        prices: Dict[str, float] = {}
+        owned: Dict[str, _Flight] = {}
+        joined: Dict[str, _Flight] = {}
+
+        with self._lock:
+            for symbol in dict.fromkeys(symbols):
+                cached = self._quotes.get(symbol)
+                if cached is not None:
+                    prices[symbol] = cached
+                    self.hits += 1
+                elif symbol in self._flights:
+                    joined[symbol] = self._flights[symbol]
+                    self.shared += 1
+                else:
+                    owned[symbol] = self._flights[symbol] = _Flight()
+                    self.misses += 1
+
+        if owned:
+            self._fetch(owned, fetch)
+
+        for symbol, flight in {**owned, **joined}.items():
+            if symbol in joined and not flight.done.wait(FLIGHT_TIMEOUT_SECS):
+                logger.warning(f"{symbol}: Timed out waiting for the quote fetched by another caller")
+                continue
+            if flight.error is not None:
+                raise flight.error
+            if flight.price is not None:
+                prices[symbol] = flight.price
+        return prices
+
+    def _fetch(self, owned: Dict[str, _Flight], fetch: Callable[[List[str]], Dict[str, float]]) -> None:
+        fetched: Dict[str, float] = {}
+        error: Optional[Exception] = None
+        try:
+            fetched = fetch(list(owned))
+        except Exception as ex:
+            error = ex
+
+        with self._lock:
+            for symbol, flight in owned.items():
+                flight.price = fetched.get(symbol)
+                flight.error = error
+                if flight.price is not None:
+                    self._quotes[symbol] = flight.price
+                self._flights.pop(symbol, None)
+                flight.done.set()
+
+    def invalidate(self, symbol: str = None) -> None:
+        with self._lock:
+            if symbol is None:
+                self._quotes.clear()
+            else:
+                self._quotes.pop(symbol, None)
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            requests = self.hits + self.misses + self.shared
+            return {'hits': self.hits, 'misses': self.misses, 'shared': self.shared,
+                    'hit_ratio': round((self.hits + self.shared) / requests, 3) if requests else 0.0,
+                    'cached_symbols': len(self._quotes), 'ttl_secs': self.ttl_secs}
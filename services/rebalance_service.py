@@ -0,0 +1,210 @@
+import concurrent.futures
+import copy
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional
+
+from alpaca.trading import Order, OrderSide
+from kink import inject, di
+
+from core.logger import logger
+from core.rate_limiter import RateLimiter
+from services.data_service import DataService
+from services.notification_service import Notification
+from services.order_service import OrderService
+from services.portfolio_diff import PortfolioDiff, PortfolioDelta
+from services.position_service import PositionService
+
+# Alpaca allows 200 requests per minute per account, leave headroom for the rest of the app
+BROKER_CALLS_PER_MINUTE = 150
+MAX_CONCURRENT_ORDERS = 5
+FILL_POLL_INTERVAL_SECS = 0.5
+FILL_TIMEOUT_SECS = 60
+TERMINAL_STATUSES = {'filled', 'canceled', 'expired', 'rejected', 'replaced', 'done_for_day'}
+
+
+@dataclass
+class RebalanceOrder:
+    symbol: str
+    side: OrderSide
+    qty: int
+    ref_price: Optional[float] = None
+    order_id: Optional[str] = None
+    status: Optional[str] = None
+    filled_qty: float = 0
+    filled_avg_price: Optional[float] = None
+    submit_latency_secs: float = 0
+    fill_latency_secs: Optional[float] = None
+
+    @property
+    def slippage_bps(self) -> Optional[float]:
+        """ Positive values are a cost: paid more than the snapshot price on a buy, or received less on a sell """
+        if not self.ref_price or not self.filled_avg_price:
+            return None
+        direction = 1 if self.side == OrderSide.BUY else -1
+        return direction * (self.filled_avg_price - self.ref_price) / self.ref_price * 10_000
+
+
+@dataclass
+class RebalanceReport:
+    orders: List[RebalanceOrder]
+    total_latency_secs: float
+
+    @property
+    def filled(self) -> List[RebalanceOrder]:
+        return [order for order in self.orders if order.status == 'filled']
+
+    @property
+    def avg_slippage_bps(self) -> Optional[float]:
+        slippages = [order.slippage_bps for order in self.orders if order.slippage_bps is not None]
+        return sum(slippages) / len(slippages) if slippages else None
+
+
+def equal_weights(held_symbols: List[str], new_picks: List[str], max_count: int) -> Dict[str, float]:
+    """
+    Equal target weights for every held symbol, even past `max_count`, then for the new picks that fit in the free
+    slots in rank order. Held symbols only leave the targets when the caller drops them from `held_symbols`
+    """
+    held_symbols = list(dict.fromkeys(held_symbols))
+    free_slots = max(max_count - len(held_symbols), 0)
+    targets = held_symbols + [symbol for symbol in dict.fromkeys(new_picks) if symbol not in held_symbols][:free_slots]
+    return {symbol: 1 / max(max_count, len(targets)) for symbol in targets}
+
+
+@inject
+class RebalanceService(object):
+    """
+    Executes a rebalance as two concurrent waves: all sells first, then all buys once the sells are done.
+    Order quantities are computed by the caller from one batched price snapshot, and each wave waits on the
+    order status instead of sleeping for a fixed amount of time.
+    """
+
+    def __init__(self):
+        self.order_service: OrderService = di[OrderService]
+        self.data_service: DataService = di[DataService]
+        self.position_service: PositionService = di[PositionService]
+        self.notification: Notification = di[Notification]
+        self.rate_limiter = RateLimiter(BROKER_CALLS_PER_MINUTE, 60)
+
+    '''
+    Copy of the service that places and sizes the orders as `strategy`, for strategies sharing the account.
+    The rate limiter stays shared, it is the account's quota
+    '''
+    def for_strategy(self, strategy: str) -> 'RebalanceService':
+        scoped = copy.copy(self)
+        scoped.order_service = self.order_service.for_strategy(strategy)
+        scoped.position_service = self.position_service.for_strategy(strategy)
+        return scoped
+
+    def get_price_snapshot(self, symbols: List[str]) -> Dict[str, float]:
+        return self.data_service.get_current_prices(symbols)
+
+    def rebalance_to_weights(self, target_weights: Dict[str, float], portfolio_value: float,
+                             held_symbols: Iterable[str], min_trade_value: float = 0,
+                             max_qty: int = None) -> RebalanceReport:
+        """
+        Moves the positions of `held_symbols` (the caller's own) to `target_weights` of `portfolio_value` with the
+        minimal set of delta orders. Held symbols that are not part of `target_weights` are liquidated, positions
+        of any other symbol are left alone.
+        """
+        held_symbols = set(held_symbols)
+        current_qty = {symbol: qty for symbol, qty in self.position_service.get_held_qty().items()
+                       if symbol in held_symbols}
+        prices = self.get_price_snapshot(list(current_qty) + list(target_weights))
+
+        delta: PortfolioDelta = PortfolioDiff.compute(current_qty, target_weights, prices, portfolio_value,
+                                                      min_trade_value=min_trade_value, max_qty=max_qty)
+        return self.execute(delta.sells, delta.buys, prices)
+
+    def execute(self, to_be_sold: Dict[str, int], to_be_bought: Dict[str, int],
+                prices: Dict[str, float] = None) -> RebalanceReport:
+        prices = prices or {}
+        started = time.monotonic()
+
+        sells = [RebalanceOrder(sym, OrderSide.SELL, qty, prices.get(sym))
+                 for sym, qty in to_be_sold.items() if qty > 0]
+        buys = [RebalanceOrder(sym, OrderSide.BUY, qty, prices.get(sym))
+                for sym, qty in to_be_bought.items() if qty > 0]
+
+        # Buying power is only released once the sells are filled
+        self._run_wave(sells)
+        self._run_wave(buys)
+
+        report = RebalanceReport(sells + buys, time.monotonic() - started)
+        self._report(report)
+        return report
+
+    def _run_wave(self, orders: List[RebalanceOrder]) -> None:
+        if not orders:
+            return
+
+        submitted_after = datetime.now(timezone.utc) - timedelta(seconds=5)
+        wave_started = time.monotonic()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=MAX_CONCURRENT_ORDERS) as executor:
+            list(executor.map(self._submit, orders))
+
+        self._await_fills([order for order in orders if order.order_id], submitted_after, wave_started)
+
+    def _submit(self, order: RebalanceOrder) -> None:
+        started = time.monotonic()
+        self.rate_limiter.acquire()
+        if order.side == OrderSide.SELL:
+            order_id = self.order_service.market_sell(order.symbol, order.qty)
+        else:
+            order_id = self.order_service.market_buy(order.symbol, order.qty)
+
+        order.submit_latency_secs = time.monotonic() - started
+        order.order_id = str(order_id) if order_id else None
+        order.status = 'submitted' if order_id else 'failed'
+
+    def _await_fills(self, orders: List[RebalanceOrder], submitted_after: datetime, wave_started: float) -> None:
+        pending: Dict[str, RebalanceOrder] = {order.order_id: order for order in orders}
+        deadline = time.monotonic() + FILL_TIMEOUT_SECS
+
+        while pending and time.monotonic() < deadline:
+            # One request returns the status of every order in the wave
+            self.rate_limiter.acquire()
+            try:
+                broker_orders: Dict[str, Order] = self.order_service.get_orders_by_ids(list(pending), submitted_after)
+            except Exception as ex:
+                logger.warning(f"Could not fetch order status: {ex}")
+                broker_orders = {}
+
+            for order_id, broker_order in broker_orders.items():
+                order = pending[order_id]
+                order.status = broker_order.status.value
+                order.filled_qty = float(broker_order.filled_qty or 0)
+                if broker_order.filled_avg_price is not None:
+                    order.filled_avg_price = float(broker_order.filled_avg_price)
+
+                if order.status in TERMINAL_STATUSES:
+                    order.fill_latency_secs = time.monotonic() - wave_started
+                    self.order_service.save_order_update(broker_order)
+                    del pending[order_id]
+
+            if pending:
+                time.sleep(FILL_POLL_INTERVAL_SECS)
+
+        for order in pending.values():
+            logger.warning(f"{order.symbol}: {order.side} order {order.order_id} is still {order.status} "
+                           f"after {FILL_TIMEOUT_SECS} seconds")
+
+    def _report(self, report: RebalanceReport) -> None:
+        if not report.orders:
+            logger.info("Nothing to rebalance")
+            return
+
+        msg = f"Rebalance took {report.total_latency_secs:.1f}s for {len(report.orders)} orders " \
+              f"({len(report.filled)} filled)\n"
+        msg += "Symbol  Side  Qty    Ref $    Fill $   Slip(bps)\n"
+        for order in report.orders:
+            ref_price = f"{order.ref_price:8.2f}" if order.ref_price else f"{'-':>8}"
+            fill_price = f"{order.filled_avg_price:8.2f}" if order.filled_avg_price else f"{'-':>8}"
+            slippage = f"{order.slippage_bps:9.1f}" if order.slippage_bps is not None else f"{order.status:>9}"
+            msg += f"{order.symbol:<7} {order.side.value:<4} {order.qty:>4} {ref_price} {fill_price} {slippage}\n"
+
+        if report.avg_slippage_bps is not None:
+            msg += f"Average slippage: {report.avg_slippage_bps:.1f} bps\n"
+        logger.info(msg)
+        self.notification.notify(msg)
@@ -0,0 +1,51 @@
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+
+# Trading days per period of FMP's stock price change
+PERIOD_TRADING_DAYS = {'1D': 1, '5D': 5, '1M': 21, '3M': 63, '6M': 126, '1Y': 252, '3Y': 756, '5Y': 1260,
+                       '10Y': 2520}
+PRICE_CHANGE_COLUMNS = ['symbol', '1D', '5D', '1M', '3M', '6M', 'ytd', '1Y', '3Y', '5Y', '10Y', 'max']
+
+
+class ReturnsCalculator:
+    """
+    Computes FMP's stock price change (% change over 1D ... 10Y, ytd and max) for every symbol of a matrix of daily
+    closes (dates x symbols) at once. Changes are measured from each symbol's last close, periods the history is
+    too short for are NaN.
+    """
+
+    @classmethod
+    def price_change(cls, closes: DataFrame) -> DataFrame:
+        closes = closes.sort_index().dropna(axis=1, how='all')
+        if closes.empty:
+            return DataFrame(columns=PRICE_CHANGE_COLUMNS)
+
+        values = closes.to_numpy(dtype=np.float64)
+        # Halted days and late listings are filled with the previous close
+        filled = closes.ffill().to_numpy(dtype=np.float64)
+        valid = ~np.isnan(values)
+        row_count = len(values)
+        columns = np.arange(values.shape[1])
+
+        first_idx = valid.argmax(axis=0)
+        last_idx = row_count - 1 - valid[::-1].argmax(axis=0)
+        last_close = values[last_idx, columns]
+
+        def change_since(past_idx: np.ndarray) -> np.ndarray:
+            past_close = filled[np.clip(past_idx, 0, row_count - 1), columns]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                change = (last_close / past_close - 1) * 100
+            return np.where((past_idx >= first_idx) & (past_close > 0), change, np.nan)
+
+        result = {'symbol': closes.columns.to_numpy()}
+        for period, trading_days in PERIOD_TRADING_DAYS.items():
+            result[period] = change_since(last_idx - trading_days)
+
+        # Year to date starts at the last close of the previous year
+        dates = closes.index.to_numpy()
+        year_start = pd.Timestamp(year=pd.Timestamp(dates[last_idx.max()]).year, month=1, day=1).to_datetime64()
+        result['ytd'] = change_since(np.full(len(columns), np.searchsorted(dates, year_start) - 1))
+        result['max'] = change_since(first_idx)
+
+        return DataFrame(result, columns=PRICE_CHANGE_COLUMNS)
@@ -0,0 +1,154 @@
+import json
+import struct
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from core.logger import logger
+from services.bar_store import BarStore, BAR_DTYPE
+
+# Header: its length (8 bytes), then JSON with symbol -> [first record, record count]
+HEADER_LENGTH = struct.Struct('<Q')
+# Records start on a cache line
+RECORD_ALIGNMENT = 64
+
+
+class SharedBarCache(object):
+    """
+    Bars of many symbols in a single shared memory block, so worker processes share one copy instead of each
+    downloading or unpickling its own. A loader process creates the block with `create()`, workers `attach()` to it
+    by name and get read-only NumPy views (BAR_DTYPE records) without copying. The block starts with an index of
+    symbol -> (first record, record count), all records of a symbol are contiguous and sorted by date.
+    """
+
+    def __init__(self, shm: SharedMemory, index: Dict[str, Tuple[int, int]], records: np.ndarray, owner: bool):
+        self.shm = shm
+        self.index = index
+        self.records = records
+        self.owner = owner
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    @classmethod
+    def create(cls, bars_by_symbol: Dict[str, np.ndarray], name: str = None) -> 'SharedBarCache':
+        cache = cls._allocate({symbol: len(bars) for symbol, bars in bars_by_symbol.items()}, name)
+        for symbol, bars in bars_by_symbol.items():
+            first, count = cache.index[symbol]
+            cache.records[first:first + count] = bars
+        return cache
+
+    '''
+    Loads the stored bars of `symbols` between `start` and `end` from a BarStore into a new cache. The block is
+    sized from the lengths of the memory-mapped chunks, then every chunk is copied straight into its place, so
+    the bars are never held in private memory on the way
+    '''
+    @classmethod
+    def from_bar_store(cls, bar_store: BarStore, symbols: List[str], start=None, end=None,
+                       name: str = None) -> 'SharedBarCache':
+        counts = {symbol: sum(len(chunk) for chunk in bar_store.iter_chunks(symbol, start, end))
+                  for symbol in dict.fromkeys(symbols)}
+        cache = cls._allocate({symbol: count for symbol, count in counts.items() if count}, name)
+        for symbol, (first, count) in cache.index.items():
+            end_record = first + count
+            for chunk in bar_store.iter_chunks(symbol, start, end):
+                # A month rewritten since it was counted must not overflow into the next symbol
+                chunk = chunk[:end_record - first]
+                cache.records[first:first + len(chunk)] = chunk
+                first += len(chunk)
+        return cache
+
+    '''
+    New block with the index of symbol -> record count written, the records are left for the caller to fill
+    '''
+    @classmethod
+    def _allocate(cls, counts: Dict[str, int], name: str = None) -> 'SharedBarCache':
+        index: Dict[str, Tuple[int, int]] = {}
+        offset = 0
+        for symbol, count in counts.items():
+            index[symbol] = (offset, count)
+            offset += count
+
+        header = json.dumps({'index': index}).encode()
+        records_start = _align(HEADER_LENGTH.size + len(header))
+        shm = SharedMemory(name=name, create=True, size=max(records_start + offset * BAR_DTYPE.itemsize, 1))
+        HEADER_LENGTH.pack_into(shm.buf, 0, len(header))
+        shm.buf[HEADER_LENGTH.size:HEADER_LENGTH.size + len(header)] = header
+
+        records = np.ndarray(offset, dtype=BAR_DTYPE, buffer=shm.buf, offset=records_start)
+        logger.info(f"Shared bar cache {shm.name}: {len(index)} symbols, {offset} bars, "
+                    f"{shm.size / 1024 / 1024:.1f} MiB")
+        return cls(shm, index, records, owner=True)
+
+    '''
+    Read-only view of a cache created by another process
+    '''
+    @classmethod
+    def attach(cls, name: str) -> 'SharedBarCache':
+        shm = SharedMemory(name=name)
+        # Before Python 3.13 attaching registers the block with this process' resource tracker, which would
+        # unlink it when the worker exits, under the feet of the loader and of the other workers
+        try:
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        except Exception as ex:
+            logger.debug(f"Shared bar cache {name}: Could not unregister from the resource tracker: {ex}")
+
+        header_length, = HEADER_LENGTH.unpack_from(shm.buf, 0)
+        header = json.loads(bytes(shm.buf[HEADER_LENGTH.size:HEADER_LENGTH.size + header_length]))
+        index = {symbol: tuple(location) for symbol, location in header['index'].items()}
+        record_count = sum(count for _, count in index.values())
+        records = np.ndarray(record_count, dtype=BAR_DTYPE, buffer=shm.buf,
+                             offset=_align(HEADER_LENGTH.size + header_length))
+        records.flags.writeable = False
+        return cls(shm, index, records, owner=False)
+
+    def symbols(self) -> List[str]:
+        return list(self.index)
+
+    def get(self, symbol: str) -> Optional[np.ndarray]:
+        if symbol not in self.index:
+            return None
+        first, count = self.index[symbol]
+        return self.records[first:first + count]
+
+    '''
+    Same as BarStore.iter_chunks, so a cache can stand in for the store in Strategy.backtest
+    '''
+    def iter_chunks(self, symbol: str, start=None, end=None) -> Iterator[np.ndarray]:
+        bars = self.get(symbol)
+        if bars is None or len(bars) == 0:
+            return
+        dates = bars['date']
+        first = np.searchsorted(dates, np.datetime64(start, 'D').astype(dates.dtype)) if start is not None else 0
+        last = np.searchsorted(dates, (np.datetime64(end, 'D') + 1).astype(dates.dtype)) if end is not None \
+            else len(bars)
+        bars = bars[first:last]
+        months = bars['date'].astype('datetime64[M]')
+        for chunk in np.split(bars, np.flatnonzero(months[1:] != months[:-1]) + 1):
+            if len(chunk):
+                yield chunk
+
+    '''
+    Workers only close their view, the owner also frees the block
+    '''
+    def close(self) -> None:
+        self.records = None
+        try:
+            self.shm.close()
+        except BufferError:
+            logger.warning(f"Shared bar cache {self.name}: Views of the bars are still in use, the mapping stays open")
+        if self.owner:
+            self.shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def _align(offset: int) -> int:
+    return (offset + RECORD_ALIGNMENT - 1) // RECORD_ALIGNMENT * RECORD_ALIGNMENT
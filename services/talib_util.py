@@ -2,6 +2,8 @@ from enum import Enum
 
 import pandas as pd
 
+from core.tracing import traced
+
 
 class Trend(Enum):
     BULL = "BULL"
@@ -12,6 +14,7 @@ class Trend(Enum):
 class TalibUtil:
 
     @classmethod
+    @traced('indicators')
     def volatility(cls, df, period=14):
         """
         Calculate the volatility of a stock over the last `period` days.
@@ -33,6 +36,7 @@ class TalibUtil:
         return volatility
 
     @classmethod
+    @traced('indicators')
     def atr(cls, df, period=14):
         high_low = df['high'] - df['low']
         high_close = abs(df['high'] - df['close'].shift())
@@ -48,13 +52,30 @@ class TalibUtil:
         atr_df['ATR'] = atr
         return atr_df
 
+    '''
+    TA-Lib's EMA and RSI. TA-Lib is imported on first use, the other indicators do not need it
+    '''
+    @classmethod
+    @traced('indicators')
+    def ema(cls, series, period):
+        import talib
+        return talib.EMA(series, timeperiod=period)
+
+    @classmethod
+    @traced('indicators')
+    def rsi(cls, series, period=14):
+        import talib
+        return talib.RSI(series, timeperiod=period)
+
     @classmethod
+    @traced('indicators')
     def vwap(cls, df):
         vol = df['volume'].values
         tp = (df['low'] + df['close'] + df['high']).div(3).values
         return df.assign(VWAP=(tp * vol).cumsum() / vol.cumsum())
 
     @classmethod
+    @traced('indicators')
     def heikenashi(cls, df):
         heikinashi_df = pd.DataFrame(index=df.index.values, columns=['open', 'high', 'low', 'close'])
         heikinashi_df['close'] = (df['open'] + df['high'] + df['low'] + df['close']) / 4
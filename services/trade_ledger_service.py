@@ -0,0 +1,120 @@
+import threading
+from dataclasses import dataclass
+from datetime import date, datetime
+from typing import Dict, List, Optional, Tuple
+
+from kink import inject, di
+
+from core.database import Database
+from core.db_tables import DailyPnlEntity, SymbolPnlEntity, TradeEntity
+from core.logger import logger
+
+
+@dataclass
+class Fill:
+    order_id: str
+    symbol: str
+    side: str
+    qty: float
+    price: float
+    filled_at: datetime
+
+
+@inject
+class TradeLedgerService(object):
+    """
+    Matches fills into round trip trades (FIFO) as they arrive, and keeps the daily and per symbol realized P/L
+    up to date in their own tables. Readers look up the aggregates instead of replaying every filled order.
+
+    Alpaca reports cumulative fill quantities, so only the quantity filled since the last update of an order is
+    matched. Updating the same order twice is a no-op.
+    """
+
+    def __init__(self):
+        self.db: Database = di[Database]
+        self._lock = threading.Lock()
+
+    def record_fill(self, order_id: str, symbol: str, side: str, filled_qty: float, filled_avg_price: float,
+                    filled_at: datetime) -> List[dict]:
+        if not filled_qty or not filled_avg_price or filled_at is None:
+            return []
+
+        with self._lock:
+            processed = self.db.get_ledger_fill(order_id)
+            processed_qty = float(processed.filled_qty) if processed else 0.0
+            processed_cost = processed_qty * float(processed.filled_avg_price) if processed else 0.0
+
+            qty = filled_qty - processed_qty
+            if qty <= 0:
+                return []
+
+            # Price of just the new part of a partially filled order
+            price = (filled_qty * filled_avg_price - processed_cost) / qty
+            side = str(getattr(side, 'value', side)).lower().split('.')[-1]
+            fill = Fill(order_id, symbol, side, qty, price, filled_at)
+
+            lot_updates, new_lot, trades = self._match(fill)
+            self.db.apply_ledger_fill(order_id, symbol, filled_qty, filled_avg_price, lot_updates, new_lot, trades)
+
+        for trade in trades:
+            logger.info(f"Closed {trade['side']} trade: {trade['qty']} {symbol} {trade['entry_price']:.2f} -> "
+                        f"{trade['exit_price']:.2f}, P/L ${trade['realized_pl']:.2f}")
+        return trades
+
+    def _match(self, fill: Fill) -> Tuple[Dict[int, float], Optional[dict], List[dict]]:
+        remaining = fill.qty if fill.side == 'buy' else -fill.qty
+        lot_updates: Dict[int, float] = {}
+        trades: List[dict] = []
+
+        for lot in self.db.get_open_lots(fill.symbol):
+            lot_qty = float(lot.qty)
+            # Only lots on the opposite side get closed by this fill
+            if remaining == 0 or (lot_qty > 0) == (remaining > 0):
+                continue
+
+            matched = min(abs(lot_qty), abs(remaining))
+            direction = 1 if lot_qty > 0 else -1
+            trades.append({
+                'symbol': fill.symbol,
+                'side': 'long' if direction > 0 else 'short',
+                'qty': matched,
+                'entry_price': float(lot.price),
+                'exit_price': fill.price,
+                'realized_pl': direction * matched * (fill.price - float(lot.price)),
+                'entry_order_id': lot.order_id,
+                'exit_order_id': fill.order_id,
+                'opened_at': lot.opened_at,
+                'closed_at': fill.filled_at,
+            })
+            lot_updates[lot.id] = lot_qty - direction * matched
+            remaining += direction * matched
+
+        new_lot = None
+        if remaining != 0:
+            new_lot = {'symbol': fill.symbol, 'qty': remaining, 'price': fill.price, 'order_id': fill.order_id,
+                       'opened_at': fill.filled_at}
+        return lot_updates, new_lot, trades
+
+    '''
+    Rebuilds the whole ledger from the saved orders, e.g. after the ledger tables were added to an existing DB
+    '''
+    def rebuild(self) -> int:
+        self.db.clear_ledger()
+        orders = self.db.get_all_filled_orders()
+        for order in orders:
+            self.record_fill(str(order.id), order.symbol, order.side, float(order.filled_qty),
+                             float(order.filled_avg_price), order.filled_at)
+        logger.info(f"Trade ledger rebuilt from {len(orders)} filled orders")
+        return len(orders)
+
+    def get_daily_pnl(self, for_date: date) -> List[DailyPnlEntity]:
+        return self.db.get_daily_pnl(for_date)
+
+    def get_daily_pnl_totals(self, limit: int = 30) -> List[dict]:
+        return self.db.get_daily_pnl_totals(limit)
+
+    def get_symbol_pnl(self) -> List[SymbolPnlEntity]:
+        return self.db.get_symbol_pnl()
+
+    def get_trades_closed_on(self, for_date: date) -> List[TradeEntity]:
+        return self.db.get_trades_closed_on(for_date)
@@ -1,18 +1,21 @@
+import logging
 from typing import List, Dict
 
 from alpaca.trading import TradeAccount
 from kink import di
 from pandas import DataFrame
-from scipy import stats
 
-from core.logger import logger
+from core.logger import logger, log_frame
 from core.schedule import SafeScheduler, JobRunType
 from services.notification_service import Notification
 from universe.BarchartUniverse import BarchartUniverse
 from services.account_service import AccountService
 from services.data_service import DataService
+from services.history_store import HistoryStore
+from services.hqm_util import HqmUtil, HQM_SCORE
 from services.order_service import OrderService
 from services.position_service import PositionService, Position
+from services.rebalance_service import RebalanceService, equal_weights
 from strategies.strategy import Strategy
 
 '''
@@ -24,7 +27,9 @@ from strategies.strategy import Strategy
 '''
 
 MAX_STOCKS_TO_PURCHASE = 30
+MIN_TRADE_FRACTION = 0.05  # Skip adjustments worth less than 5% of a position
 TIME_PERIOD_WEIGHTS = {'1Y': 1, '1M': 3, '3M': 3, '6M': 2}
+PERCENTILE_LABEL = '{} Return Percentile'
 
 
 class BarchartMomentumStrategy(Strategy):
@@ -34,9 +39,11 @@ class BarchartMomentumStrategy(Strategy):
         self.order_service: OrderService = di[OrderService]
         self.position_service: PositionService = di[PositionService]
         self.data_service: DataService = di[DataService]
+        self.history_store: HistoryStore = di[HistoryStore]
         self.account_service: AccountService = di[AccountService]
         self.schedule: SafeScheduler = di[SafeScheduler]
         self.notification: Notification = di[Notification]
+        self.rebalance_service: RebalanceService = di[RebalanceService]
 
         self.stock_picks_today: DataFrame = None
         self.stocks_traded_today: List[str] = []
@@ -55,8 +62,8 @@ class BarchartMomentumStrategy(Strategy):
 
     def init_data(self) -> None:
         self.stock_picks_today: DataFrame = self.prep_stocks()
-        logger.info("Stock picks for today")
-        logger.info(self.stock_picks_today)
+        log_frame("Stock picks for today:", self.stock_picks_today, logging.INFO, max_rows=MAX_STOCKS_TO_PURCHASE,
+                  head=True)
         self._run_trading()
 
     # ''' Since this is a strict LONG TERM strategy, run it every 24 hrs '''
@@ -74,29 +81,19 @@ class BarchartMomentumStrategy(Strategy):
         universe: List[str] = list(set(from_barchart).union(from_positions))
 
         # Fetch stock price change data
-        hqm_base: DataFrame = self.data_service.stock_price_change(universe)
+        hqm_base: DataFrame = self.history_store.price_change(universe)
 
         # Filter out records where '1M' price change is greater than 150%
         hqm = hqm_base[hqm_base['1M'] <= 150]
 
-        # Calculate return percentiles with weights
-        for time_period, weight in TIME_PERIOD_WEIGHTS.items():
-            hqm[f'{time_period} Return Percentile'] = stats.percentileofscore(
-                hqm[time_period], hqm[time_period]) / 100 * weight
-
-        # Calculate weighted HQM Score
-        weighted_scores = hqm[[f'{time_period} Return Percentile' for time_period in TIME_PERIOD_WEIGHTS.keys()]]
-        hqm['HQM Score'] = weighted_scores.sum(axis=1)
-
-        # Sort by HQM Score and return the top 51 rows
-        hqm = hqm.sort_values(by='HQM Score', ascending=False).head(51)
+        # Score all periods at once and keep the top 51 rows
+        hqm = HqmUtil.top_n(HqmUtil.score(hqm, TIME_PERIOD_WEIGHTS, PERCENTILE_LABEL), 51)
 
         # Print the HQM stocks
         self.show_stocks_df("HQM stocks today:\n", hqm)
 
-        # Print the DataFrame
-        logger.info(hqm[['HQM Score'] + [f'{time_period} Return Percentile' for time_period in
-                                         TIME_PERIOD_WEIGHTS.keys()]])
+        log_frame("HQM scores:", hqm[[HQM_SCORE] + [PERCENTILE_LABEL.format(time_period) for time_period in
+                                                    TIME_PERIOD_WEIGHTS.keys()]], head=True)
 
         return hqm
 
@@ -119,13 +116,11 @@ class BarchartMomentumStrategy(Strategy):
 
             # Print the stocks to be liquidated
             header_str = "Positions to be sold now:\n"
-            cur_df: DataFrame = self.data_service.stock_price_change(to_be_removed)
+            cur_df: DataFrame = self.history_store.price_change(to_be_removed)
             self.show_stocks_df(header_str, cur_df)
 
-            # Liquidate the selected stocks
             for stock in to_be_removed:
                 self.notify_to_sell(held_stocks[stock])
-                self.order_service.market_sell(stock, int(held_stocks[stock].qty))
                 del held_stocks[stock]
 
         else:
@@ -134,36 +129,21 @@ class BarchartMomentumStrategy(Strategy):
         buffer: int = 10
         top_picks_addn = top_picks_today[:MAX_STOCKS_TO_PURCHASE + buffer]
         top_picks_final = [stock for stock in top_picks_addn if stock not in to_be_removed]
-        self.rebalance_stocks(top_picks_final)
 
-    def rebalance_stocks(self, symbols: List[str]):
+        # The liquidations are executed by the rebalance, ahead of the purchases
+        self.rebalance_stocks(list(held_stocks), top_picks_final, list(held_stocks) + to_be_removed)
+
+    def rebalance_stocks(self, held_to_keep: List[str], new_picks: List[str], held_symbols: List[str]):
         account = self.account_service.get_account_details()
-        allocated_amt_per_symbol = float(account.portfolio_value) / MAX_STOCKS_TO_PURCHASE
-
-        held_stocks = {pos.symbol: int(pos.qty) for pos in self.position_service.get_all_positions()}
-        position_count = 0
-
-        def calculate_qty_and_buy(sym: str) -> None:
-            nonlocal position_count
-            qty = int(allocated_amt_per_symbol / self.data_service.get_current_price(sym))
-            qty_to_add = min(qty, qty - held_stocks.get(sym, 0))
-            position_count += 1
-            if qty_to_add > 0:
-                self.order_service.market_buy(sym, int(qty_to_add))
-
-        # Rebalance held stocks
-        for symbol in held_stocks:
-            if position_count > MAX_STOCKS_TO_PURCHASE:
-                break
-            calculate_qty_and_buy(symbol)
-
-        # Rebalance selected symbols
-        for symbol in set(symbols):
-            if position_count > MAX_STOCKS_TO_PURCHASE:
-                break
-            if symbol not in held_stocks:
-                calculate_qty_and_buy(symbol)
+        # Only the share of the portfolio allocated to this strategy is balanced
+        portfolio_value = float(account.portfolio_value) * self.allocation
+        allocated_amt_per_symbol = portfolio_value / MAX_STOCKS_TO_PURCHASE
+
+        # Held stocks are all kept, then the new picks fill up the portfolio in rank order
+        target_weights = equal_weights(held_to_keep, new_picks, MAX_STOCKS_TO_PURCHASE)
 
+        self.rebalance_service.rebalance_to_weights(target_weights, portfolio_value, held_symbols,
+                                                    min_trade_value=MIN_TRADE_FRACTION * allocated_amt_per_symbol)
         logger.info("All stocks rebalanced for today")
 
     def show_stocks_df(self, msg: str, df: DataFrame):
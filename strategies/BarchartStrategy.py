@@ -97,7 +97,7 @@ class BarchartStrategy(Strategy):
 
     def rebalance_stocks(self, symbols: List[str]):
         account = self.account_service.get_account_details()
-        allocated_amt_per_symbol = float(account.portfolio_value) / MAX_STOCKS_TO_PURCHASE
+        allocated_amt_per_symbol = float(account.portfolio_value) * self.allocation / MAX_STOCKS_TO_PURCHASE
 
         held_stocks = {pos.symbol: int(pos.qty) for pos in self.position_service.get_all_positions()}
         position_count = 0
@@ -130,7 +130,7 @@ class BarchartStrategy(Strategy):
 
     def purchase_stocks(self, symbols: List[str]):
         account: TradeAccount = self.account_service.get_account_details()
-        buying_power = float(account.buying_power) / int(account.multiplier)
+        buying_power = float(account.buying_power) * self.allocation / int(account.multiplier)
         position_size_per_symbol: float = buying_power / len(symbols)
 
         for symbol in symbols:
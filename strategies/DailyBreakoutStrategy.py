@@ -1,22 +1,20 @@
 from dataclasses import dataclass
-from datetime import date
 from enum import Enum
-from pathlib import Path
 from typing import List
 from uuid import UUID
 
-import pandas
 from alpaca.trading import OrderSide
-from finta import TA as talib
-from fmp_python.fmp import Interval
 from kink import di, inject
 
 from core.logger import logger
 from core.schedule import SafeScheduler, JobRunType
 from universe.watchlist import WatchList
-from services.data_service import DataService
+from services.bar_resampler import BarResampler
+from services.data_service import DataService, Timeframe
+from services.feature_store import FeatureStore
 from services.order_service import OrderService
 from services.position_service import PositionService
+from services.talib_util import TalibUtil
 from strategies.strategy import Strategy
 
 '''
@@ -67,19 +65,19 @@ class DailyBreakoutStrategy(Strategy):
     # TODO : Move the constants to Algo config
     STOCK_MIN_PRICE = 20
     STOCK_MAX_PRICE = 500
-    BARSET_RECORDS = 60
 
-    AMOUNT_PER_ORDER = 1000
+    AMOUNT_PER_ORDER = 1000  # At an allocation of 1.0, scaled by the strategy's share of the portfolio
     MAX_NUM_STOCKS = 40
     MAX_STOCK_WATCH_COUNT = 100
 
     def __init__(self):
         self.name = "DailyBreakoutStrategy"
-        self.watchlist = WatchList()
+        self.watchlist: WatchList = di[WatchList]
         self.order_service: OrderService = di[OrderService]
         self.position_service: PositionService = di[PositionService]
         self.schedule: SafeScheduler = di[SafeScheduler]
         self.data_service: DataService = di[DataService]
+        self.feature_store: FeatureStore = di[FeatureStore]
 
         self.pre_stock_picks: List[BreakoutStock] = []
         self.todays_stock_picks: List[BreakoutStock] = []
@@ -113,6 +111,7 @@ class DailyBreakoutStrategy(Strategy):
 
         # First check if stock not already purchased
         held_stocks = [x.symbol for x in self.position_service.get_all_positions()]
+        amount_per_order = DailyBreakoutStrategy.AMOUNT_PER_ORDER * self.allocation
 
         for stock in self.todays_stock_picks:
             logger.info(f"Checking {stock.symbol} to place an order ...")
@@ -127,7 +126,7 @@ class DailyBreakoutStrategy(Strategy):
                     if current_market_price > stock.upper_bound + (1 * stock.running_atr) \
                             and len(self.stocks_traded_today) < DailyBreakoutStrategy.MAX_NUM_STOCKS:
 
-                        no_of_shares = int(DailyBreakoutStrategy.AMOUNT_PER_ORDER / current_market_price)
+                        no_of_shares = int(amount_per_order / current_market_price)
                         order_id = self.order_service.place_trailing_bracket_order(stock.symbol, OrderSide.BUY,
                                                                                    no_of_shares, 2 * stock.running_atr)
 
@@ -144,7 +143,7 @@ class DailyBreakoutStrategy(Strategy):
                             and current_market_price < stock.lower_bound - (1 * stock.running_atr) \
                             and len(self.stocks_traded_today) < DailyBreakoutStrategy.MAX_NUM_STOCKS:
 
-                        no_of_shares = int(DailyBreakoutStrategy.AMOUNT_PER_ORDER / current_market_price)
+                        no_of_shares = int(amount_per_order / current_market_price)
                         order_id = self.order_service.place_trailing_bracket_order(stock.symbol, OrderSide.SELL,
                                                                                    no_of_shares, 2 * stock.running_atr)
 
@@ -166,7 +165,7 @@ class DailyBreakoutStrategy(Strategy):
                     if stock.side == 'long' and self.order_service.is_shortable(stock.symbol) \
                             and current_market_price < stock.lower_bound + (1 * stock.running_atr):
 
-                        no_of_shares = int(DailyBreakoutStrategy.AMOUNT_PER_ORDER / current_market_price)
+                        no_of_shares = int(amount_per_order / current_market_price)
                         order_id = self.order_service \
                             .place_trailing_bracket_order(stock.symbol, OrderSide.SELL, no_of_shares, 2 * stock.running_atr)
 
@@ -180,7 +179,7 @@ class DailyBreakoutStrategy(Strategy):
                     # Go long the previously closed 'short' positions
                     if stock.side == 'short' and current_market_price > stock.upper_bound - (1 * stock.running_atr):
 
-                        no_of_shares = int(DailyBreakoutStrategy.AMOUNT_PER_ORDER / current_market_price)
+                        no_of_shares = int(amount_per_order / current_market_price)
                         order_id = self.order_service.place_trailing_bracket_order(stock.symbol, OrderSide.BUY,
                                                                                    no_of_shares, 2 * stock.running_atr)
 
@@ -226,13 +225,13 @@ class DailyBreakoutStrategy(Strategy):
         for stock_pick in self.pre_stock_picks:
 
             logger.info(f"Prepping for ... {stock_pick.symbol}")
-            one_min_df = self.data_service.get_intra_day_bars(stock_pick.symbol, Interval.MIN_1)
-            five_min_df = self.data_service.get_intra_day_bars(stock_pick.symbol, Interval.MIN_5)
+            # One download, the 5 min bars are resampled from the 1 min bars
+            bar_set = self.data_service.get_intra_day_bar_set(stock_pick.symbol, [Timeframe.MIN_5])
 
-            opening_range = self._populate_opening_range(stock_pick.symbol, one_min_df, five_min_df)
+            opening_range = self._populate_opening_range(stock_pick.symbol, bar_set[Timeframe.MIN_1])
             if len(opening_range) == 2:
                 lower_bound, upper_bound = opening_range
-                running_atr = self._get_running_atr(five_min_df)
+                running_atr = self._get_running_atr(bar_set[Timeframe.MIN_5])
 
                 orb_stock = BreakoutStock(stock_pick.symbol, stock_pick.atr_to_price, stock_pick.side,
                                           lower_bound, upper_bound, running_atr)
@@ -244,72 +243,24 @@ class DailyBreakoutStrategy(Strategy):
     def _get_pre_stock_picks(self) -> List[BreakoutStock]:
         # get the best buy and strong buy stock from Nasdaq.com and sort them by the best stocks
 
-        logger.info("Downloading data ...")
+        logger.info("Reading features ...")
         from_watchlist: List[str] = self.watchlist.get_universe(2000000, 1.0)
-        stock_info: List[BreakoutStock] = []
+        features = self.feature_store.get_features(from_watchlist)
 
-        for count, stock in enumerate(from_watchlist):
-
-            df = None
-            try:
-                df = self._get_stock_df(stock)
-            except Exception as ex:
-                logger.warning(f"symbol {stock} does not exist: {ex}")
-
-            if df is None:
-                continue
-
-            stock_price = df.iloc[-1]['close']
-            if stock_price > DailyBreakoutStrategy.STOCK_MAX_PRICE or stock_price < DailyBreakoutStrategy.STOCK_MIN_PRICE:
-                continue
-
-            try:
-                df['ATR'] = talib(df['high'], df['low'], df['close'], timeperiod=14)
-                df['ATR-slope-fast'] = talib.EMA(df['ATR'], period=9)
-                df['ATR-slope-slow'] = talib.EMA(df['ATR'], period=14)
-                increasing_atr = df.iloc[-1]['ATR-slope-fast'] > df.iloc[-1]['ATR-slope-slow'] \
-                                 and df.iloc[-5]['ATR-slope-fast'] > df.iloc[-5]['ATR-slope-slow']
-                atr_to_price = round((df.iloc[-1]['ATR'] / stock_price) * 100, 3)
-
-                # df['RSI'] = talib.RSI(df['close'], timeperiod=14)
-                # df['RSI-slope-fast'] = talib.EMA(df['RSI'], timeperiod=9)
-                # df['RSI-slope-slow'] = talib.EMA(df['RSI'], timeperiod=14)
-
-                # Open long positions for increasing RSI and short positions for decreasing RSI only
-                # long = df.iloc[-1]['RSI-slope-fast'] > df.iloc[-1]['RSI-slope-slow'] \
-                #        and df.iloc[-5]['RSI-slope-fast'] > df.iloc[-5]['RSI-slope-slow']
-                # short = df.iloc[-1]['RSI-slope-fast'] < df.iloc[-1]['RSI-slope-slow'] \
-                #         and df.iloc[-5]['RSI-slope-fast'] < df.iloc[-5]['RSI-slope-slow']
-
-                # choose the most volatile stocks
-                if increasing_atr and atr_to_price > 5 and self.order_service.is_tradable(stock):
-                    logger.info(f'[{count + 1}/{len(from_watchlist)}] -> {stock} '
-                                f'has an ATR:price ratio of {atr_to_price}%')
-                    stock_info.append(BreakoutStock(stock, atr_to_price))
-                    # if long:
-                    #     stock_info.append(ORBStock(stock, atr_to_price, 'long'))
-                    # else:
-                    #     stock_info.append(ORBStock(stock, atr_to_price, 'short'))
-            except Exception as ex:
-                logger.warning(f"Could not process {stock}: {ex}")
+        # choose the most volatile stocks
+        price_in_range = features['close'].between(DailyBreakoutStrategy.STOCK_MIN_PRICE,
+                                                   DailyBreakoutStrategy.STOCK_MAX_PRICE)
+        candidates = features[price_in_range & features['atr_14_increasing'].eq(True)
+                              & (features['atr_14_to_price'] > 5)]
+        stock_info: List[BreakoutStock] = []
+        for count, (stock, atr_to_price) in enumerate(candidates['atr_14_to_price'].items()):
+            if self.order_service.is_tradable(stock):
+                logger.info(f'[{count + 1}/{len(candidates)}] -> {stock} has an ATR:price ratio of {atr_to_price}%')
+                stock_info.append(BreakoutStock(stock, atr_to_price))
 
         pre_stock_picks = sorted(stock_info, key=lambda i: i.atr_to_price, reverse=True)
         return pre_stock_picks[:DailyBreakoutStrategy.MAX_STOCK_WATCH_COUNT]
 
-    def _get_stock_df(self, stock):
-        data_folder = "data"
-        today = date.today().isoformat()
-        df_path = Path("/".join([data_folder, today, stock + ".pkl"]))
-        df_path.parent.mkdir(parents=True, exist_ok=True)
-
-        if df_path.exists():
-            logger.info(f'data for {stock} exists locally')
-            df = pandas.read_pickle(df_path)
-        else:
-            df = self.data_service.get_daily_bars(stock, limit=DailyBreakoutStrategy.BARSET_RECORDS)
-            df.to_pickle(df_path)
-        return df
-
     def place_smart_stop_loss(self, stock: BreakoutStock) -> UUID:
         self.order_service.cancel_order(stock.order_id)
         qty_to_close: int = int(abs(stock.order_qty / 2))
@@ -330,31 +281,16 @@ class DailyBreakoutStrategy(Strategy):
         return order_id
 
     @staticmethod
-    def _populate_opening_range(symbol, one_min_df, five_min_df) -> List[float]:
-        today = date.today().isoformat()
-
-        # because FMP data is received in EST
-        from_time = f'{today} 09:29:00'
-        until_time = f'{today} 10:00:00'
-
-        # fix reduce the no of missing bars
-        one_min_bars = one_min_df[(one_min_df.index > from_time) & (one_min_df.index <= until_time)]
-        five_min_bars = five_min_df[(five_min_df.index > from_time) &
-                                    (five_min_df.index <= until_time)]
-
-        highs = one_min_bars['high'].to_list()
-        highs.extend(five_min_bars['high'].to_list())
-
-        lows = one_min_bars['low'].to_list()
-        lows.extend(five_min_bars['low'].to_list())
-
-        if len(highs) >= 2 and len(lows) >= 2:
-            return [min(lows), max(highs)]
-        logger.warning(f"Record count of 5 and 1 min bars is lesser than threshold for : {symbol}")
+    def _populate_opening_range(symbol, one_min_df) -> List[float]:
+        # 09:30 - 10:00 EST
+        opening_range = BarResampler.opening_range(one_min_df, minutes=30)
+        if opening_range:
+            return list(opening_range)
+        logger.warning(f"Record count of 1 min bars is lesser than threshold for : {symbol}")
         return []
 
     @staticmethod
     def _get_running_atr(five_min_df) -> float:
-        df = five_min_df.tail(50)
-        df['ATR'] = talib.ATR(df, period=30)
-        return round(df.iloc[-1]['ATR'], 2)
+        # atr() works on a copy, the tail of the bar set is not written to
+        atr_df = TalibUtil.atr(five_min_df.tail(50), period=30)
+        return round(float(atr_df.iloc[-1]['ATR']), 2)
@@ -1,10 +1,6 @@
-from datetime import date
-from pathlib import Path
 from statistics import mean
 from typing import List
 
-import pandas
-import talib
 from attr import dataclass
 from fmp_python.fmp import Interval
 from kink import di, inject
@@ -13,6 +9,7 @@ from core.logger import logger
 from core.schedule import SafeScheduler, JobRunType
 from universe.watchlist import WatchList
 from services.data_service import DataService
+from services.feature_store import FeatureStore
 from services.order_service import OrderService
 from services.position_service import PositionService
 
@@ -42,19 +39,21 @@ class LWBreakout(object):
     STOCK_MIN_PRICE = 20
     STOCK_MAX_PRICE = 1000
     MOVED_DAYS = 3
-    BARSET_RECORDS = 60
 
-    AMOUNT_PER_ORDER = 1000
+    AMOUNT_PER_ORDER = 1000  # At an allocation of 1.0, scaled by the strategy's share of the portfolio
+    # Share of the portfolio, set from the STRATEGIES config. Not a Strategy, so it cannot share the account
+    allocation = 1.0
     MAX_NUM_STOCKS = 40
     MAX_STOCK_WATCH_COUNT = 100
 
     def __init__(self):
         self.name = "LWBreakout"
-        self.watchlist = WatchList()
+        self.watchlist: WatchList = di[WatchList]
         self.order_service: OrderService = di[OrderService]
         self.position_service: PositionService = di[PositionService]
         self.schedule: SafeScheduler = di[SafeScheduler]
         self.data_service: DataService = di[DataService]
+        self.feature_store: FeatureStore = di[FeatureStore]
 
         self.todays_stock_picks: List[LWStock] = []
         self.stocks_traded_today: List[str] = []
@@ -77,6 +76,7 @@ class LWBreakout(object):
 
         # First check if stock not already purchased
         held_stocks = [x.symbol for x in self.position_service.get_all_positions()]
+        amount_per_order = LWBreakout.AMOUNT_PER_ORDER * self.allocation
 
         for stock in self.todays_stock_picks:
             logger.info(f"Checking {stock.symbol} to place an order ...")
@@ -91,7 +91,7 @@ class LWBreakout(object):
                     # long
                     if stock.lw_upper_bound < current_market_price and trade_count < LWBreakout.MAX_NUM_STOCKS:
                         logger.info("Long: Current market price.. {}: ${}".format(stock.symbol, current_market_price))
-                        no_of_shares = int(LWBreakout.AMOUNT_PER_ORDER / current_market_price)
+                        no_of_shares = int(amount_per_order / current_market_price)
                         stop_loss = current_market_price - (3 * stock.step)
                         take_profit = current_market_price + (6 * stock.step)
 
@@ -103,7 +103,7 @@ class LWBreakout(object):
                     if self.order_service.is_shortable(stock.symbol) \
                             and stock.lw_lower_bound > current_market_price and trade_count < LWBreakout.MAX_NUM_STOCKS:
                         logger.info("Short: Current market price.. {}: ${}".format(stock.symbol, current_market_price))
-                        no_of_shares = int(LWBreakout.AMOUNT_PER_ORDER / current_market_price)
+                        no_of_shares = int(amount_per_order / current_market_price)
                         stop_loss = current_market_price + (3 * stock.step)
                         take_profit = current_market_price - (6 * stock.step)
 
@@ -114,51 +114,29 @@ class LWBreakout(object):
     def _get_todays_picks(self) -> List[LWStock]:
         # get the best buy and strong buy stock from Nasdaq.com and sort them by the best stocks
 
-        logger.info("Downloading data ...")
+        logger.info("Reading features ...")
         from_watchlist = self.watchlist.get_universe()
-        stock_info: List[LWStock] = []
-
-        for count, stock in enumerate(from_watchlist):
+        features = self.feature_store.get_features(from_watchlist)
 
-            df = self._get_stock_df(stock)
-            if df is None:
-                continue
-
-            stock_price = df.iloc[-1]['close']
-            if stock_price > LWBreakout.STOCK_MAX_PRICE or stock_price < LWBreakout.STOCK_MIN_PRICE:
+        # choose the most volatile stocks
+        candidates = features[features['close'].between(LWBreakout.STOCK_MIN_PRICE, LWBreakout.STOCK_MAX_PRICE)
+                              & features['atr_14_increasing'].eq(True) & (features['atr_14_to_price'] > 5)]
+        stock_info: List[LWStock] = []
+        for count, (stock, yesterdays_record) in enumerate(candidates.iterrows()):
+            if not self.order_service.is_tradable(stock):
                 continue
+            stock_price = yesterdays_record['close']
+            atr_to_price = yesterdays_record['atr_14_to_price']
 
-            try:
-                df = self._get_stock_df(stock)
+            y_change = round((stock_price - yesterdays_record['open']) / yesterdays_record['open'] * 100, 3)
+            y_range = yesterdays_record['high'] - yesterdays_record['low']  # yesterday's range
+            step = round(y_range * 0.25, 3)
 
-                df['ATR'] = talib.ATR(df['high'], df['low'], df['close'], timeperiod=14)
-                df['ATR-slope-fast'] = talib.EMA(df['ATR'], timeperiod=9)
-                df['ATR-slope-slow'] = talib.EMA(df['ATR'], timeperiod=14)
-                increasing_atr = df.iloc[-1]['ATR-slope-fast'] > df.iloc[-1]['ATR-slope-slow'] \
-                                 and df.iloc[-5]['ATR-slope-fast'] > df.iloc[-5]['ATR-slope-slow']
-                atr_to_price = round((df.iloc[-1]['ATR'] / stock_price) * 100, 3)
+            lw_lower_bound = round(stock_price - step)
+            lw_upper_bound = round(stock_price + step)
 
-                yesterdays_record = df.iloc[-1]
-                y_stock_open = yesterdays_record['open']
-                y_stock_high = yesterdays_record['high']
-                y_stock_low = yesterdays_record['low']
-                y_stock_close = yesterdays_record['close']
-
-                y_change = round((y_stock_close - y_stock_open) / y_stock_open * 100, 3)
-                y_range = y_stock_high - y_stock_low  # yesterday's range
-                step = round(y_range * 0.25, 3)
-
-                lw_lower_bound = round(stock_price - step)
-                lw_upper_bound = round(stock_price + step)
-
-                # choose the most volatile stocks
-                if increasing_atr and atr_to_price > 5 and self.order_service.is_tradable(stock):
-                    logger.info(f'[{count + 1}/{len(from_watchlist)}] -> '
-                                f'{stock} has an ATR:price ratio of {atr_to_price}%')
-                    stock_info.append(LWStock(stock, y_change, atr_to_price, lw_lower_bound, lw_upper_bound, step))
-
-            except Exception as ex:
-                logger.warning(f"Could not process {stock}: {ex}")
+            logger.info(f'[{count + 1}/{len(candidates)}] -> {stock} has an ATR:price ratio of {atr_to_price}%')
+            stock_info.append(LWStock(stock, y_change, atr_to_price, lw_lower_bound, lw_upper_bound, step))
 
         stock_picks = sorted(stock_info, key=lambda i: i.atr_to_price, reverse=True)
         logger.info(f'Today\'s stock picks: {len(stock_picks)}')
@@ -166,24 +144,6 @@ class LWBreakout(object):
 
         return stock_picks[:LWBreakout.MAX_STOCK_WATCH_COUNT]
 
-    def _get_stock_df(self, stock):
-        data_folder = "data"
-        today = date.today().isoformat()
-        df_path = Path("/".join([data_folder, today, stock + ".pkl"]))
-        df_path.parent.mkdir(parents=True, exist_ok=True)
-
-        if df_path.exists():
-            logger.info(f'data for {stock} exists locally')
-            df = pandas.read_pickle(df_path)
-        else:
-            df = self.data_service.get_daily_bars(stock, limit=LWBreakout.BARSET_RECORDS)
-            # df['pct_change'] = round(((df['close'] - df['open']) / df['open']) * 100, 4)
-            # df['net_change'] = 1 + (df['pct_change'] / 100)
-            # df['cum_change'] = df['net_change'].cumprod()
-            df.to_pickle(df_path)
-
-        return df
-
     def _with_high_volume(self, symbol):
         minute_bars = self.data_service.get_intra_day_bars(symbol, Interval.MIN_5)
         volumes = minute_bars['volume'].to_list()
@@ -1,19 +1,20 @@
-import time
+import logging
 from typing import Dict
 from kink import di
 from pandas import DataFrame
-from scipy import stats
 
-from core.logger import logger
+from core.logger import logger, log_frame
 from core.schedule import SafeScheduler, JobRunType
 from services.notification_service import Notification
 from universe.watchlist import WatchList
 from services.account_service import AccountService
 from services.data_service import DataService
+from services.history_store import HistoryStore
+from services.hqm_util import HqmUtil, HQM_SCORE
 from services.order_service import OrderService
 from services.position_service import PositionService, Position
+from services.rebalance_service import RebalanceService, equal_weights
 from strategies.strategy import Strategy
-from tabulate import tabulate
 
 '''
     Step 1: Get a list of popular stocks/ETFs
@@ -27,17 +28,21 @@ from tabulate import tabulate
 '''
 
 MAX_STOCKS_TO_PURCHASE = 30
+MIN_TRADE_FRACTION = 0.05  # Skip adjustments worth less than 5% of a position
 TIME_PERIOD_WEIGHTS = {'6M': 3, '3M': 3, '1M': 2, '5D': -8}
+PERCENTILE_LABEL = '{} Ret. %ile'
 
 
 class MomentumStrategy(Strategy):
 
     def __init__(self):
-        self.watchlist = WatchList()
+        self.watchlist: WatchList = di[WatchList]
         self.order_service: OrderService = di[OrderService]
         self.position_service: PositionService = di[PositionService]
         self.data_service: DataService = di[DataService]
+        self.history_store: HistoryStore = di[HistoryStore]
         self.account_service: AccountService = di[AccountService]
+        self.rebalance_service: RebalanceService = di[RebalanceService]
         self.schedule: SafeScheduler = di[SafeScheduler]
         self.notification: Notification = di[Notification]
 
@@ -58,8 +63,8 @@ class MomentumStrategy(Strategy):
 
     def init_data(self) -> None:
         self.stock_picks_today: DataFrame = self.prep_stocks()
-        tabled_stock_picks = tabulate(self.stock_picks_today, headers='keys', tablefmt='pretty')
-        logger.info(f"Stock picks for today:\n{tabled_stock_picks}")
+        log_frame("Stock picks for today:", self.stock_picks_today, logging.INFO, max_rows=MAX_STOCKS_TO_PURCHASE,
+                  head=True)
         self._run_trading()
 
     # ''' Since this is a strict LONG TERM strategy, run it every 24 hrs '''
@@ -75,7 +80,7 @@ class MomentumStrategy(Strategy):
         universe: list[str] = sorted(list(set(from_watchlist + from_positions)))
 
         # Fetch stock price change data
-        hqm_base: DataFrame = self.data_service.stock_price_change(universe)
+        hqm_base: DataFrame = self.history_store.price_change(universe)
 
         # Filter out the stocks that don't meet the below criteria
         hqm = hqm_base[
@@ -87,27 +92,14 @@ class MomentumStrategy(Strategy):
             (hqm_base['5D'] < 30)  # '5D' change is less than 30%
             ]
 
-        # Calculate return percentiles with weights
-        for time_period, weight in TIME_PERIOD_WEIGHTS.items():
-            hqm[f'{time_period} Ret. %ile'] = stats.percentileofscore(
-                hqm[time_period], hqm[time_period]) / 100 * weight
-
-            # Format the values to two decimal places
-            hqm[f'{time_period} Ret. %ile'] = hqm[f'{time_period} Ret. %ile'].apply(lambda x: f'{x:.2f}')
-
-        # Calculate weighted HQM Score
-        weighted_scores = hqm[[f'{time_period} Ret. %ile' for time_period in TIME_PERIOD_WEIGHTS.keys()]]
-        hqm['HQM Score'] = weighted_scores.sum(axis=1)
-
-        # Sort by HQM Score and return the top 51 rows
-        hqm = hqm.sort_values(by='HQM Score', ascending=False).head(51)
+        # Score all periods at once and keep the top 51 rows
+        hqm = HqmUtil.top_n(HqmUtil.score(hqm, TIME_PERIOD_WEIGHTS, PERCENTILE_LABEL), 51)
 
         # Print the HQM stocks
         self.show_stocks_df("HQM stocks today:\n", hqm)
 
-        # Print the DataFrame
-        logger.info(hqm[['HQM Score'] + [f'{time_period} Ret. %ile' for time_period in
-                                         TIME_PERIOD_WEIGHTS.keys()]])
+        log_frame("HQM scores:", hqm[[HQM_SCORE] + [PERCENTILE_LABEL.format(time_period) for time_period in
+                                                    TIME_PERIOD_WEIGHTS.keys()]], head=True)
 
         return hqm
 
@@ -125,17 +117,11 @@ class MomentumStrategy(Strategy):
         if to_be_removed:
             # Print the stocks to be liquidated
             header_str = "Positions to be liquidated now:\n"
-            cur_df: DataFrame = self.data_service.stock_price_change(to_be_removed)
+            cur_df: DataFrame = self.history_store.price_change(to_be_removed)
             self.show_stocks_df(header_str, cur_df)
 
-            # Liquidate the selected stocks
             for stock in to_be_removed:
                 self.notify_to_liquidate(held_stocks[stock])
-                self.order_service.market_sell(stock, int(held_stocks[stock].qty))
-                del held_stocks[stock]
-
-            time.sleep(10)  # Allow sufficient time for the stocks to liquidate
-            logger.info("Above stocks have been liquidated")
         else:
             logger.info("No stocks to be liquidated today")
 
@@ -145,42 +131,22 @@ class MomentumStrategy(Strategy):
         buffer: int = 10
         top_picks_addn = top_picks_today[:MAX_STOCKS_TO_PURCHASE + buffer]
         top_picks_final = [stock for stock in top_picks_addn if stock not in to_be_removed]
-        self.rebalance_stocks(top_picks_final)
+        held_to_keep = [stock for stock in held_stocks if stock not in to_be_removed]
+        self.rebalance_stocks(held_to_keep, top_picks_final, list(held_stocks))
 
-    def rebalance_stocks(self, symbols: list[str]):
+    def rebalance_stocks(self, held_to_keep: list[str], new_picks: list[str], held_symbols: list[str]):
         account = self.account_service.get_account_details()
-        allocated_amt_per_symbol = float(account.portfolio_value) / MAX_STOCKS_TO_PURCHASE
-
-        held_stocks = {pos.symbol: int(pos.qty) for pos in self.position_service.get_all_positions()}
-        position_count = 0
-
-        def calculate_qty_and_buy(sym: str) -> None:
-            nonlocal position_count
-            if position_count >= MAX_STOCKS_TO_PURCHASE:
-                return
-
-            current_price = self.data_service.get_current_price(sym)
-            qty = int(allocated_amt_per_symbol / current_price)
-            current_qty = held_stocks.get(sym, 0)
-            qty_to_add = qty - current_qty
-
-            if qty_to_add > 0:
-                self.order_service.market_buy(sym, int(qty_to_add))
-                position_count += 1
-                held_stocks[sym] = current_qty + qty_to_add
-                time.sleep(3)  # Allow sufficient time to purchase
-
-        # Re-balance held stocks
-        for symbol in held_stocks:
-            logger.info(f"Balancing for HELD symbol: {symbol}")
-            calculate_qty_and_buy(symbol)
-
-        # Re-balance selected symbols
-        for symbol in set(symbols):
-            if symbol not in held_stocks:
-                logger.info(f"Balancing for NEW symbol: {symbol}")
-                calculate_qty_and_buy(symbol)
+        # Only the share of the portfolio allocated to this strategy is balanced
+        portfolio_value = float(account.portfolio_value) * self.allocation
+        allocated_amt_per_symbol = portfolio_value / MAX_STOCKS_TO_PURCHASE
+
+        # Held stocks are all kept, then the new picks fill up the portfolio in rank order
+        target_weights = equal_weights(held_to_keep, new_picks, MAX_STOCKS_TO_PURCHASE)
+        logger.info(f"Balancing {len(target_weights)} symbols: {list(target_weights)}")
 
+        # Held stocks that are not part of the targets get liquidated by the same rebalance
+        self.rebalance_service.rebalance_to_weights(target_weights, portfolio_value, held_symbols,
+                                                    min_trade_value=MIN_TRADE_FRACTION * allocated_amt_per_symbol)
         logger.info("All stocks rebalanced for today")
 
     def show_stocks_df(self, msg: str, df: DataFrame):
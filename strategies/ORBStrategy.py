@@ -1,18 +1,17 @@
 from dataclasses import dataclass
-from datetime import date, datetime
+from datetime import datetime
 from enum import Enum
-from pathlib import Path
 from typing import List, Set
 
-import pandas
-import talib
 from fmp_python.fmp import Interval
 from kink import di, inject
 
-from core.logger import logger
+from core.logger import logger, log_frame
 from core.schedule import SafeScheduler, JobRunType
 from universe.watchlist import WatchList
-from services.data_service import DataService
+from services.bar_resampler import BarResampler
+from services.data_service import DataService, Timeframe
+from services.feature_store import FeatureStore
 from services.order_service import OrderService
 from services.position_service import PositionService
 from services.talib_util import TalibUtil, Trend
@@ -48,8 +47,6 @@ Steps:
     alpaca.get_barset('QQQ', "15Min", start='2022-01-03T09:00:00-05:00', until='2022-01-03T10:15:00-05:00').df
 '''
 
-pandas.set_option("display.max_rows", None, "display.max_columns", None)
-
 
 class Target(Enum):
     INIT = "INIT"
@@ -78,20 +75,20 @@ class ORBStrategy(Strategy):
     # TODO : Move the constants to Algo config
     STOCK_MIN_PRICE = 20
     STOCK_MAX_PRICE = 500
-    BARSET_COUNT = 60
 
-    AMOUNT_PER_ORDER = 1000
+    AMOUNT_PER_ORDER = 1000  # At an allocation of 1.0, scaled by the strategy's share of the portfolio
     MAX_NUM_STOCKS = 40
     MAX_STOCK_WATCH_COUNT = 100
     OPEN_NEW_POSITIONS_UNTIL = "11:00"
 
     def __init__(self):
         self.name = "OpeningRangeBreakoutStrategy"
-        self.watchlist = WatchList()
+        self.watchlist: WatchList = di[WatchList]
         self.order_service: OrderService = di[OrderService]
         self.position_service: PositionService = di[PositionService]
         self.schedule: SafeScheduler = di[SafeScheduler]
         self.data_service: DataService = di[DataService]
+        self.feature_store: FeatureStore = di[FeatureStore]
 
         self.pre_stock_picks: List[SelectedStock] = []
         self.todays_stock_picks: List[SelectedStock] = []
@@ -125,6 +122,7 @@ class ORBStrategy(Strategy):
 
         # First check if stock not already purchased
         held_stocks = [x.symbol for x in self.position_service.get_all_positions()]
+        amount_per_order = ORBStrategy.AMOUNT_PER_ORDER * self.allocation
 
         for stock in self.todays_stock_picks:
             logger.info(f"{stock.symbol}: Checking to place an order ...")
@@ -139,9 +137,9 @@ class ORBStrategy(Strategy):
                     # Get 5M DF
                     df = self.data_service.get_intra_day_bars(stock.symbol, Interval.MIN_5)
                     ha_df = TalibUtil.heikenashi(df)
-                    df['EMA'] = talib.EMA(df['close'], timeperiod=9)
+                    df['EMA'] = TalibUtil.ema(df['close'], 9)
 
-                    no_of_shares = int(ORBStrategy.AMOUNT_PER_ORDER / current_market_price)
+                    no_of_shares = int(amount_per_order / current_market_price)
                     stop_loss_margin = 0.6 * stock.range
 
                     # long
@@ -185,7 +183,7 @@ class ORBStrategy(Strategy):
             else:
                 # Get 5M DF
                 df = self.data_service.get_intra_day_bars(stock.symbol, Interval.MIN_5)
-                df['EMA'] = talib.EMA(df['close'], timeperiod=15)
+                df['EMA'] = TalibUtil.ema(df['close'], 15)
                 ha_df = TalibUtil.heikenashi(df)
                 profit_margin = 0.3 * stock.range
 
@@ -227,14 +225,13 @@ class ORBStrategy(Strategy):
         for stock_pick in self.pre_stock_picks:
 
             logger.info(f"{stock_pick.symbol}: prepping ...")
-            one_min_df = self.data_service.get_intra_day_bars(stock_pick.symbol, Interval.MIN_1)
-            five_min_df = self.data_service.get_intra_day_bars(stock_pick.symbol, Interval.MIN_5)
-            fifteen_min_df = self.data_service.get_intra_day_bars(stock_pick.symbol, Interval.MIN_15)
+            # One download, the 5 and 15 min bars are resampled from the 1 min bars
+            bar_set = self.data_service.get_intra_day_bar_set(stock_pick.symbol, [Timeframe.MIN_5, Timeframe.MIN_15])
 
-            logger.info(f"{stock_pick.symbol}: Five Min DF\n{five_min_df.tail(7)}\n")
-            logger.info(f"{stock_pick.symbol}: Fifteen Min DF\n{fifteen_min_df.tail(3)}\n")
+            log_frame(f"{stock_pick.symbol}: Five Min DF", bar_set[Timeframe.MIN_5], max_rows=7)
+            log_frame(f"{stock_pick.symbol}: Fifteen Min DF", bar_set[Timeframe.MIN_15], max_rows=3)
 
-            opening_range = self._populate_opening_range(stock_pick.symbol, one_min_df, five_min_df, fifteen_min_df)
+            opening_range = self._populate_opening_range(stock_pick.symbol, bar_set[Timeframe.MIN_1])
             if len(opening_range) == 2:
                 lower_bound, upper_bound = opening_range
                 range: float = abs(round(upper_bound - lower_bound, 2))
@@ -249,73 +246,22 @@ class ORBStrategy(Strategy):
     def _get_pre_stock_picks(self) -> List[SelectedStock]:
         # get the best buy and strong buy stock from Nasdaq.com and sort them by the best stocks
 
-        logger.info("Downloading data ...")
+        logger.info("Reading features ...")
         from_watchlist = self.watchlist.get_universe(2000000, 0.5)
-        stock_info: List[SelectedStock] = []
+        features = self.feature_store.get_features(from_watchlist)
 
-        for count, stock in enumerate(from_watchlist):
-
-            df = None
-            try:
-                df = self._get_stock_df(stock)
-            except Exception as ex:
-                logger.warning(f"symbol {stock} does not exist: {ex}")
-
-            if df is None:
-                continue
-
-            stock_price = df.iloc[-1]['close']
-            if stock_price > ORBStrategy.STOCK_MAX_PRICE or stock_price < ORBStrategy.STOCK_MIN_PRICE:
-                continue
-
-            try:
-                df['ATR'] = talib.ATR(df['high'], df['low'], df['close'], timeperiod=7)
-                # df['ATR-slope-fast'] = talib.EMA(df['ATR'], timeperiod=9)
-                # df['ATR-slope-slow'] = talib.EMA(df['ATR'], timeperiod=14)
-                increasing_atr = True
-                # df.iloc[-1]['ATR-slope-fast'] > df.iloc[-1]['ATR-slope-slow'] \
-                # and df.iloc[-5]['ATR-slope-fast'] > df.iloc[-5]['ATR-slope-slow']
-                atr_to_price = round((df.iloc[-1]['ATR'] / stock_price) * 100, 3)
-
-                # df['RSI'] = talib.RSI(df['close'], timeperiod=14)
-                # df['RSI-slope-fast'] = talib.EMA(df['RSI'], timeperiod=9)
-                # df['RSI-slope-slow'] = talib.EMA(df['RSI'], timeperiod=14)
-
-                # Open long positions for increasing RSI and short positions for decreasing RSI only
-                # long = df.iloc[-1]['RSI-slope-fast'] > df.iloc[-1]['RSI-slope-slow'] \
-                #        and df.iloc[-5]['RSI-slope-fast'] > df.iloc[-5]['RSI-slope-slow']
-                # short = df.iloc[-1]['RSI-slope-fast'] < df.iloc[-1]['RSI-slope-slow'] \
-                #         and df.iloc[-5]['RSI-slope-fast'] < df.iloc[-5]['RSI-slope-slow']
-
-                # choose the most volatile stocks
-                if increasing_atr and atr_to_price > 5 and self.order_service.is_tradable(stock):
-                    logger.info(f'[{count + 1}/{len(from_watchlist)}] -> {stock} '
-                                f'has an ATR:price ratio of {atr_to_price}%')
-                    stock_info.append(SelectedStock(stock, atr_to_price))
-                    # if long:
-                    #     stock_info.append(ORBStock(stock, atr_to_price, 'long'))
-                    # else:
-                    #     stock_info.append(ORBStock(stock, atr_to_price, 'short'))
-            except Exception as ex:
-                logger.warning(f"{stock}: Could not process data: {ex}")
+        # choose the most volatile stocks
+        candidates = features[features['close'].between(ORBStrategy.STOCK_MIN_PRICE, ORBStrategy.STOCK_MAX_PRICE)
+                              & (features['atr_7_to_price'] > 5)]
+        stock_info: List[SelectedStock] = []
+        for count, (stock, atr_to_price) in enumerate(candidates['atr_7_to_price'].items()):
+            if self.order_service.is_tradable(stock):
+                logger.info(f'[{count + 1}/{len(candidates)}] -> {stock} has an ATR:price ratio of {atr_to_price}%')
+                stock_info.append(SelectedStock(stock, atr_to_price))
 
         pre_stock_picks = sorted(stock_info, key=lambda i: i.atr_to_price, reverse=True)
         return pre_stock_picks[:ORBStrategy.MAX_STOCK_WATCH_COUNT]
 
-    def _get_stock_df(self, symbol):
-        data_folder = "data"
-        today = date.today().isoformat()
-        df_path = Path("/".join([data_folder, today, symbol + ".pkl"]))
-        df_path.parent.mkdir(parents=True, exist_ok=True)
-
-        if df_path.exists():
-            logger.info(f'{symbol}: data exists locally!')
-            df = pandas.read_pickle(df_path)
-        else:
-            df = self.data_service.get_daily_bars(symbol, limit=ORBStrategy.BARSET_COUNT)
-            df.to_pickle(df_path)
-        return df
-
     # def place_smart_stop_loss(self, stock: SelectedStock) -> str:
     #     self.order_service.cancel_order(stock.order_id)
     #     qty_to_close: int = int(abs(stock.order_qty / 2))
@@ -337,29 +283,12 @@ class ORBStrategy(Strategy):
     #     return order_id
 
     @staticmethod
-    def _populate_opening_range(symbol, one_min_df, five_min_df, fifteen_min_df) -> List[float]:
-        today = date.today().isoformat()
-
-        # because FMP data is received in EST
-        from_time = f'{today} 09:29:00'
-        until_time = f'{today} 10:00:00'
-
-        # fix reduce the no of missing bars
-        one_min_bars = one_min_df[(one_min_df.index > from_time) & (one_min_df.index <= until_time)]
-        five_min_bars = five_min_df[(five_min_df.index > from_time) & (five_min_df.index <= until_time)]
-        fifteen_min_bars = fifteen_min_df[(fifteen_min_df.index > from_time) & (fifteen_min_df.index <= until_time)]
-
-        highs = one_min_bars['high'].to_list()
-        highs.extend(five_min_bars['high'].to_list())
-        highs.extend(fifteen_min_bars['high'].to_list())
-
-        lows = one_min_bars['low'].to_list()
-        lows.extend(five_min_bars['low'].to_list())
-        lows.extend(fifteen_min_bars['low'].to_list())
-
-        if len(highs) >= 2 and len(lows) >= 2:
-            return [min(lows), max(highs)]
-        logger.warning(f"{symbol}: Record count of 5 and 1 min bars is lesser than threshold")
+    def _populate_opening_range(symbol, one_min_df) -> List[float]:
+        # 09:30 - 10:00 EST, the coarser bars of the same window hold no other highs / lows
+        opening_range = BarResampler.opening_range(one_min_df, minutes=30)
+        if opening_range:
+            return list(opening_range)
+        logger.warning(f"{symbol}: Record count of 1 min bars is lesser than threshold")
         return []
 
     def _check_timeout(self) -> bool:
@@ -1,21 +1,25 @@
+import logging
 from typing import List, Dict
 
 import numpy as np
 from kink import di
 from pandas import DataFrame
 
-from core.logger import logger
+from core.logger import logger, log_frame
 from core.schedule import SafeScheduler, JobRunType
 from services.account_service import AccountService
 from services.data_service import DataService
+from services.history_store import HistoryStore
 from services.notification_service import Notification
 from services.order_service import OrderService
 from services.position_service import PositionService, Position
+from services.rebalance_service import RebalanceService, equal_weights
 from strategies.strategy import Strategy
 from universe.watchlist import WatchList
 
 MAX_STOCKS_TO_PURCHASE = 30
 MAX_POSITION_SIZE = 30
+MIN_TRADE_FRACTION = 0.05  # Skip adjustments worth less than 5% of a position
 
 '''
 Qullamaggie Strategy:
@@ -31,11 +35,13 @@ Qullamaggie Strategy:
 class QmStrategy(Strategy):
 
     def __init__(self):
-        self.watchlist = WatchList()
+        self.watchlist: WatchList = di[WatchList]
         self.order_service: OrderService = di[OrderService]
         self.position_service: PositionService = di[PositionService]
         self.data_service: DataService = di[DataService]
+        self.history_store: HistoryStore = di[HistoryStore]
         self.account_service: AccountService = di[AccountService]
+        self.rebalance_service: RebalanceService = di[RebalanceService]
         self.schedule: SafeScheduler = di[SafeScheduler]
         self.notification: Notification = di[Notification]
 
@@ -56,8 +62,8 @@ class QmStrategy(Strategy):
 
     def init_data(self) -> None:
         self.stock_picks_today: DataFrame = self.prep_stocks()
-        logger.info("Stock picks for today")
-        logger.info(self.stock_picks_today)
+        log_frame("Stock picks for today:", self.stock_picks_today, logging.INFO, max_rows=MAX_STOCKS_TO_PURCHASE,
+                  head=True)
         self._run_trading()
 
     def run(self, sleep_next_x_seconds, until_time):
@@ -107,18 +113,17 @@ class QmStrategy(Strategy):
 
         if to_be_removed:
             header_str = "Positions to be sold now:\n"
-            cur_df: DataFrame = self.data_service.stock_price_change(to_be_removed)
+            cur_df: DataFrame = self.history_store.price_change(to_be_removed)
             self.show_stocks_df(header_str, cur_df)
 
             for stock in to_be_removed:
                 self.notify_to_sell(held_stocks[stock])
-                self.order_service.market_sell(stock, int(held_stocks[stock].qty))
                 del held_stocks[stock]
 
             buffer: int = 10
             top_picks_addn = top_picks_today[:MAX_STOCKS_TO_PURCHASE + buffer]
             top_picks_final = [stock for stock in top_picks_addn if stock not in to_be_removed]
-            self.rebalance_stocks(top_picks_final)
+            self.rebalance_stocks(list(held_stocks), top_picks_final, list(held_stocks) + to_be_removed)
         else:
             logger.info("No stocks to be liquidated today")
 
@@ -126,35 +131,18 @@ class QmStrategy(Strategy):
         for stock in held_stocks.keys():
             self.manage_position(stock)
 
-    def rebalance_stocks(self, symbols: List[str]):
+    def rebalance_stocks(self, held_to_keep: List[str], new_picks: List[str], held_symbols: List[str]):
         account = self.account_service.get_account_details()
-        allocated_amt_per_symbol = float(account.portfolio_value) / MAX_STOCKS_TO_PURCHASE
+        # Only the share of the portfolio allocated to this strategy is balanced
+        portfolio_value = float(account.portfolio_value) * self.allocation
+        allocated_amt_per_symbol = portfolio_value / MAX_STOCKS_TO_PURCHASE
 
-        held_stocks = {pos.symbol: int(pos.qty) for pos in self.position_service.get_all_positions()}
-        position_count = 0
-
-        def calculate_qty_and_buy(sym: str) -> None:
-            nonlocal position_count
-            if position_count >= MAX_STOCKS_TO_PURCHASE:
-                return
-
-            current_price = self.data_service.get_current_price(sym)
-            qty = int(allocated_amt_per_symbol / current_price)
-            current_qty = held_stocks.get(sym, 0)
-            qty_to_add = min(qty - current_qty, MAX_POSITION_SIZE - current_qty)
-
-            if qty_to_add > 0:
-                self.order_service.market_buy(sym, int(qty_to_add))
-                position_count += 1
-                held_stocks[sym] = current_qty + qty_to_add
-
-        for symbol in held_stocks:
-            calculate_qty_and_buy(symbol)
-
-        for symbol in set(symbols):
-            if symbol not in held_stocks:
-                calculate_qty_and_buy(symbol)
+        target_weights = equal_weights(held_to_keep, new_picks, MAX_STOCKS_TO_PURCHASE)
 
+        # Held stocks that are not part of the targets get liquidated by the same rebalance
+        self.rebalance_service.rebalance_to_weights(target_weights, portfolio_value, held_symbols,
+                                                    min_trade_value=MIN_TRADE_FRACTION * allocated_amt_per_symbol,
+                                                    max_qty=MAX_POSITION_SIZE)
         logger.info("All stocks rebalanced for today")
 
     def manage_position(self, stock):
@@ -1,17 +1,15 @@
+import logging
 from dataclasses import dataclass
-from datetime import date
-from pathlib import Path
 from typing import List
 
-import pandas
-import talib
 from fmp_python.fmp import Interval
 from kink import di, inject
 
-from core.logger import logger
+from core.logger import logger, log_frame
 from core.schedule import SafeScheduler, JobRunType
 from universe.watchlist import WatchList
 from services.data_service import DataService
+from services.feature_store import FeatureStore
 from services.order_service import OrderService
 from services.position_service import PositionService
 from services.talib_util import TalibUtil
@@ -39,7 +37,6 @@ Steps:
        c. take profit: 2 X stop loss
 '''
 
-pandas.set_option("display.max_rows", None, "display.max_columns", None)
 
 @dataclass
 class SelectedStock:
@@ -54,19 +51,19 @@ class RsiHaStrategy(Strategy):
     # TODO : Move the constants to Algo config
     STOCK_MIN_PRICE = 20
     STOCK_MAX_PRICE = 500
-    BARSET_COUNT = 30
 
-    AMOUNT_PER_ORDER = 4000
+    AMOUNT_PER_ORDER = 4000  # At an allocation of 1.0, scaled by the strategy's share of the portfolio
     MAX_HELD_STOCKS = 10
     MAX_STOCK_WATCH_COUNT = 200
 
     def __init__(self):
         self.name = "RSI Heiken Ashi EMA Strategy"
-        self.watchlist = WatchList()
+        self.watchlist: WatchList = di[WatchList]
         self.order_service: OrderService = di[OrderService]
         self.position_service: PositionService = di[PositionService]
         self.schedule: SafeScheduler = di[SafeScheduler]
         self.data_service: DataService = di[DataService]
+        self.feature_store: FeatureStore = di[FeatureStore]
 
         self.todays_stock_picks: List[SelectedStock] = []
         self.stocks_tracking: List[str] = []
@@ -97,6 +94,7 @@ class RsiHaStrategy(Strategy):
 
         # First check if stock not already purchased
         held_stocks = [x.symbol for x in self.position_service.get_all_positions()]
+        amount_per_order = RsiHaStrategy.AMOUNT_PER_ORDER * self.allocation
 
         for stock in self.todays_stock_picks:
             logger.info(f"Checking {stock.symbol} to place an order ...")
@@ -109,10 +107,10 @@ class RsiHaStrategy(Strategy):
                 ha_df = TalibUtil.heikenashi(df)
                 trend: str = self._get_ha_trend(ha_df)
 
-                df['EMA'] = talib.EMA(df['close'], timeperiod=14)
-                df['RSI'] = talib.RSI(df['close'], timeperiod=14)
-                df['RSI-slope-fast'] = talib.EMA(df['RSI'], timeperiod=9)
-                df['RSI-slope-slow'] = talib.EMA(df['RSI'], timeperiod=14)
+                df['EMA'] = TalibUtil.ema(df['close'], 14)
+                df['RSI'] = TalibUtil.rsi(df['close'], 14)
+                df['RSI-slope-fast'] = TalibUtil.ema(df['RSI'], 9)
+                df['RSI-slope-slow'] = TalibUtil.ema(df['RSI'], 14)
 
                 if stock.side == "long":
                     # Set tracking to True if satisfied
@@ -121,7 +119,7 @@ class RsiHaStrategy(Strategy):
 
                     if stock.tracking and trend == "BULLISH" and ha_df.iloc[-1]['close'] > df.iloc[-1]['EMA']:
                         current_market_price = self.data_service.get_current_price(stock.symbol)
-                        no_of_shares = int(RsiHaStrategy.AMOUNT_PER_ORDER / current_market_price)
+                        no_of_shares = int(amount_per_order / current_market_price)
 
                         stop_loss = min(list(ha_df['low'][:-7]))
                         take_profit = current_market_price + (2 * (current_market_price - stop_loss))
@@ -129,7 +127,7 @@ class RsiHaStrategy(Strategy):
                                                                take_profit)
                         logger.info(f"Placed order for {stock.symbol}:{stock.side} at ${current_market_price}")
                         logger.info(f"Stock data : {stock}")
-                        logger.info(f"{ha_df.tail(10)}")
+                        log_frame(f"{stock.symbol}: Heikin Ashi DF", ha_df, logging.INFO)
                         stock.tracking = False
 
                 if stock.side == "short" and self.order_service.is_shortable(stock.symbol):
@@ -139,7 +137,7 @@ class RsiHaStrategy(Strategy):
 
                     if stock.tracking and trend == "BEARISH" and ha_df.iloc[-1]['close'] < df.iloc[-1]['EMA']:
                         current_market_price = self.data_service.get_current_price(stock.symbol)
-                        no_of_shares = int(RsiHaStrategy.AMOUNT_PER_ORDER / current_market_price)
+                        no_of_shares = int(amount_per_order / current_market_price)
 
                         stop_loss = max(list(ha_df['high'][:-7]))
                         take_profit = current_market_price - (2 * (stop_loss - current_market_price))
@@ -147,50 +145,26 @@ class RsiHaStrategy(Strategy):
                                                                take_profit)
                         logger.info(f"Placed order for {stock.symbol}:{stock.side} at ${current_market_price}")
                         logger.info(f"Stock data : {stock}")
-                        logger.info(f"{ha_df.tail(10)}")
+                        log_frame(f"{stock.symbol}: Heikin Ashi DF", ha_df, logging.INFO)
                         stock.tracking = False
 
     def _get_todays_stock_picks(self) -> List[SelectedStock]:
-
-        logger.info("Downloading data ...")
+        logger.info("Reading features ...")
         from_watchlist = self.watchlist.get_universe(2000000, 1.0)
-        stock_info: List[SelectedStock] = []
-
-        for count, symbol in enumerate(from_watchlist):
-
-            df = None
-            try:
-                df = self._get_daily_stock_df(symbol)
-            except Exception as ex:
-                logger.warning(f"symbol {symbol} does not exist: {ex}")
-
-            if df is None:
-                continue
-
-            stock_price = df.iloc[-1]['close']
-            if stock_price > RsiHaStrategy.STOCK_MAX_PRICE or stock_price < RsiHaStrategy.STOCK_MIN_PRICE:
-                continue
-
-            try:
-                df['EMA'] = talib.EMA(df['close'], timeperiod=20)
-                df['ATR'] = talib.ATR(df['high'], df['low'], df['close'], timeperiod=7)
-                atr_to_price = round((df.iloc[-1]['ATR'] / stock_price) * 100, 3)
+        features = self.feature_store.get_features(from_watchlist)
 
-                # Open long positions for increasing RSI and short positions for decreasing RSI only
-                long = df.iloc[-1]['close'] > df.iloc[-1]['EMA']
-                short = df.iloc[-1]['close'] < df.iloc[-1]['EMA']
-
-                # choose the most volatile stocks
-                if atr_to_price > 3 and self.order_service.is_tradable(symbol):
-                    logger.info(f'[{count + 1}/{len(from_watchlist)}] -> {symbol} '
-                                f'has an ATR:price ratio of {atr_to_price}%')
-                    if long:
-                        stock_info.append(SelectedStock(symbol, atr_to_price, 'long'))
-                    if short:
-                        stock_info.append(SelectedStock(symbol, atr_to_price, 'short'))
-
-            except Exception as ex:
-                logger.warning(f"Could not process {symbol}: {ex}")
+        # choose the most volatile stocks
+        candidates = features[features['close'].between(RsiHaStrategy.STOCK_MIN_PRICE, RsiHaStrategy.STOCK_MAX_PRICE)
+                              & (features['atr_7_to_price'] > 3)]
+        stock_info: List[SelectedStock] = []
+        for count, (symbol, row) in enumerate(candidates.iterrows()):
+            if self.order_service.is_tradable(symbol):
+                logger.info(f'[{count + 1}/{len(candidates)}] -> {symbol} '
+                            f'has an ATR:price ratio of {row["atr_7_to_price"]}%')
+                if row['close'] > row['ema_20']:
+                    stock_info.append(SelectedStock(symbol, row['atr_7_to_price'], 'long'))
+                if row['close'] < row['ema_20']:
+                    stock_info.append(SelectedStock(symbol, row['atr_7_to_price'], 'short'))
 
         pre_stock_picks = sorted(stock_info, key=lambda i: i.atr_to_price, reverse=True)
         todays_picks = pre_stock_picks[:RsiHaStrategy.MAX_STOCK_WATCH_COUNT]
@@ -199,20 +173,6 @@ class RsiHaStrategy(Strategy):
         [logger.info(s) for s in todays_picks]
         return todays_picks
 
-    def _get_daily_stock_df(self, symbol):
-        data_folder = "data"
-        today = date.today().isoformat()
-        df_path = Path("/".join([data_folder, today, symbol + ".pkl"]))
-        df_path.parent.mkdir(parents=True, exist_ok=True)
-
-        if df_path.exists():
-            logger.info(f'data for {symbol} exists locally')
-            df = pandas.read_pickle(df_path)
-        else:
-            df = self.data_service.get_daily_bars(symbol, limit=RsiHaStrategy.BARSET_COUNT)
-            df.to_pickle(df_path)
-        return df
-
     @staticmethod
     def _get_ha_trend(ha_df) -> str:
         latest_row = ha_df.iloc[-1]
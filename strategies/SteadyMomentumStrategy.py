@@ -1,20 +1,20 @@
-import time
+import logging
 from typing import Dict
 from kink import di
 from pandas import DataFrame
-from sklearn.linear_model import LinearRegression
 import numpy as np
 
-from core.logger import logger
+from core.logger import logger, log_frame
 from core.schedule import SafeScheduler, JobRunType
 from services.notification_service import Notification
 from universe.watchlist import WatchList
 from services.account_service import AccountService
 from services.data_service import DataService
+from services.history_store import HistoryStore
 from services.order_service import OrderService
 from services.position_service import PositionService, Position
+from services.rebalance_service import RebalanceService, equal_weights
 from strategies.strategy import Strategy
-from tabulate import tabulate
 
 '''
     Step 1: Get a list of popular stocks/ETFs
@@ -30,16 +30,19 @@ from tabulate import tabulate
 '''
 
 MAX_STOCKS_TO_PURCHASE = 30
+MIN_TRADE_FRACTION = 0.05  # Skip adjustments worth less than 5% of a position
 
 
 class SteadyMomentumStrategy(Strategy):
 
     def __init__(self):
-        self.watchlist = WatchList()
+        self.watchlist: WatchList = di[WatchList]
         self.order_service: OrderService = di[OrderService]
         self.position_service: PositionService = di[PositionService]
         self.data_service: DataService = di[DataService]
+        self.history_store: HistoryStore = di[HistoryStore]
         self.account_service: AccountService = di[AccountService]
+        self.rebalance_service: RebalanceService = di[RebalanceService]
         self.schedule: SafeScheduler = di[SafeScheduler]
         self.notification: Notification = di[Notification]
 
@@ -60,8 +63,8 @@ class SteadyMomentumStrategy(Strategy):
 
     def init_data(self) -> None:
         self.stock_picks_today: DataFrame = self.prep_stocks()
-        tabled_stock_picks = tabulate(self.stock_picks_today, headers='keys', tablefmt='pretty')
-        logger.info(f"Stock picks for today:\n{tabled_stock_picks}")
+        log_frame("Stock picks for today:", self.stock_picks_today, logging.INFO, max_rows=MAX_STOCKS_TO_PURCHASE,
+                  head=True)
         self._run_trading()
 
     # ''' Since this is a strict LONG TERM strategy, run it every 24 hrs '''
@@ -77,7 +80,7 @@ class SteadyMomentumStrategy(Strategy):
         universe: list[str] = sorted(list(set(from_watchlist + from_positions)))
 
         # Fetch stock price change data
-        hqm_base: DataFrame = self.data_service.stock_price_change(universe)
+        hqm_base: DataFrame = self.history_store.price_change(universe)
 
         # Filter out the stocks that don't meet the below criteria
         hqm = hqm_base[
@@ -90,6 +93,7 @@ class SteadyMomentumStrategy(Strategy):
         return self._calculate_stock_momentum(hqm)
 
     def _calculate_stock_momentum(self, hqm: DataFrame) -> DataFrame:
+        from sklearn.linear_model import LinearRegression
         results = []
         thresholds = [0.8, 0.7, 0.6, 0.5]  # Percentage of up days
         spike_threshold = 0.20  # 20% price increase/decrease considered a spike
@@ -106,17 +110,17 @@ class SteadyMomentumStrategy(Strategy):
             data['rolling_max'] = data['close'].rolling(window=30, min_periods=1).max()
             # Calculate the drawdown as the percentage decline from the rolling maximum
             data['drawdown'] = (data['close'] - data['rolling_max']) / data['rolling_max']
-            print(f"{symbol} had a max drawdown of {data['drawdown'].min() * 100} in the last 30 days")
+            logger.debug(f"{symbol} had a max drawdown of {data['drawdown'].min() * 100} in the last 30 days")
 
             # Step 2: Check if the drawdown in last 30 days > drawdown threshold
             if any(data['drawdown'] < -drawdown_threshold):
-                print(f"Excluding {symbol} due to a drawdown of {drawdown_threshold*100} or more in the last 30 days")
+                logger.info(f"Excluding {symbol} due to a drawdown of {drawdown_threshold*100} or more in the last 30 days")
                 continue  # Skip this stock if a significant drawdown is detected
 
             # Step 3: Check for sudden price spikes in the last 10 days
             recent_data = data[-10:]  # Get the last 10 days of data
             if any(recent_data['pct_change'].abs() > spike_threshold):
-                print(f"Excluding {symbol} due to sudden price spike in the last 10 days")
+                logger.info(f"Excluding {symbol} due to sudden price spike in the last 10 days")
                 continue  # Skip this stock if a spike is detected in the last 10 days
 
             # Step 4: Calculate Exponential Moving Average (EMA)
@@ -140,9 +144,9 @@ class SteadyMomentumStrategy(Strategy):
             # Calculate the count of days the stock has fallen below the 30-day EMA
             below_ema_count = np.sum(recent_data['close'] < recent_data['EMA_30'])
 
-            # Print the rows where the closing price is below the 30-day EMA
+            # Log the rows where the closing price is below the 30-day EMA
             below_ema_df = recent_data[recent_data['close'] < recent_data['EMA_30']]
-            print(below_ema_df)
+            log_frame(f"{symbol}: Closed below the 30-day EMA", below_ema_df)
 
             # Determine which threshold the stock meets
             threshold_met = None
@@ -196,14 +200,8 @@ class SteadyMomentumStrategy(Strategy):
         logger.info(f"Stocks to be liquidated: {to_be_removed}")
 
         if to_be_removed:
-            # Liquidate the selected stocks
             for stock in to_be_removed:
                 self.notify_to_liquidate(held_stocks[stock])
-                self.order_service.market_sell(stock, int(held_stocks[stock].qty))
-                del held_stocks[stock]
-
-            time.sleep(10)  # Allow sufficient time for the stocks to liquidate
-            logger.info("Above stocks have been liquidated")
         else:
             logger.info("No stocks to be liquidated today")
 
@@ -213,45 +211,24 @@ class SteadyMomentumStrategy(Strategy):
 
         top_picks_addn = top_picks_today[:MAX_STOCKS_TO_PURCHASE]
         top_picks_final = [stock for stock in top_picks_addn if stock not in held_stocks]
+        held_to_keep = [stock for stock in held_stocks if stock not in to_be_removed]
 
         logger.info(f"{len(top_picks_final)} Stocks to hold: {top_picks_final}")
-        self.rebalance_stocks(top_picks_final)
+        self.rebalance_stocks(held_to_keep, top_picks_final, list(held_stocks))
 
-    def rebalance_stocks(self, symbols: list[str]):
+    def rebalance_stocks(self, held_to_keep: list[str], new_picks: list[str], held_symbols: list[str]):
         account = self.account_service.get_account_details()
-        allocated_amt_per_symbol = float(account.portfolio_value) / MAX_STOCKS_TO_PURCHASE
-
-        held_stocks = {pos.symbol: int(pos.qty) for pos in self.position_service.get_all_positions()}
-        position_count = 0
-
-        def calculate_qty_and_buy(sym: str) -> None:
-            nonlocal position_count
-            if position_count >= MAX_STOCKS_TO_PURCHASE:
-                return
-
-            current_price = self.data_service.get_current_price(sym)
-            qty = int(allocated_amt_per_symbol / current_price)
-            current_qty = held_stocks.get(sym, 0)
-            qty_to_add = qty - current_qty
-
-            if qty_to_add > 0:
-                self.order_service.market_buy(sym, int(qty_to_add))
-                position_count += 1
-                held_stocks[sym] = current_qty + qty_to_add
-                time.sleep(3)  # Allow sufficient time to purchase
-
-        # Re-balance held stocks
-        for symbol in held_stocks:
-            logger.info(f"Balancing for HELD symbol: {symbol}")
-            calculate_qty_and_buy(symbol)
-
-        # Re-balance selected symbols
-        logger.info(f"{len(symbols)} Remaining symbols: {symbols}")
-        for symbol in set(symbols):
-            if symbol not in held_stocks:
-                logger.info(f"Balancing for NEW symbol: {symbol}")
-                calculate_qty_and_buy(symbol)
+        # Only the share of the portfolio allocated to this strategy is balanced
+        portfolio_value = float(account.portfolio_value) * self.allocation
+        allocated_amt_per_symbol = portfolio_value / MAX_STOCKS_TO_PURCHASE
+
+        # Held stocks are all kept, then the new picks fill up the portfolio in rank order
+        target_weights = equal_weights(held_to_keep, new_picks, MAX_STOCKS_TO_PURCHASE)
+        logger.info(f"Balancing {len(target_weights)} symbols: {list(target_weights)}")
 
+        # Held stocks that are not part of the targets get liquidated by the same rebalance
+        self.rebalance_service.rebalance_to_weights(target_weights, portfolio_value, held_symbols,
+                                                    min_trade_value=MIN_TRADE_FRACTION * allocated_amt_per_symbol)
         logger.info("All stocks rebalanced for today")
 
     def notify_to_liquidate(self, position: Position):
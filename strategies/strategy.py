@@ -1,12 +1,34 @@
 from abc import ABC, abstractmethod
-from typing import List, Dict
+from typing import List, Dict, TYPE_CHECKING
 import pandas as pd
 import numpy as np
 import logging
 
+if TYPE_CHECKING:
+    # Pulls in the FMP client (orjson, requests), only the backtests read the bar store
+    from services.bar_store import BarStore
+
 class Strategy(ABC):
     DATA = "data"
     logger = logging.getLogger(__name__)
+    # Share of the portfolio the strategy trades with, set from the STRATEGIES config
+    allocation: float = 1.0
+    # True for strategies that act on held positions they did not open, they cannot share the account
+    trades_whole_portfolio: bool = False
+    # Services whose orders and positions are limited to the strategy's own when the account is shared
+    SCOPED_SERVICES = ('order_service', 'position_service', 'rebalance_service')
+    # Bars of the previous chunk put in front of the next one in out of core backtests, so indicators carry over
+    WARMUP_BARS: int = 390
+
+    '''
+    Used when several strategies share the account: the orders are tagged with `name`, and the strategy only sees,
+    rebalances and closes the positions opened by its own orders
+    '''
+    def share_account(self, name: str, allocation: float) -> None:
+        self.allocation = allocation
+        for attr in self.SCOPED_SERVICES:
+            if hasattr(self, attr):
+                setattr(self, attr, getattr(self, attr).for_strategy(name))
 
     @abstractmethod
     def init_data(self):
@@ -32,11 +54,36 @@ class Strategy(ABC):
     def define_buy_sell(self, data: pd.DataFrame) -> pd.DataFrame:
         pass
 
-    def backtest(self, symbols: List[str], start_date: str, end_date: str) -> Dict:
+    '''
+    With a BarStore, or a SharedBarCache attached in a worker process, every symbol is backtested on its stored
+    bars one month at a time (see backtest_from_store) and the performance is returned per symbol
+    '''
+    def backtest(self, symbols: List[str], start_date: str, end_date: str, bar_store: 'BarStore' = None) -> Dict:
+        if bar_store is not None:
+            return {symbol: self.backtest_from_store(bar_store, symbol, start_date, end_date) for symbol in symbols}
         data = self.download_data(symbols, start_date, end_date)
         signals = self.define_buy_sell(data)
         return self.calculate_performance(signals)
 
+    '''
+    Out of core backtest over memory-mapped bars: define_buy_sell() sees one month at a time, with the last
+    WARMUP_BARS bars of the previous month in front, and the performance is accumulated chunk by chunk.
+    Memory use does not grow with the length of the history
+    '''
+    def backtest_from_store(self, bar_store: 'BarStore', symbol: str, start_date: str, end_date: str) -> Dict:
+        from services.bar_store import BarStore
+        performance = RunningPerformance()
+        warmup = None
+        for chunk in bar_store.iter_chunks(symbol, start_date, end_date):
+            bars = BarStore.to_frame(chunk)
+            data = bars if warmup is None else pd.concat([warmup, bars])
+            signals = self.define_buy_sell(data)
+            # Shifted over the whole frame, so the first bar of the chunk uses the last position of the warmup
+            strategy_returns = signals['position'].shift(1) * signals['returns']
+            performance.add(strategy_returns.iloc[len(data) - len(bars):])
+            warmup = bars.tail(self.WARMUP_BARS)
+        return performance.result()
+
     def calculate_performance(self, signals: pd.DataFrame) -> Dict:
         signals['strategy_returns'] = signals['position'].shift(1) * signals['returns']
         signals['cumulative_returns'] = (1 + signals['strategy_returns']).cumprod()
@@ -66,4 +113,56 @@ class Strategy(ABC):
 
     # @staticmethod
     # def get_backtest_file_path(symbol) -> Path:
-    #     return Path("/".join([Strategy.DATA, "back-test", symbol + ".pkl"]))
\ No newline at end of file
+    #     return Path("/".join([Strategy.DATA, "back-test", symbol + ".pkl"]))
+
+
+class RunningPerformance(object):
+    """
+    Same figures as Strategy.calculate_performance(), accumulated from the strategy returns of consecutive chunks
+    without keeping them
+    """
+
+    def __init__(self):
+        self.first_date = None
+        self.last_date = None
+        self.cumulative_return = 1.0
+        self.count = 0
+        self.total = 0.0
+        self.downside_count = 0
+        self.downside_total = 0.0
+        self.downside_squares = 0.0
+
+    def add(self, strategy_returns: pd.Series) -> None:
+        if strategy_returns.empty:
+            return
+        if self.first_date is None:
+            self.first_date = strategy_returns.index[0]
+        self.last_date = strategy_returns.index[-1]
+
+        returns = strategy_returns.to_numpy(dtype=np.float64)
+        returns = returns[~np.isnan(returns)]
+        downside = returns[returns < 0]
+        self.cumulative_return *= float(np.prod(1 + returns))
+        self.count += len(returns)
+        self.total += float(returns.sum())
+        self.downside_count += len(downside)
+        self.downside_total += float(downside.sum())
+        self.downside_squares += float(np.square(downside).sum())
+
+    def result(self) -> Dict:
+        if self.count == 0:
+            return {'CAGR': np.nan, 'Sortino Ratio': np.nan, 'Final Portfolio Value': np.nan}
+
+        years = (self.last_date - self.first_date).days / 365.25
+        cagr = self.cumulative_return ** (1 / years) - 1 if years > 0 else np.nan
+        downside_deviation = np.nan
+        if self.downside_count > 1:
+            downside_mean = self.downside_total / self.downside_count
+            variance = (self.downside_squares - self.downside_count * downside_mean ** 2) / (self.downside_count - 1)
+            downside_deviation = np.sqrt(max(variance, 0.0))
+
+        return {
+            'CAGR': cagr,
+            'Sortino Ratio': (self.total / self.count) / downside_deviation,
+            'Final Portfolio Value': self.cumulative_return
+        }
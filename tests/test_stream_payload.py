@@ -0,0 +1,26 @@
+import json
+from decimal import Decimal
+from types import SimpleNamespace
+
+from webapp.live_snapshot import ORDER, order_state
+from webapp.stream_router import _to_payload
+
+
+def test_order_delta_is_json_serializable():
+    order = SimpleNamespace(id='6f1c', symbol='AAPL', side='buy', status='filled', filled_qty=Decimal('10'),
+                            filled_avg_price=Decimal('187.25'))
+
+    payload = json.loads(json.dumps(_to_payload({(ORDER, '6f1c'): order_state(order)})))
+
+    assert payload[ORDER]['6f1c']['filled_qty'] == 10.0
+    assert payload[ORDER]['6f1c']['filled_avg_price'] == 187.25
+
+
+def test_unfilled_order_keeps_nulls():
+    order = SimpleNamespace(id='6f1d', symbol='MSFT', side='sell', status='new', filled_qty=None,
+                            filled_avg_price=None)
+
+    payload = json.loads(json.dumps(_to_payload({(ORDER, '6f1d'): order_state(order)})))
+
+    assert payload[ORDER]['6f1d']['filled_qty'] is None
+    assert payload[ORDER]['6f1d']['filled_avg_price'] is None
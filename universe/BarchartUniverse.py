@@ -1,14 +1,16 @@
-import json
-import re
-from typing import List
+import concurrent.futures
+import threading
+import time
+from typing import List, Optional
+from urllib.parse import unquote
 
 import pandas as pd
 import requests
-from urllib.parse import unquote
-
 from kink import inject
 from pandas import DataFrame
+from requests.adapters import HTTPAdapter
 
+from core.logger import logger
 from universe.Universe import Universe
 
 BARCHART_URL = "https://www.barchart.com/stocks/top-100-stocks?orderBy=weightedAlpha&orderDir=desc"
@@ -17,7 +19,19 @@ API_URL = ('https://www.barchart.com/proxies/core-api/v1/quotes/get?'
            'Top100%2CpreviousRank%2ClastPrice%2CpriceChange%2CpercentChange%2ChighPrice1y%2ClowPrice1y%2Cperc'
            'entChange1y%2CtradeTime%2CsymbolCode%2ChasOptions%2CsymbolType&orderBy=weightedAlpha&orderDir=des'
            'c&meta=field.shortName%2Cfield.type%2Cfield.description%2Clists.lastUpdate&hasOptions=true'
-           '&page=1&limit=100&raw=1')
+           '&page={page}&limit={limit}&raw=1')
+
+PAGE_SIZE = 100
+DEFAULT_MAX_ROWS = 100
+MAX_PAGE_WORKERS = 4
+REQUEST_TIMEOUT_SECS = 30
+# Used when the session cookies don't carry an expiry
+TOKEN_TTL_SECS = 30 * 60
+STOCKS_CACHE_TTL_SECS = 15 * 60
+TOKEN_COOKIES = ['laravel_token', 'XSRF-TOKEN', 'laravel_session']
+FLOAT_COLUMNS = ['weightedAlpha', 'lastPrice', 'priceChange', 'percentChange', 'highPrice1y', 'lowPrice1y',
+                 'percentChange1y']
+INT_COLUMNS = ['currentRankUsTop100', 'previousRank']
 
 HEADERS = {
     'authority': 'www.barchart.com',
@@ -35,58 +49,108 @@ HEADERS = {
     'user-agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) '
                   'Chrome/119.0.0.0 Safari/537.36 Edg/119.0.0.0',
 }
-# Define a pattern for extracting key-value pairs
-PATTERN_MATCHER = r'(?P<key>[\w-]+)=(?P<value>[^;,]+)'
+API_HEADERS = {
+    'authority': 'www.barchart.com',
+    'accept': 'application/json',
+    'accept-language': 'en-US,en;q=0.9',
+    'referer': BARCHART_URL,
+    'sec-ch-ua': '"Microsoft Edge";v="119", "Chromium";v="119", "Not?A_Brand";v="24"',
+    'sec-ch-ua-mobile': '?0',
+    'sec-ch-ua-platform': '"macOS"',
+    'sec-fetch-dest': 'empty',
+    'sec-fetch-mode': 'cors',
+    'sec-fetch-site': 'same-origin',
+    'user-agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) '
+                  'Chrome/119.0.0.0 Safari/537.36 Edg/119.0.0.0',
+}
 
 
 @inject
 class BarchartUniverse(Universe):
+    """
+    Reuses one keep-alive session for every Barchart request. The cookies / XSRF token harvested from the
+    top-100 page are kept until they expire, so the HTML page is only downloaded once per session instead of
+    once per API call. Results are cached as a typed DataFrame for STOCKS_CACHE_TTL_SECS.
+    """
 
     def __init__(self):
-        self.cookie_dict = {}
-
-    def make_request(self):
-        response = requests.get(BARCHART_URL, headers=HEADERS)
-        response_headers = response.headers
-
-        cookie_string = response_headers.get("Set-Cookie", "")
-        matches = re.findall(PATTERN_MATCHER, cookie_string)
-        self.cookie_dict = dict(matches)
-        return self.cookie_dict
-
-    def make_api_request(self):
-        self.make_request()
-        headers = {
-            'authority': 'www.barchart.com',
-            'accept': 'application/json',
-            'accept-language': 'en-US,en;q=0.9',
-            'cookie': f'laravel_token={self.cookie_dict.get("laravel_token")}; '
-                      f'XSRF-TOKEN={self.cookie_dict.get("XSRF-TOKEN")}; '
-                      f'laravel_session={self.cookie_dict.get("laravel_session")}; '
-                      f'market={self.cookie_dict.get("market")};',
-            'referer': 'https://www.barchart.com/stocks/top-100-stocks?orderBy=weightedAlpha&orderDir=desc',
-            'sec-ch-ua': '"Microsoft Edge";v="119", "Chromium";v="119", "Not?A_Brand";v="24"',
-            'sec-ch-ua-mobile': '?0',
-            'sec-ch-ua-platform': '"macOS"',
-            'sec-fetch-dest': 'empty',
-            'sec-fetch-mode': 'cors',
-            'sec-fetch-site': 'same-origin',
-            'user-agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) '
-                          'Chrome/119.0.0.0 Safari/537.36 Edg/119.0.0.0',
-            'x-xsrf-token': unquote(self.cookie_dict.get("XSRF-TOKEN"))
-        }
-
-        response = requests.get(API_URL, headers=headers)
-        return json.loads(response.text)
+        self.session = requests.Session()
+        self.session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=MAX_PAGE_WORKERS))
+        self._lock = threading.Lock()
+        self._tokens_expire_at: float = 0
+        self._stocks_df: Optional[DataFrame] = None
+        self._stocks_max_rows: int = 0
+        self._stocks_fetched_at: float = 0
+
+    def refresh_tokens(self) -> None:
+        self.session.cookies.clear()
+        response = self.session.get(BARCHART_URL, headers=HEADERS, timeout=REQUEST_TIMEOUT_SECS)
+        response.raise_for_status()
+
+        expiries = [cookie.expires for cookie in self.session.cookies
+                    if cookie.name in TOKEN_COOKIES and cookie.expires]
+        self._tokens_expire_at = min(expiries + [time.time() + TOKEN_TTL_SECS])
+        logger.info(f"Barchart tokens refreshed, valid for {self._tokens_expire_at - time.time():.0f} seconds")
+
+    def _ensure_tokens(self) -> None:
+        with self._lock:
+            if time.time() >= self._tokens_expire_at or not self.session.cookies.get('XSRF-TOKEN'):
+                self.refresh_tokens()
+
+    def make_api_request(self, page: int = 1, limit: int = PAGE_SIZE) -> dict:
+        self._ensure_tokens()
+        for attempt in (1, 2):
+            headers = dict(API_HEADERS, **{'x-xsrf-token': unquote(self.session.cookies.get('XSRF-TOKEN', ''))})
+            response = self.session.get(API_URL.format(page=page, limit=limit), headers=headers,
+                                        timeout=REQUEST_TIMEOUT_SECS)
+            # Barchart answers 401 / 419 once the session expires ahead of the cookie expiry
+            if response.status_code in (401, 403, 419) and attempt == 1:
+                with self._lock:
+                    self.refresh_tokens()
+                continue
+            response.raise_for_status()
+            return response.json()
+
+    def fetch_rows(self, max_rows: int = DEFAULT_MAX_ROWS) -> List[dict]:
+        first_page = self.make_api_request(1, min(PAGE_SIZE, max_rows))
+        rows = [row['raw'] for row in first_page.get('data', [])]
+
+        total = min(int(first_page.get('total') or len(rows)), max_rows)
+        page_count = -(-total // PAGE_SIZE)
+        if page_count > 1:
+            # The remaining pages only depend on the page number, fetch them in parallel
+            with concurrent.futures.ThreadPoolExecutor(max_workers=MAX_PAGE_WORKERS) as executor:
+                for page in executor.map(self.make_api_request, range(2, page_count + 1)):
+                    rows.extend(row['raw'] for row in page.get('data', []))
+        return rows[:max_rows]
+
+    def invalidate(self) -> None:
+        self._stocks_df = None
 
     def get_stocks_df(self, params=None) -> DataFrame:
-        json_data = self.make_api_request()
-        stocks_data = []
-        for row in json_data['data']:
-            stocks_data.append(row['raw'])
-        df = pd.DataFrame(stocks_data)
-        return df
+        max_rows = (params or {}).get('max_rows', DEFAULT_MAX_ROWS)
+        is_fresh = time.time() - self._stocks_fetched_at < STOCKS_CACHE_TTL_SECS
+        if self._stocks_df is None or not is_fresh or self._stocks_max_rows < max_rows:
+            self._stocks_df = self._to_typed_df(self.fetch_rows(max_rows))
+            self._stocks_max_rows = max_rows
+            self._stocks_fetched_at = time.time()
+        return self._stocks_df.head(max_rows).copy()
 
     def get_stocks(self, params=None) -> List[str]:
-        json_data = self.make_api_request()
-        return [item['symbol'] for item in json_data['data']]
+        return self.get_stocks_df(params)['symbol'].tolist()
+
+    @staticmethod
+    def _to_typed_df(rows: List[dict]) -> DataFrame:
+        df = pd.DataFrame(rows)
+        if df.empty:
+            return pd.DataFrame(columns=['symbol'] + FLOAT_COLUMNS + INT_COLUMNS)
+
+        for col in FLOAT_COLUMNS:
+            if col in df.columns:
+                df[col] = pd.to_numeric(df[col], errors='coerce').astype('float64')
+        for col in INT_COLUMNS:
+            if col in df.columns:
+                df[col] = pd.to_numeric(df[col], errors='coerce').astype('Int64')
+        if 'tradeTime' in df.columns:
+            df['tradeTime'] = pd.to_datetime(df['tradeTime'], unit='s', errors='coerce')
+        return df
@@ -1,16 +1,20 @@
 import time
 from enum import Enum
-from random import randint
 from typing import List
 from urllib.parse import urlparse
 
 import requests
 from kink import inject
-from requests import ConnectTimeout, HTTPError, ReadTimeout, Timeout
+from pandas import DataFrame
+from requests import ConnectTimeout, ConnectionError, HTTPError, ReadTimeout, Timeout
 
 from core.logger import logger
 from universe.Universe import Universe
 
+RETRY_COUNT = 3
+RETRY_BACKOFF_SECS = 2
+REQUEST_TIMEOUT_SECS = 30
+
 
 class StockType(Enum):
     MEGA = "mega"
@@ -37,7 +41,17 @@ class NasdaqUniverse(Universe):
         self.stock_types = stock_types
         self.reco_types = reco_types
 
-    def get_stocks(self, params=None):
+    def get_stocks(self, params=None) -> List[str]:
+        rows = self._fetch_rows()
+        return [row['symbol'].strip() for row in rows if row.get('symbol')]
+
+    def get_stocks_df(self, params=None) -> DataFrame:
+        df = DataFrame(self._fetch_rows())
+        if not df.empty:
+            df['symbol'] = df['symbol'].str.strip()
+        return df
+
+    def _fetch_rows(self) -> List[dict]:
         no_of_stocks = 4000
         stocks_type = [s_type.value for s_type in self.stock_types]
         recommendation_type = [r_type.value for r_type in self.reco_types]
@@ -48,8 +62,6 @@ class NasdaqUniverse(Universe):
                                    ])
         # api used by https://www.nasdaq.com/market-activity/stocks/screener
         parsed_uri = urlparse(nasdaq_api_url)
-        # stagger requests to avoid connection issues to nasdaq.com
-        time.sleep(randint(1, 3))
         headers = {
             'authority': parsed_uri.netloc,
             'method': 'GET',
@@ -68,12 +80,15 @@ class NasdaqUniverse(Universe):
             'user-agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_14_6) AppleWebKit/537.36 '
                           '(KHTML, like Gecko) Chrome/80.0.3987.149 Safari/537.36'
         }
-        try:
-            return requests.get(nasdaq_api_url, headers=headers).json()
-        except (ConnectTimeout, HTTPError, ReadTimeout, Timeout, ConnectionError) as e:
-            logger.warning('NASDAQ CONNECTION ERROR: {}'.format(e))
-            time.sleep(randint(2, 5))
-            self.get_stocks()
-
-    def get_stocks_df(self, params=None):
-        raise NotImplementedError("This function is not implemented yet")
\ No newline at end of file
+        for attempt in range(1, RETRY_COUNT + 1):
+            try:
+                response = requests.get(nasdaq_api_url, headers=headers, timeout=REQUEST_TIMEOUT_SECS)
+                response.raise_for_status()
+                data = response.json().get('data') or {}
+                # tableonly=true nests the rows under 'table'
+                return (data.get('table') or data).get('rows') or []
+            except (ConnectTimeout, HTTPError, ReadTimeout, Timeout, ConnectionError, ValueError) as e:
+                logger.warning(f'NASDAQ CONNECTION ERROR (attempt {attempt}/{RETRY_COUNT}): {e}')
+                if attempt < RETRY_COUNT:
+                    time.sleep(RETRY_BACKOFF_SECS * attempt)
+        return []
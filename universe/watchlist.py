@@ -1,23 +1,138 @@
+import concurrent.futures
+import threading
+import time
+from datetime import date, datetime
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import pandas as pd
+import pytz
 from kink import inject, di
+from pandas import DataFrame
 
 from core.logger import logger
 from services.data_service import DataService
 
+MARKET_TIMEZONE = pytz.timezone('America/New_York')
+MAX_SOURCE_WORKERS = 4
+# A universe built while a source was failing is only reused this long, then the sources are asked again
+FAILED_SOURCE_RETRY_SECS = 5 * 60
+METADATA_COLUMNS = ['companyName', 'sector', 'industry', 'exchangeShortName', 'marketCap', 'beta', 'price',
+                    'volume', 'isEtf']
+
+# Names of the universe sources
+HIGH_VOL_ETFS = 'high_vol_etfs'
+HIGH_VOL_STOCKS = 'high_vol_stocks'
+SCREENER = 'screener'
+
 
 @inject
 class WatchList(object):
+    """
+    Builds the trading universe once per trading day. The screener results and the merged universe are cached
+    per set of screener params until the trading day rolls over or `invalidate()` is called, so every strategy
+    resolving `di[WatchList]` shares the same results. A universe missing a failed source is only cached for
+    FAILED_SOURCE_RETRY_SECS.
+    """
 
     def __init__(self):
         self.data_service: DataService = di[DataService]
+        self._lock = threading.RLock()
+        self._trading_day: Optional[date] = None
+        self._universe_cache: Dict[Tuple, List[str]] = {}
+        self._screener_cache: Dict[Tuple, DataFrame] = {}
+        # params -> time.monotonic() after which a universe built with a failed source is built again
+        self._retry_at: Dict[Tuple, float] = {}
+
+    def get_universe(self, market_cap_gt: int = None, beta_gt=0.5, price_gt=20, price_lt=1000,
+                     volume_gt=None) -> list[str]:
+        params = (market_cap_gt, beta_gt, price_gt, price_lt, volume_gt)
+        with self._lock:
+            self._roll_trading_day()
+            if params in self._universe_cache and time.monotonic() < self._retry_at.get(params, float('inf')):
+                return list(self._universe_cache[params])
+
+            sources: Dict[str, Callable[[], Iterable[str]]] = {
+                SCREENER: lambda: self._screen(params)['symbol'].tolist(),
+                HIGH_VOL_ETFS: get_high_vol_etfs,
+                HIGH_VOL_STOCKS: get_high_vol_stocks,
+            }
+            symbols_by_source, failed = self._fetch_sources(sources)
+
+            all_stocks = set().union(*symbols_by_source.values())
+            self._universe_cache[params] = sorted(all_stocks)
+            if failed:
+                self._retry_at[params] = time.monotonic() + FAILED_SOURCE_RETRY_SECS
+                logger.warning(f"Universe built without {failed}, the sources are asked again in "
+                               f"{FAILED_SOURCE_RETRY_SECS}s")
+            else:
+                self._retry_at.pop(params, None)
+            logger.info(f"Universe for {self._trading_day}: {len(all_stocks)} symbols "
+                        f"({', '.join(f'{name}: {len(syms)}' for name, syms in symbols_by_source.items())})")
+            return list(self._universe_cache[params])
+
+    '''
+    Symbol -> metadata (company, sector, market cap, beta, ...) of every symbol screened today, so later stages
+    don't need to query the screener again. Symbols only known from the static lists have empty metadata.
+    '''
+    def get_metadata(self, symbols: List[str] = None) -> DataFrame:
+        with self._lock:
+            self._roll_trading_day()
+            frames = [df for df in self._screener_cache.values() if not df.empty]
+            universe = set().union(*self._universe_cache.values()) if self._universe_cache else set()
+
+        if frames:
+            metadata = pd.concat(frames).drop_duplicates(subset='symbol', keep='last').set_index('symbol')
+            metadata = metadata[[col for col in METADATA_COLUMNS if col in metadata.columns]]
+        else:
+            metadata = DataFrame(columns=METADATA_COLUMNS, index=pd.Index([], name='symbol'))
+
+        index = sorted(universe.union(metadata.index)) if symbols is None else list(dict.fromkeys(symbols))
+        return metadata.reindex(index)
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._universe_cache.clear()
+            self._screener_cache.clear()
+            self._retry_at.clear()
+            logger.info("Watchlist cache invalidated")
+
+    def _roll_trading_day(self) -> None:
+        today = datetime.now(MARKET_TIMEZONE).date()
+        if self._trading_day != today:
+            self._universe_cache.clear()
+            self._screener_cache.clear()
+            self._retry_at.clear()
+            self._trading_day = today
+
+    def _screen(self, params: Tuple) -> DataFrame:
+        if params not in self._screener_cache:
+            market_cap_gt, beta_gt, price_gt, price_lt, volume_gt = params
+            screened = self.data_service.screen_stocks(market_cap_gt=market_cap_gt, beta_gt=beta_gt,
+                                                       price_gt=price_gt, price_lt=price_lt, volume_gt=volume_gt)
+            if not isinstance(screened, DataFrame) or 'symbol' not in screened.columns:
+                # Not cached, the next universe build asks the screener again
+                raise ValueError(f"Unexpected screener response: {type(screened).__name__}")
+            self._screener_cache[params] = screened
+        return self._screener_cache[params]
 
-    def get_universe(self, market_cap_gt: int, beta_gt=0.5, price_gt=20, price_lt=1000, volume_gt=None) -> list[str]:
-        all_stocks_df = self.data_service.screen_stocks(market_cap_gt=market_cap_gt, beta_gt=beta_gt,
-                                                        price_gt=price_gt, price_lt=price_lt, volume_gt=volume_gt)
-        all_stocks = all_stocks_df['symbol'].tolist()
-        all_stocks.extend(get_high_vol_etfs())
-        all_stocks.extend(get_high_vol_stocks())
-        logger.info(f"All stocks: {all_stocks}")
-        return sorted(list(set(all_stocks)))
+    '''
+    Symbols of every source, and the names of the sources that failed (they have no symbols)
+    '''
+    @staticmethod
+    def _fetch_sources(sources: Dict[str, Callable[[], Iterable[str]]]) -> Tuple[Dict[str, set], List[str]]:
+        results: Dict[str, set] = {}
+        failed: List[str] = []
+        with concurrent.futures.ThreadPoolExecutor(max_workers=MAX_SOURCE_WORKERS) as executor:
+            future_to_source = {executor.submit(fetch): name for name, fetch in sources.items()}
+            for future in concurrent.futures.as_completed(future_to_source):
+                name = future_to_source[future]
+                try:
+                    results[name] = set(future.result())
+                except Exception as ex:
+                    logger.warning(f"Universe source {name} failed: {ex}")
+                    results[name] = set()
+                    failed.append(name)
+        return results, failed
 
 
 def get_high_vol_etfs() -> list[str]:
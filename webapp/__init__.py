@@ -1,6 +1,7 @@
-from typing import Any
+from typing import Any, Callable, Optional
 
 import peewee
+from anyio import CapacityLimiter, to_thread
 from pydantic.utils import GetterDict
 
 
@@ -10,3 +11,24 @@ class PeeweeGetterDict(GetterDict):
         if isinstance(res, peewee.ModelSelect):
             return list(res)
         return res
+
+
+# Shared by every route, so slow broker / DB calls can't use up the threads of the other routes
+BLOCKING_IO_THREADS = 16
+_blocking_io_limiter: Optional[CapacityLimiter] = None
+
+
+async def run_blocking(func: Callable, *args, **kwargs) -> Any:
+    """
+    Runs a blocking (peewee / Alpaca REST) call in the bounded worker pool instead of on the event loop.
+    Peewee queries are materialized in the worker, so serializing the response doesn't hit the DB again.
+    """
+    global _blocking_io_limiter
+    if _blocking_io_limiter is None:
+        _blocking_io_limiter = CapacityLimiter(BLOCKING_IO_THREADS)
+
+    def call():
+        result = func(*args, **kwargs)
+        return list(result) if isinstance(result, peewee.ModelSelect) else result
+
+    return await to_thread.run_sync(call, limiter=_blocking_io_limiter)
@@ -0,0 +1,138 @@
+import asyncio
+from typing import Dict, List, Optional, Tuple
+
+from kink import inject, di
+
+from core.database import Database
+from core.db_tables import OrderEntity
+from core.logger import logger
+from services.order_service import OrderService
+from services.position_service import PositionService
+from webapp import run_blocking
+
+POLL_INTERVAL_SECS = 5
+POSITION = 'position'
+ORDER = 'order'
+SUMMARY = 'summary'
+
+# (kind, key) -> latest state, None once the position / order is gone
+Deltas = Dict[Tuple[str, str], Optional[dict]]
+
+
+class Subscriber(object):
+    """
+    Pending deltas of one stream client. A client that falls behind only receives the latest state of every
+    position / order once it catches up, instead of a backlog of every intermediate update.
+    """
+
+    def __init__(self):
+        self.pending: Deltas = {}
+        self.event = asyncio.Event()
+
+    def push(self, deltas: Deltas) -> None:
+        self.pending.update(deltas)
+        self.event.set()
+
+    async def next(self, timeout_secs: float) -> Deltas:
+        try:
+            await asyncio.wait_for(self.event.wait(), timeout_secs)
+        except asyncio.TimeoutError:
+            return {}
+        deltas, self.pending = self.pending, {}
+        self.event.clear()
+        return deltas
+
+
+@inject
+class LiveSnapshot(object):
+    """
+    One shared poller for every stream subscriber: positions are read from the broker (without the DB upsert
+    of `update_and_get_current_positions`) and today's orders are only re-read when the DB data version moved.
+    The poller runs on the event loop while at least one client is subscribed.
+    """
+
+    def __init__(self):
+        self.position_service: PositionService = di[PositionService]
+        self.order_service: OrderService = di[OrderService]
+        self.database: Database = di[Database]
+
+        self.state: Dict[Tuple[str, str], dict] = {}
+        self.version = 0
+        self._subscribers: List[Subscriber] = []
+        self._orders_version: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def subscribe(self) -> Subscriber:
+        subscriber = Subscriber()
+        self._subscribers.append(subscriber)
+        if self.state:
+            subscriber.push(dict(self.state))
+        # The first poll of a new task sends the full state to everyone subscribed
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber) -> None:
+        if subscriber in self._subscribers:
+            self._subscribers.remove(subscriber)
+        if not self._subscribers and self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self) -> None:
+        while self._subscribers:
+            try:
+                await self._poll_once()
+            except Exception as ex:
+                logger.warning(f"Live snapshot poll failed: {ex}")
+            await asyncio.sleep(POLL_INTERVAL_SECS)
+
+    async def _poll_once(self) -> None:
+        current: Dict[Tuple[str, str], dict] = {}
+
+        positions = await run_blocking(self.position_service.get_all_positions) or []
+        total_pl = 0.0
+        for pos in positions:
+            total_pl += float(pos.unrealized_pl)
+            current[(POSITION, pos.symbol)] = {
+                'symbol': pos.symbol,
+                'side': pos.side.value,
+                'qty': float(pos.qty),
+                'current_price': float(pos.current_price),
+                'market_value': float(pos.market_value),
+                'unrealized_pl': float(pos.unrealized_pl),
+                'unrealized_plpc': float(pos.unrealized_plpc),
+            }
+        current[(SUMMARY, 'pl')] = {'positions': len(positions), 'unrealized_pl': round(total_pl, 2)}
+
+        data_version = self.database.data_version(OrderEntity)
+        if data_version != self._orders_version:
+            for order in await run_blocking(self.order_service.get_all_todays_orders):
+                current[(ORDER, str(order.id))] = order_state(order)
+            self._orders_version = data_version
+        else:
+            current.update({key: value for key, value in self.state.items() if key[0] == ORDER})
+
+        deltas: Deltas = {key: value for key, value in current.items() if self.state.get(key) != value}
+        deltas.update({key: None for key in self.state if key not in current})
+        self.state = current
+
+        if deltas:
+            self.version += 1
+            for subscriber in self._subscribers:
+                subscriber.push(deltas)
+
+
+'''
+Stream state of an order row. The filled columns are DecimalFields, sent as floats so the deltas stay JSON
+serializable
+'''
+def order_state(order) -> dict:
+    return {
+        'id': str(order.id),
+        'symbol': order.symbol,
+        'side': order.side,
+        'status': order.status,
+        'filled_qty': float(order.filled_qty) if order.filled_qty is not None else None,
+        'filled_avg_price': float(order.filled_avg_price) if order.filled_avg_price is not None else None,
+    }
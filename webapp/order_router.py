@@ -1,12 +1,17 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
 from datetime import datetime, date
-from typing import List
+from typing import Any, Dict, List, Optional, Tuple
 
-from fastapi import APIRouter
-from kink import di
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
 from pydantic import BaseModel
 
+from core.db_tables import OrderEntity
+from core.lazy import lazy_di
 from services.order_service import OrderService
-from webapp import PeeweeGetterDict
+from webapp import PeeweeGetterDict, run_blocking
+from webapp.response_cache import ResponseCache, DB_TTL_SECS
 
 
 class OrderModel(BaseModel):
@@ -31,6 +36,7 @@ class OrderModel(BaseModel):
     # replaced_by: str
     extended_hours: bool
     status: str
+    strategy: Optional[str]
     # cancelled_at: datetime
     # expired_at: datetime
     # replaced_at: datetime
@@ -43,32 +49,81 @@ class OrderModel(BaseModel):
         getter_dict = PeeweeGetterDict
 
 
+class OrderPage(BaseModel):
+    orders: List[Dict[str, Any]]
+    next_cursor: Optional[str]
+
+
+ORDER_MODEL_FIELDS = list(OrderModel.__fields__)
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
 route = APIRouter(
     prefix="/order",
     tags=["order"]
 )
 
-order_service: OrderService = di[OrderService]
+order_service: OrderService = lazy_di(OrderService)
+response_cache: ResponseCache = lazy_di(ResponseCache)
 
 
 @route.get("/today/all", response_model=List[OrderModel], summary="All orders", description="Returns all orders")
-async def get_all_orders():
-    return order_service.get_all_todays_orders()
+async def get_all_orders(request: Request):
+    return await response_cache.respond(request, ('order', date.today()), DB_TTL_SECS,
+                                        lambda: render_orders(date.today()), (OrderEntity,))
 
 
 @route.get("/{for_date}/all", response_model=List[OrderModel], summary="All orders", description="Returns all orders")
-async def get_all_orders(for_date: str):
+async def get_all_orders(request: Request, for_date: str):
     dt: date = datetime.strptime(for_date, '%Y-%m-%d').date()
-    return order_service.get_all_orders(dt)
+    return await response_cache.respond(request, ('order', dt), DB_TTL_SECS,
+                                        lambda: render_orders(dt), (OrderEntity,))
+
+
+async def render_orders(for_date: date) -> JSONResponse:
+    # Only the columns of OrderModel are selected, and the rows are serialized without building model objects
+    rows = await run_blocking(order_service.get_all_order_rows, for_date, ORDER_MODEL_FIELDS)
+    return JSONResponse(jsonable_encoder(rows))
+
+
+@route.get("/page", response_model=OrderPage, summary="Orders by page",
+           description="Newest first. Pass `next_cursor` of a page as `cursor` to get the next one. "
+                       "`fields` is a comma separated list of the columns to return")
+async def get_orders_page(cursor: Optional[str] = None, limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                          fields: Optional[str] = None):
+    field_names = [name.strip() for name in fields.split(',') if name.strip()] if fields else None
+    try:
+        after = decode_cursor(cursor) if cursor else None
+        rows = await run_blocking(order_service.list_orders_page, after, limit + 1, field_names)
+    except ValueError as ex:
+        raise HTTPException(status_code=400, detail=str(ex))
+
+    # One extra row tells if there is a next page without a COUNT(*)
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = encode_cursor(rows[-1]['created_at'], rows[-1]['id']) if has_more else None
+    return JSONResponse(jsonable_encoder({'orders': rows, 'next_cursor': next_cursor}))
+
+
+def encode_cursor(created_at: datetime, order_id: str) -> str:
+    return urlsafe_b64encode(f"{created_at.isoformat()}|{order_id}".encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    try:
+        created_at, order_id = urlsafe_b64decode(cursor.encode()).decode().split('|', 1)
+        return datetime.fromisoformat(created_at), order_id
+    except Exception:
+        raise ValueError(f"Invalid cursor: {cursor}")
 
 
 @route.post("/update", response_model=List[OrderModel], summary="Update saved orders",
             description="Returns all updated orders")
 async def update_open_orders():
-    return order_service.update_all_open_orders()
+    return await run_blocking(order_service.update_all_open_orders)
 
 
 @route.post("/update/{order_id}", response_model=List[OrderModel], summary="Update saved order by id",
             description="Returns updated order")
 async def update_order(order_id: str):
-    return order_service.update_saved_order(order_id)
+    return await run_blocking(order_service.update_saved_order, order_id)
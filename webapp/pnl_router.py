@@ -0,0 +1,59 @@
+from datetime import datetime, date
+from typing import List
+
+from fastapi import APIRouter, Query
+from pydantic import BaseModel
+
+from core.lazy import lazy_di
+from services.trade_ledger_service import TradeLedgerService
+from webapp import PeeweeGetterDict, run_blocking
+
+
+class DailyPnlModel(BaseModel):
+    run_date: date
+    realized_pl: float
+    trade_count: int
+    win_count: int
+
+
+class SymbolPnlModel(BaseModel):
+    symbol: str
+    realized_pl: float
+    trade_count: int
+    win_count: int
+
+    class Config:
+        orm_mode = True
+        getter_dict = PeeweeGetterDict
+
+
+route = APIRouter(
+    prefix="/pnl",
+    tags=["pnl"]
+)
+
+trade_ledger: TradeLedgerService = lazy_di(TradeLedgerService)
+
+
+@route.get("/daily", response_model=List[DailyPnlModel], summary="Realized P/L per day",
+           description="Returns the realized P/L of the last trading days, newest first")
+async def get_daily_pnl(days: int = Query(30, ge=1, le=365)):
+    return await run_blocking(trade_ledger.get_daily_pnl_totals, days)
+
+
+@route.get("/daily/{for_date}", response_model=List[SymbolPnlModel], summary="Realized P/L of a day per symbol")
+async def get_daily_symbol_pnl(for_date: str):
+    dt: date = datetime.strptime(for_date, '%Y-%m-%d').date()
+    return await run_blocking(trade_ledger.get_daily_pnl, dt)
+
+
+@route.get("/symbol", response_model=List[SymbolPnlModel], summary="Realized P/L per symbol",
+           description="Returns the all time realized P/L of every traded symbol")
+async def get_symbol_pnl():
+    return await run_blocking(trade_ledger.get_symbol_pnl)
+
+
+@route.post("/rebuild", summary="Rebuild the trade ledger",
+            description="Replays all saved filled orders into the ledger. Returns the number of orders replayed")
+async def rebuild_ledger():
+    return {'orders': await run_blocking(trade_ledger.rebuild)}
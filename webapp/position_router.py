@@ -2,11 +2,12 @@ from datetime import datetime, date
 from typing import List
 
 from fastapi import APIRouter
-from kink import di
 from pydantic import BaseModel
 
+from core.lazy import lazy_di
 from services.position_service import PositionService
-from webapp import PeeweeGetterDict
+from services.quote_cache import QuoteCache
+from webapp import PeeweeGetterDict, run_blocking
 
 
 class PositionModel(BaseModel):
@@ -29,16 +30,23 @@ route = APIRouter(
     tags=["position"]
 )
 
-position_service = di[PositionService]
+position_service: PositionService = lazy_di(PositionService)
+quote_cache: QuoteCache = lazy_di(QuoteCache)
 
 
 @route.get("/", response_model=List[PositionModel],
            summary="List of positions",
            description="Returns all positions")
 async def get_all_positions():
-    return position_service.update_and_get_current_positions()
+    return await run_blocking(position_service.update_and_get_current_positions)
 
 
 @route.get("/id/{sym}", response_model=PositionModel, summary="Returns a single position")
 async def view(sym: str):
-    return position_service.get_position(sym)
+    return await run_blocking(position_service.get_position, sym)
+
+
+@route.get("/quotes/stats", summary="Quote cache counters",
+           description="Hits, misses and requests that joined another caller's in-flight fetch")
+async def get_quote_cache_stats():
+    return quote_cache.stats()
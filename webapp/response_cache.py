@@ -0,0 +1,80 @@
+import asyncio
+import hashlib
+import threading
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, Hashable, Tuple
+
+from cachetools import TTLCache
+from fastapi import Request, Response
+from kink import inject, di
+
+from core.database import Database
+
+# Live broker data (positions, P/L) is only reused for a few seconds
+LIVE_TTL_SECS = 15
+# Data only read from the DB stays valid until the data version changes
+DB_TTL_SECS = 5 * 60
+MAX_ENTRIES = 256
+# Render locks of keys not requested for this long are dropped, a later miss simply creates a new one
+RENDER_LOCK_TTL_SECS = DB_TTL_SECS
+
+
+@dataclass
+class CachedResponse:
+    body: bytes
+    media_type: str
+    etag: str
+
+
+@inject
+class ResponseCache(object):
+    """
+    Caches rendered responses per (key, data version of the tables the page is read from). A write to one of
+    those tables changes `Database.data_version(*tables)`, so it invalidates the page without explicit
+    bookkeeping, while writes to other tables (e.g. the position upserts of every poll) leave it cached.
+    Concurrent misses for the same key share a single render, so several dashboards cost one set of broker calls.
+    """
+
+    def __init__(self):
+        self.database: Database = di[Database]
+        self._caches: Dict[int, TTLCache] = {}
+        self._caches_lock = threading.Lock()
+        # Bounded and expiring like the caches, so keys such as past order dates do not pile up
+        self._render_locks: TTLCache = TTLCache(maxsize=MAX_ENTRIES, ttl=RENDER_LOCK_TTL_SECS)
+
+    async def respond(self, request: Request, key: Hashable, ttl_secs: int,
+                      render: Callable[[], Awaitable[Response]], tables: Tuple[type, ...] = ()) -> Response:
+        cache = self._get_cache(ttl_secs)
+        cache_key = (key, self.database.data_version(*tables))
+
+        cached: CachedResponse = cache.get(cache_key)
+        if cached is None:
+            lock = self._render_locks.setdefault(key, asyncio.Lock())
+            async with lock:
+                cached = cache.get(cache_key)
+                if cached is None:
+                    cached = self._to_cached(await render())
+                    cache[cache_key] = cached
+
+        headers = {'ETag': cached.etag, 'Cache-Control': 'private, max-age=0, must-revalidate'}
+        if cached.etag in _parse_if_none_match(request.headers.get('if-none-match')):
+            return Response(status_code=304, headers=headers)
+        return Response(content=cached.body, media_type=cached.media_type, headers=headers)
+
+    def _get_cache(self, ttl_secs: int) -> TTLCache:
+        with self._caches_lock:
+            if ttl_secs not in self._caches:
+                self._caches[ttl_secs] = TTLCache(maxsize=MAX_ENTRIES, ttl=ttl_secs)
+            return self._caches[ttl_secs]
+
+    @staticmethod
+    def _to_cached(response: Response) -> CachedResponse:
+        # The ETag only depends on the content, so a re-render with the same data still matches
+        etag = f'"{hashlib.sha1(response.body).hexdigest()}"'
+        return CachedResponse(response.body, response.media_type, etag)
+
+
+def _parse_if_none_match(header: str) -> set:
+    if not header:
+        return set()
+    return {tag.strip().removeprefix('W/') for tag in header.split(',')}
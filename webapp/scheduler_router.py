@@ -1,14 +1,22 @@
-from fastapi import APIRouter
-from kink import di
+import os
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import FileResponse
 
 from app_config import AppConfig
+from core.lazy import lazy_di
+from core.schedule import list_profiles, PROFILES_FOLDER
+from webapp import run_blocking
+
+MAX_PROFILED_RUNS = 20
 
 route = APIRouter(
     prefix="/scheduler",
     tags=["scheduler"]
 )
 
-app_config = di[AppConfig]
+app_config: AppConfig = lazy_di(AppConfig)
 
 
 @route.get("/all", summary="Get all schedules", description="Get all schedules")
@@ -18,11 +26,43 @@ async def get_all_schedules():
 
 @route.post("/cancel", summary="Cancel running schedule", description="Cancel running schedule")
 async def cancel_running_schedule():
-    app_config.cancel()
+    await run_blocking(app_config.cancel)
     return {"status": "cancelled"}
 
 
 @route.post("/restart", summary="Restart running schedule", description="Restart running schedule")
 async def restart_running_schedule():
-    app_config.restart()
+    await run_blocking(app_config.restart)
     return {"status": "restarted"}
+
+
+@route.get("/profile", summary="Profiling state and recent profiles",
+           description="Jobs that can be profiled, runs still to profile per job, and the saved .pstats files")
+async def get_profiles():
+    return {"jobs": app_config.schedule.job_names(),
+            "pending": app_config.schedule.pending_profiles(),
+            "profiles": await run_blocking(list_profiles)}
+
+
+@route.post("/profile", summary="Profile the next runs of a job",
+            description="Runs the next `runs` executions of the job under cProfile. The stats can be read with "
+                        "pstats, snakeviz or flameprof")
+async def profile_job(job: str, runs: int = Query(1, ge=1, le=MAX_PROFILED_RUNS)):
+    try:
+        return {"pending": app_config.schedule.profile_next(job, runs)}
+    except ValueError as ex:
+        raise HTTPException(status_code=404, detail=str(ex))
+
+
+@route.delete("/profile", summary="Stop profiling", description="Stops profiling the job, or every job")
+async def cancel_profiling(job: Optional[str] = None):
+    return {"pending": app_config.schedule.cancel_profiling(job)}
+
+
+@route.get("/profile/{file_name}", summary="Download a profile", response_class=FileResponse)
+async def download_profile(file_name: str):
+    # Only files of the listing can be downloaded, not arbitrary paths
+    if file_name not in {profile['name'] for profile in await run_blocking(list_profiles)}:
+        raise HTTPException(status_code=404, detail=f"No profile named {file_name}")
+    return FileResponse(os.path.join(PROFILES_FOLDER, file_name), media_type="application/octet-stream",
+                        filename=file_name)
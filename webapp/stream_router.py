@@ -0,0 +1,45 @@
+import json
+from typing import Dict
+
+from fastapi import APIRouter, Request
+from fastapi.responses import StreamingResponse
+
+from core.lazy import lazy_di
+from webapp.live_snapshot import LiveSnapshot, Deltas
+
+# A comment line keeps proxies from closing an idle stream
+KEEP_ALIVE_SECS = 15
+
+route = APIRouter(
+    prefix="/stream",
+    tags=["stream"]
+)
+
+live_snapshot: LiveSnapshot = lazy_di(LiveSnapshot)
+
+
+@route.get("/live", summary="Stream positions, P/L and orders",
+           description="Server-Sent Events: a full snapshot first, then only the changed positions / orders")
+async def stream_live(request: Request):
+    return StreamingResponse(_events(request), media_type="text/event-stream",
+                             headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+async def _events(request: Request):
+    subscriber = live_snapshot.subscribe()
+    try:
+        while not await request.is_disconnected():
+            deltas = await subscriber.next(KEEP_ALIVE_SECS)
+            if deltas:
+                yield f"id: {live_snapshot.version}\nevent: delta\ndata: {json.dumps(_to_payload(deltas))}\n\n"
+            else:
+                yield ": keep-alive\n\n"
+    finally:
+        live_snapshot.unsubscribe(subscriber)
+
+
+def _to_payload(deltas: Deltas) -> Dict[str, Dict]:
+    payload: Dict[str, Dict] = {}
+    for (kind, key), value in deltas.items():
+        payload.setdefault(kind, {})[key] = value
+    return payload
@@ -1,15 +1,21 @@
+import asyncio
 from datetime import date
 from random import choice
 from typing import List
 
 from fastapi import Request, APIRouter
 from fastapi.responses import HTMLResponse
-from kink import di
 from starlette.templating import Jinja2Templates
 
+from core.database import LEDGER_ENTITIES
+from core.db_tables import AccountEntity, OrderEntity
+from core.lazy import lazy_di
 from services.account_service import AccountService
 from services.order_service import OrderService
 from services.position_service import PositionService, Position
+from services.trade_ledger_service import TradeLedgerService
+from webapp import run_blocking
+from webapp.response_cache import ResponseCache, LIVE_TTL_SECS
 
 templates = Jinja2Templates(directory="templates")
 
@@ -18,9 +24,11 @@ route = APIRouter(
     tags=["ui"]
 )
 
-position_service: PositionService = di[PositionService]
-account_service: AccountService = di[AccountService]
-order_service: OrderService = di[OrderService]
+position_service: PositionService = lazy_di(PositionService)
+account_service: AccountService = lazy_di(AccountService)
+order_service: OrderService = lazy_di(OrderService)
+trade_ledger: TradeLedgerService = lazy_di(TradeLedgerService)
+response_cache: ResponseCache = lazy_di(ResponseCache)
 
 colors = ['green', 'blue', 'orange', 'red', 'purple', 'yellow', 'olive', 'teal', 'violet', 'pink', 'grey']
 
@@ -61,59 +69,33 @@ def current_positions() -> []:
     return curr_positions
 
 
-def calculate_profit(records):
-    profit = 0
-    invested_amt = records[0]["filled_qty"] * records[0]["filled_price"]
-    for record in records:
-        if record["side"] == "buy":
-            profit = profit - (record["filled_qty"] * record["filled_price"])
-        else:
-            profit = profit + (record["filled_qty"] * record["filled_price"])
-
-    if abs(profit) / abs(invested_amt) < 0.5:
-        return round(profit, 2)
-    return 0
-
-
 def stocks_closed() -> []:
-    result = []
-    prev_sym = None
-    records = []
+    # Realized P/L is read from the trade ledger, the orders only list the fills of the day
+    trading_date = order_service.last_trading_date()
+    records_by_symbol = {}
     for order in order_service.get_all_filled_orders_today():
-        if prev_sym != order.symbol:
-            records = [{
-                "side": order.side,
-                "side_color": "green" if order.side == "buy" else "red",
-                "order_type": order.order_type,
-                "order_color": _get_order_type_color(order.order_type),
-                "filled_qty": order.filled_qty,
-                "limit_price": order.limit_price,
-                "filled_price": order.filled_avg_price,
-                "filled_at": order.filled_at
-            }]
-        else:
-            records.append({
-                "side": order.side,
-                "side_color": "green" if order.side == "buy" else "red",
-                "order_type": order.order_type,
-                "order_color": _get_order_type_color(order.order_type),
-                "filled_qty": order.filled_qty,
-                "limit_price": order.limit_price,
-                "filled_price": order.filled_avg_price,
-                "filled_at": order.filled_at
-            })
-            # result.pop()
+        records_by_symbol.setdefault(order.symbol, []).append({
+            "side": order.side,
+            "side_color": "green" if order.side == "buy" else "red",
+            "order_type": order.order_type,
+            "order_color": _get_order_type_color(order.order_type),
+            "filled_qty": order.filled_qty,
+            "limit_price": order.limit_price,
+            "filled_price": order.filled_avg_price,
+            "filled_at": order.filled_at
+        })
 
-        profit = calculate_profit(records)
+    result = []
+    for pnl in trade_ledger.get_daily_pnl(trading_date):
+        profit = round(float(pnl.realized_pl), 2)
         if profit != 0:
             result.append({
-                "symbol": order.symbol,
+                "symbol": pnl.symbol,
                 "color": choice(colors),
-                "records": records,
+                "records": records_by_symbol.get(pnl.symbol, []),
                 "pl_color": "green" if profit > 0 else "red",
                 "profit": profit
             })
-        prev_sym = order.symbol
     return result
 
 
@@ -132,12 +114,22 @@ def _get_order_type_color(order_type: str) -> str:
 
 @route.get("/index", response_class=HTMLResponse)
 async def index(request: Request):
+    # Positions come live from the broker, only the history and the closed positions are read from the DB
+    return await response_cache.respond(request, 'ui/index', LIVE_TTL_SECS, lambda: render_index(request),
+                                        (AccountEntity, OrderEntity, *LEDGER_ENTITIES))
+
+
+async def render_index(request: Request) -> HTMLResponse:
+    # The three sources are independent of each other, fetch them concurrently
+    positions, history, closed_positions = await asyncio.gather(run_blocking(current_positions),
+                                                                run_blocking(get_history),
+                                                                run_blocking(stocks_closed))
     return templates.TemplateResponse("index.html",
                                       {
                                           "request": request,
                                           "data": {
-                                              "current_positions": current_positions(),
-                                              "history": get_history(),
-                                              "closed_positions": stocks_closed()
+                                              "current_positions": positions,
+                                              "history": history,
+                                              "closed_positions": closed_positions
                                           }
                                       })